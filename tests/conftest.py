@@ -0,0 +1,17 @@
+import pytest
+
+from vcenter_operator.templates import env, vcenter_service_user_crd_loader
+
+
+@pytest.fixture
+def templates(request):
+    """Fixture to set the TEMPLATES of the test module as templates of the global environment,
+       and no service-user templates, restoring them afterwards
+    """
+    template_mapping = env.loaders[0].mapping
+    service_user_mapping = vcenter_service_user_crd_loader.mapping
+    env.loaders[0].mapping = dict(request.module.TEMPLATES)
+    vcenter_service_user_crd_loader.mapping = {}
+    yield env.loaders[0].mapping
+    env.loaders[0].mapping = template_mapping
+    vcenter_service_user_crd_loader.mapping = service_user_mapping
@@ -0,0 +1,103 @@
+import threading
+import time
+
+import pytest
+from kubernetes import client as k8s_client
+
+from vcenter_operator.limiter import MAX_RETRIES, AdaptiveLimiter
+
+
+def api_exception(status, retry_after=None):
+    e = k8s_client.rest.ApiException(status=status)
+    e.headers = {"Retry-After": retry_after} if retry_after is not None else {}
+    return e
+
+
+def test_limit_grows_on_success():
+    limiter = AdaptiveLimiter(4)
+
+    for _ in range(20):
+        assert limiter.call(lambda: "ok") == "ok"
+
+    assert limiter.limit == 4
+    assert limiter.in_flight == 0
+
+
+def test_limit_shrinks_on_slow_requests():
+    limiter = AdaptiveLimiter(8, latency_target=0)
+    limiter.limit = 8
+
+    limiter.call(lambda: time.sleep(0.001))
+
+    assert limiter.limit < 8
+
+
+def test_throttled_request_retried_after_retry_after():
+    limiter = AdaptiveLimiter(8)
+    limiter.limit = 8
+    responses = [api_exception(429, "0.05"), "ok"]
+
+    def request():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    start = time.monotonic()
+    assert limiter.call(request) == "ok"
+
+    assert time.monotonic() - start >= 0.05
+    assert limiter.limit < 8
+
+
+def test_retries_give_up():
+    limiter = AdaptiveLimiter(2)
+    calls = []
+
+    def request():
+        calls.append(1)
+        raise api_exception(503, "0")
+
+    with pytest.raises(k8s_client.rest.ApiException):
+        limiter.call(request)
+
+    assert len(calls) == MAX_RETRIES + 1
+    assert limiter.in_flight == 0
+
+
+def test_other_errors_not_retried():
+    limiter = AdaptiveLimiter(2)
+    calls = []
+
+    def request():
+        calls.append(1)
+        raise api_exception(500)
+
+    with pytest.raises(k8s_client.rest.ApiException):
+        limiter.call(request)
+
+    assert len(calls) == 1
+
+
+def test_concurrency_bounded_by_limit():
+    limiter = AdaptiveLimiter(2)
+    limiter.limit = 2
+    running = []
+    max_running = []
+    lock = threading.Lock()
+
+    def request():
+        with lock:
+            running.append(1)
+            max_running.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.pop()
+
+    threads = [threading.Thread(target=limiter.call, args=(request,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(max_running) <= 2
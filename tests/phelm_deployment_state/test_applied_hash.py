@@ -0,0 +1,97 @@
+import json
+from unittest.mock import MagicMock, patch
+
+from kubernetes import client as k8s_client
+
+from vcenter_operator.phelm import (
+    APPLIED_HASH_ANNOTATION,
+    MANAGED_BY,
+    MANAGED_BY_LABEL,
+    DeploymentState,
+    StoredItem,
+)
+
+NAMESPACE = "namespace"
+
+
+def item(kind, name, annotations=None):
+    metadata = {"name": name}
+    if annotations is not None:
+        metadata["annotations"] = annotations
+    return {"apiVersion": "v1", "kind": kind, "metadata": metadata}
+
+
+def state_with(*items):
+    state = DeploymentState()
+    for i in items:
+        state.items[(i["apiVersion"], i["kind"], i["metadata"]["name"], NAMESPACE)] = StoredItem.from_item(i)
+    return state
+
+
+@patch.object(DeploymentState, "_id_to_k8s", return_value=(MagicMock(), {"name": "a"}))
+def test_apply_sets_applied_hash(_):
+    state = state_with(item("ConfigMap", "a", {"existing": "annotation"}), item("Secret", "b", None))
+
+    with patch.object(DeploymentState, "_apply_item") as fn_apply:
+        state.apply()
+
+    applied = {call.args[2]["metadata"]["name"]: call.args[2] for call in fn_apply.call_args_list}
+    assert applied["a"]["metadata"]["annotations"] == {
+        "existing": "annotation",
+        APPLIED_HASH_ANNOTATION: state.items[("v1", "ConfigMap", "a", NAMESPACE)].digest,
+    }
+    assert applied["b"]["metadata"]["annotations"] == {
+        APPLIED_HASH_ANNOTATION: state.items[("v1", "Secret", "b", NAMESPACE)].digest,
+    }
+    assert applied["b"]["metadata"]["labels"] == {MANAGED_BY_LABEL: MANAGED_BY}
+
+
+def test_without_applied():
+    state = state_with(item("Secret", "unchanged"), item("Secret", "changed"), item("ConfigMap", "missing"),
+                       item("ConfigMap", "not-annotated"))
+    digest = state.items[("v1", "Secret", "unchanged", NAMESPACE)].digest
+    live = {
+        ("v1", "Secret", NAMESPACE): {"unchanged": digest, "changed": "old-digest"},
+        ("v1", "ConfigMap", NAMESPACE): {"not-annotated": None},
+    }
+
+    with patch.object(DeploymentState, "_list_applied_digests", side_effect=live.get):
+        unapplied = state.without_applied()
+
+    assert list(unapplied.items) == [
+        ("v1", "Secret", "changed", NAMESPACE),
+        ("v1", "ConfigMap", "missing", NAMESPACE),
+        ("v1", "ConfigMap", "not-annotated", NAMESPACE),
+    ]
+
+
+def test_without_applied_list_failure():
+    state = state_with(item("Secret", "a"))
+
+    with patch.object(DeploymentState, "_list_applied_digests",
+                      side_effect=k8s_client.rest.ApiException(status=403)):
+        unapplied = state.without_applied()
+
+    assert list(unapplied.items) == list(state.items)
+
+
+def test_list_applied_digests_metadata_only():
+    state = DeploymentState()
+    resource = MagicMock(namespaced=True)
+    labels = {MANAGED_BY_LABEL: MANAGED_BY}
+    response = MagicMock(data=json.dumps({"items": [
+        {"metadata": {"name": "a", "labels": labels, "annotations": {APPLIED_HASH_ANNOTATION: "digest"}}},
+        {"metadata": {"name": "b", "labels": labels}},
+        # Applied before we labelled the objects
+        {"metadata": {"name": "c", "annotations": {APPLIED_HASH_ANNOTATION: "digest"}}},
+    ]}).encode())
+
+    with patch.object(DeploymentState, "get_resource", return_value=resource), \
+            patch.object(DeploymentState, "get_client") as fn_client:
+        fn_client.return_value.get.return_value = response
+        digests = state._list_applied_digests(("v1", "ConfigMap", NAMESPACE))
+
+    assert digests == {"a": "digest", "b": None}
+    kwargs = fn_client.return_value.get.call_args.kwargs
+    assert kwargs["namespace"] == NAMESPACE
+    assert "PartialObjectMetadataList" in kwargs["header_params"]["Accept"]
@@ -0,0 +1,120 @@
+import threading
+from unittest.mock import MagicMock, patch
+
+from kubernetes import client as k8s_client
+
+from vcenter_operator.phelm import DeploymentState
+from vcenter_operator.pipeline import ApplyPipeline
+
+NAMESPACE = "namespace"
+
+
+def documents(version, names=("a", "b")):
+    return "\n---\n".join(
+        f"apiVersion: v1\nkind: {kind}\nmetadata:\n  name: {name}\ndata:\n  version: '{version}'\n"
+        for kind in ("Secret", "ConfigMap", "Deployment") for name in names)
+
+
+def resource_args(self, api_version, kind, name, namespace):
+    return MagicMock(kind=kind), {"name": name, "namespace": namespace}
+
+
+@patch.object(DeploymentState, "_id_to_k8s", resource_args)
+def test_applies_while_rendering():
+    applyset = MagicMock(id="applyset-x-v1")
+    last = DeploymentState(applyset=applyset)
+    last.add(documents(1), None, NAMESPACE)
+
+    applied = []
+    rendering = threading.Event()
+
+    def apply_item(resource, resource_args, new_item):
+        applied.append((new_item["kind"], new_item["metadata"]["name"], rendering.is_set()))
+        if new_item["metadata"]["name"] == "c" and rendering.is_set():
+            raise k8s_client.rest.ApiException(status=409)
+
+    state = DeploymentState(workers=2, applyset=applyset)
+    with patch.object(DeploymentState, "_apply_item", side_effect=apply_item):
+        pipeline = state.sink = ApplyPipeline(state, last)
+        rendering.set()
+        # The items b are unchanged
+        state.add(documents(1, ["b"]), None, NAMESPACE)
+        state.add(documents(2, ["a", "c"]), None, NAMESPACE)
+        pipeline.close()
+        rendering.clear()
+
+        assert sorted(applied) == [("ConfigMap", "a", True), ("ConfigMap", "c", True),
+                                   ("Secret", "a", True), ("Secret", "c", True)]
+        # The applyset records the kinds before their objects get applied
+        assert state.applyset.extend_ids.call_count == 4
+
+        delta = last.delta(state)
+        pipeline.remove_applied(delta)
+        # The ones which failed are applied again
+        assert sorted(delta.items) == [
+            ("v1", "ConfigMap", "c", NAMESPACE),
+            ("v1", "Deployment", "a", NAMESPACE),
+            ("v1", "Deployment", "c", NAMESPACE),
+            ("v1", "Secret", "c", NAMESPACE),
+        ]
+        assert delta.actions == {("v1", "Deployment", "a", NAMESPACE): "update"}
+
+        applied.clear()
+        delta.apply()
+        assert [kind for kind, _, _ in applied] == ["Secret", "ConfigMap", "Deployment", "Deployment"]
+
+
+def test_bounded_queue_blocks_rendering():
+    last = DeploymentState()
+    state = DeploymentState(workers=1)
+    release = threading.Event()
+
+    with patch.object(DeploymentState, "_apply_id", side_effect=lambda _id, stored: release.wait()):
+        pipeline = state.sink = ApplyPipeline(state, last, queue_size=1)
+        renderer = threading.Thread(target=state.add, args=(documents(1, ["a", "b", "c"]), None, NAMESPACE))
+        renderer.start()
+        renderer.join(0.2)
+        # One item being applied, one queued, the renderer waits with the third
+        assert renderer.is_alive()
+
+        release.set()
+        renderer.join()
+        pipeline.close()
+    assert len(pipeline.applied) == 6
+
+
+@patch.object(DeploymentState, "_id_to_k8s", resource_args)
+def test_config_maps_after_all_secrets():
+    applied = []
+    state = DeploymentState(workers=3)
+    with patch.object(DeploymentState, "_apply_item",
+                      side_effect=lambda resource, resource_args, new_item: applied.append(new_item["kind"])):
+        pipeline = state.sink = ApplyPipeline(state, DeploymentState())
+        for name in ("a", "b", "c"):
+            state.add(documents(1, [name]), None, NAMESPACE)
+        # Rendering is done, the ConfigMaps were held back
+        assert "ConfigMap" not in applied
+        pipeline.close()
+
+    assert applied == ["Secret"] * 3 + ["ConfigMap"] * 3
+
+
+@patch.object(DeploymentState, "_id_to_k8s", resource_args)
+def test_failed_render_records_applied_items():
+    last = DeploymentState()
+    last.add(documents(1), None, NAMESPACE)
+    applied = []
+
+    state = DeploymentState(workers=2)
+    with patch.object(DeploymentState, "_apply_item",
+                      side_effect=lambda resource, resource_args, new_item: applied.append(new_item["kind"])):
+        pipeline = state.sink = ApplyPipeline(state, last)
+        state.add(documents(2, ["a"]), None, NAMESPACE)
+        # e.g. a service-user template raising afterwards
+        pipeline.close(failed=True)
+
+    # The held back ConfigMap is dropped, the applied Secret is the baseline of the next run
+    assert applied == ["Secret"]
+    secret, config_map = ("v1", "Secret", "a", NAMESPACE), ("v1", "ConfigMap", "a", NAMESPACE)
+    assert last.items[secret] is state.items[secret]
+    assert last.items[config_map].digest != state.items[config_map].digest
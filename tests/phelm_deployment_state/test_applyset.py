@@ -0,0 +1,139 @@
+import json
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from vcenter_operator.applyset import (
+    APPLYSET_GROUP_KINDS_ANNOTATION,
+    APPLYSET_ID_LABEL,
+    APPLYSET_NAMESPACES_ANNOTATION,
+    ApplySet,
+)
+from vcenter_operator.phelm import APPLYSET_PART_OF_LABEL, TEMPLATE_LABEL, DeploymentState, StoredItem
+
+VCENTER = "vc-a-0.cc.region.cloud.sap"
+OWN_NAMESPACE = "monsoon3"
+TEMPLATES = {
+    "vcenter_cluster/namespace/good.yaml.j2": ("41", "apiVersion: v1\nkind: ConfigMap\nmetadata:\n  name: good\n",
+                                               {}, None),
+    "vcenter_cluster/namespace/broken.yaml.j2": ("42", "{{ undefined.attribute }}", {}, None),
+}
+
+
+def state_with(applyset, *ids):
+    state = DeploymentState(vcenter=VCENTER, applyset=applyset)
+    for api_version, kind, name, namespace in ids:
+        state.items[(api_version, kind, name, namespace)] = StoredItem.from_item({"kind": kind})
+    return state
+
+
+@pytest.fixture
+def client():
+    """Fixture to mock the dynamic client, serving the objects in `live` per (kind, namespace)"""
+    client = MagicMock()
+    client.live = {}
+    client.recorded = {}
+    # Name -> template label of the live objects
+    client.templates = {}
+
+    def get_resource(group, kind, preferred):
+        group_version = f"{group}/v1" if group else "v1"
+        return SimpleNamespace(kind=kind, group_version=group_version, namespaced=kind != "ClusterRole")
+
+    def get(resource, name=None, namespace=None, label_selector=None, **kwargs):
+        if name:
+            return SimpleNamespace(metadata=SimpleNamespace(annotations=client.recorded))
+        items = [{"metadata": {"name": name, "labels": {TEMPLATE_LABEL: client.templates.get(name)}}}
+                 for name in client.live.get((resource.kind, namespace), [])]
+        return SimpleNamespace(data=json.dumps({"items": items}).encode())
+
+    client.resources.get.side_effect = get_resource
+    client.get.side_effect = get
+    with patch.object(DeploymentState, "get_client", return_value=client), \
+            patch.object(DeploymentState, "get_resource"):
+        yield client
+
+
+def test_id_and_labels():
+    applyset = ApplySet(VCENTER, OWN_NAMESPACE)
+    assert applyset.id.startswith("applyset-")
+    assert applyset.id.endswith("-v1")
+    assert applyset.id == ApplySet(VCENTER, OWN_NAMESPACE).id
+
+    state = DeploymentState(applyset=applyset)
+    state.add("apiVersion: v1\nkind: Secret\nmetadata:\n  name: a\n", None, "namespace")
+    labels = state.items[("v1", "Secret", "a", "namespace")].load()["metadata"]["labels"]
+    assert labels[APPLYSET_PART_OF_LABEL] == applyset.id
+
+
+def test_extend_keeps_recorded(client):
+    applyset = ApplySet(VCENTER, OWN_NAMESPACE)
+    client.recorded = {APPLYSET_GROUP_KINDS_ANNOTATION: "ConfigMap", APPLYSET_NAMESPACES_ANNOTATION: "old"}
+
+    applyset.extend(state_with(applyset, ("apps/v1", "Deployment", "a", "namespace")))
+
+    parent = client.server_side_apply.call_args.args[1]
+    assert parent["metadata"]["labels"] == {APPLYSET_ID_LABEL: applyset.id}
+    assert parent["metadata"]["annotations"][APPLYSET_GROUP_KINDS_ANNOTATION] == "ConfigMap,Deployment.apps"
+    assert parent["metadata"]["annotations"][APPLYSET_NAMESPACES_ANNOTATION] == "namespace,old"
+
+    # Nothing new to record
+    applyset.extend(state_with(applyset, ("v1", "ConfigMap", "b", "old")))
+    assert client.server_side_apply.call_count == 1
+
+
+def test_prune(client):
+    applyset = ApplySet(VCENTER, OWN_NAMESPACE)
+    # Recorded before the restart, the templates for the ConfigMaps in "old" were removed since
+    client.recorded = {
+        APPLYSET_GROUP_KINDS_ANNOTATION: "ConfigMap,Deployment.apps,ClusterRole.rbac.authorization.k8s.io",
+        APPLYSET_NAMESPACES_ANNOTATION: "namespace,old",
+    }
+    client.live = {
+        ("Deployment", "namespace"): ["a", "gone"],
+        ("ConfigMap", "old"): ["orphan"],
+        ("ClusterRole", None): ["role", "old-role"],
+    }
+    state = state_with(applyset, ("apps/v1", "Deployment", "a", "namespace"),
+                       ("rbac.authorization.k8s.io/v1", "ClusterRole", "role", "namespace"))
+
+    with patch.object(DeploymentState, "apply", autospec=True) as fn_apply:
+        assert applyset.prune(state) == 3
+
+    pruned = fn_apply.call_args.args[0]
+    assert set(pruned.actions) == {
+        ("apps/v1", "Deployment", "gone", "namespace"),
+        ("v1", "ConfigMap", "orphan", "old"),
+        ("rbac.authorization.k8s.io/v1", "ClusterRole", "old-role", None),
+    }
+    assert not pruned.items
+
+    # Only the contents of the state are recorded after pruning
+    annotations = client.server_side_apply.call_args.args[1]["metadata"]["annotations"]
+    assert annotations[APPLYSET_GROUP_KINDS_ANNOTATION] == "ClusterRole.rbac.authorization.k8s.io,Deployment.apps"
+    assert annotations[APPLYSET_NAMESPACES_ANNOTATION] == "namespace"
+    # Cluster-scoped kinds are listed once
+    cluster_role_lists = [c for c in client.get.call_args_list if c.args[0].kind == "ClusterRole"]
+    assert len(cluster_role_lists) == 1
+
+
+def test_prune_keeps_objects_of_failed_templates(client, templates):
+    applyset = ApplySet(VCENTER, OWN_NAMESPACE)
+    client.recorded = {APPLYSET_GROUP_KINDS_ANNOTATION: "ConfigMap", APPLYSET_NAMESPACES_ANNOTATION: "namespace"}
+    client.live = {("ConfigMap", "namespace"): ["good", "broken"]}
+    client.templates = {"good": "vcenter_cluster.namespace.good.yaml.j2",
+                        "broken": "vcenter_cluster.namespace.broken.yaml.j2"}
+
+    state = DeploymentState(vcenter=VCENTER, applyset=applyset)
+    state.render("vcenter_cluster", {"name": "bb1"}, {}, {})
+
+    assert list(state.items) == [("v1", "ConfigMap", "good", "namespace")]
+    assert state.failed == {("vcenter_cluster/namespace/broken.yaml.j2", "vcenter_cluster")}
+
+    with patch.object(DeploymentState, "apply", autospec=True) as fn_apply:
+        assert applyset.prune(state) == 0
+    fn_apply.assert_not_called()
+    # The contents stay recorded for pruning the objects once the template renders again
+    annotations = client.server_side_apply.call_args.args[1]["metadata"]["annotations"]
+    assert annotations[APPLYSET_GROUP_KINDS_ANNOTATION] == "ConfigMap"
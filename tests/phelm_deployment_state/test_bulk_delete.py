@@ -0,0 +1,103 @@
+from unittest.mock import MagicMock, patch
+
+from vcenter_operator.phelm import (
+    DELETE_COLLECTION_THRESHOLD,
+    TEMPLATE_LABEL,
+    VCENTER_LABEL,
+    DeploymentState,
+    label_value,
+)
+
+NAMESPACE = "namespace"
+VCENTER = "vc-a-0.cc.region.cloud.sap"
+CONFIGMAP = """apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: {name}
+"""
+
+
+def render(templates):
+    state = DeploymentState(vcenter=VCENTER)
+    for template, names in templates.items():
+        state.add("\n---\n".join(CONFIGMAP.format(name=name) for name in names), None, NAMESPACE, template)
+    return state
+
+
+def names(prefix, count):
+    return [f"{prefix}-{i}" for i in range(count)]
+
+
+def test_label_value():
+    assert label_value("vcenter_cluster/monsoon3/neutron-agent.yaml.j2") == \
+        "vcenter_cluster.monsoon3.neutron-agent.yaml.j2"
+
+    long_value = label_value("vcenter_cluster/namespace/" + "x" * 100)
+    assert len(long_value) == 63
+    assert long_value != label_value("vcenter_cluster/namespace/" + "x" * 101)
+
+
+def test_rendered_items_are_labelled():
+    state = render({"vcenter_cluster/namespace/a.yaml.j2": ["a"]})
+    stored = state.items[("v1", "ConfigMap", "a", NAMESPACE)]
+
+    assert stored.template == "vcenter_cluster/namespace/a.yaml.j2"
+    assert stored.load()["metadata"]["labels"] == {
+        TEMPLATE_LABEL: "vcenter_cluster.namespace.a.yaml.j2",
+        VCENTER_LABEL: VCENTER,
+    }
+
+
+def test_delta_deletes_removed_template_in_bulk():
+    removed = names("removed", DELETE_COLLECTION_THRESHOLD)
+    few = names("few", DELETE_COLLECTION_THRESHOLD - 1)
+    shrunk = names("shrunk", DELETE_COLLECTION_THRESHOLD + 1)
+    last = render({"removed.yaml.j2": removed, "few.yaml.j2": few, "shrunk.yaml.j2": shrunk})
+    state = render({"shrunk.yaml.j2": shrunk[:1]})
+
+    delta = last.delta(state)
+
+    assert delta.delete_collections == [("v1", "ConfigMap", NAMESPACE, "removed.yaml.j2")]
+    # Too few items or the template is still rendering others
+    assert sorted(_id[2] for _id in delta.actions) == sorted(few + shrunk[1:])
+
+
+def test_delta_keeps_items_of_failed_templates():
+    broken = names("broken", DELETE_COLLECTION_THRESHOLD + 2)
+    last = render({"vcenter_cluster/namespace/broken.yaml.j2": broken, "removed.yaml.j2": ["removed"]})
+    state = render({})
+    state.failed.add(("vcenter_cluster/namespace/broken.yaml.j2", "vcenter_cluster"))
+
+    delta = last.delta(state)
+
+    # Only the items of the template which rendered without them are deleted
+    assert delta.delete_collections == []
+    assert delta.actions == {("v1", "ConfigMap", "removed", NAMESPACE): "delete"}
+
+
+def test_delta_without_vcenter_deletes_one_by_one():
+    last = render({"removed.yaml.j2": names("removed", DELETE_COLLECTION_THRESHOLD)})
+    last.vcenter = None
+
+    delta = last.delta(DeploymentState())
+
+    assert delta.delete_collections == []
+    assert len(delta.actions) == DELETE_COLLECTION_THRESHOLD
+
+
+def test_apply_deletes_collection():
+    state = DeploymentState(vcenter=VCENTER, dry_run=True)
+    state.delete_collections.append(("v1", "ConfigMap", NAMESPACE, "vcenter_cluster/namespace/a.yaml.j2"))
+
+    with patch.object(DeploymentState, "get_resource", return_value=MagicMock(namespaced=True)), \
+            patch.object(DeploymentState, "get_client") as fn_client:
+        state.apply()
+
+    kwargs = fn_client.return_value.delete.call_args.kwargs
+    assert kwargs["namespace"] == NAMESPACE
+    assert kwargs["dry_run"] == "All"
+    assert kwargs["label_selector"] == (
+        "app.kubernetes.io/managed-by=vcenter-operator,"
+        f"{TEMPLATE_LABEL}=vcenter_cluster.namespace.a.yaml.j2,"
+        f"{VCENTER_LABEL}={VCENTER}"
+    )
@@ -0,0 +1,79 @@
+import datetime
+
+import pytest
+
+from vcenter_operator.phelm import DeploymentState, StoredItem
+
+CONFIGMAP = """apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: {name}
+data:
+  value: "{value}"
+"""
+SECRET = """apiVersion: v1
+kind: Secret
+metadata:
+  name: {name}
+data:
+  value: {value}
+"""
+
+
+def render(*documents, compress=False):
+    state = DeploymentState(compress=compress)
+    state.add("\n---\n".join(documents), None, "namespace")
+    return state
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_stored_item_roundtrip(compress):
+    item = {"kind": "ConfigMap", "metadata": {"name": "a"}, "data": {"key": "x" * 1000}}
+    stored = StoredItem.from_item(item, compress=compress)
+
+    assert stored.load() == item
+    assert stored.compressed == compress
+    if compress:
+        assert len(stored.payload) < 1000
+
+
+def test_stored_item_digest_is_canonical():
+    a = StoredItem.from_item({"b": 1, "a": {"y": 2, "x": 1}})
+    b = StoredItem.from_item({"a": {"x": 1, "y": 2}, "b": 1}, compress=True)
+    c = StoredItem.from_item({"a": {"x": 1, "y": 3}, "b": 1})
+
+    assert a.digest == b.digest
+    assert a.digest != c.digest
+
+
+def test_stored_item_timestamps():
+    stored = StoredItem.from_item({"date": datetime.date(2026, 1, 1)})
+    assert stored.load() == {"date": "2026-01-01"}
+
+
+def test_delta():
+    last = render(CONFIGMAP.format(name="unchanged", value="1"),
+                  CONFIGMAP.format(name="changed", value="1"),
+                  SECRET.format(name="deleted", value="1"))
+    current = render(CONFIGMAP.format(name="unchanged", value="1"),
+                     CONFIGMAP.format(name="changed", value="2"),
+                     SECRET.format(name="added", value="1"),
+                     compress=True)
+
+    delta = last.delta(current)
+
+    assert delta.actions == {
+        ("v1", "Secret", "deleted", "namespace"): "delete",
+        ("v1", "ConfigMap", "changed", "namespace"): "update",
+    }
+    # Ordered by kind
+    assert list(delta.items) == [
+        ("v1", "Secret", "added", "namespace"),
+        ("v1", "ConfigMap", "changed", "namespace"),
+    ]
+    assert delta.items[("v1", "ConfigMap", "changed", "namespace")].load()["data"] == {"value": "2"}
+
+
+def test_delta_keeps_dry_run():
+    last = DeploymentState(dry_run=True)
+    assert last.delta(DeploymentState(dry_run=True)).dry_run
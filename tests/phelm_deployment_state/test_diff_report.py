@@ -0,0 +1,120 @@
+import base64
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from vcenter_operator.diff import diff_report, item_diff
+from vcenter_operator.informer import OwnedObjectInformer
+from vcenter_operator.phelm import DeploymentState, StoredItem
+
+NAMESPACE = "namespace"
+VCENTER = "vc-a-0.cc.region.cloud.sap"
+
+
+def configmap(name, data, **metadata):
+    return {"apiVersion": "v1", "kind": "ConfigMap", "metadata": dict(name=name, **metadata), "data": data}
+
+
+def test_item_diff():
+    live = configmap("a", {"same": "1", "changed": "old", "removed": "x"}, uid="1234")
+    live["metadata"]["managedFields"] = [
+        {"manager": "vcenter-operator", "operation": "Apply",
+         "fieldsV1": {"f:data": {"f:same": {}, "f:changed": {}, "f:removed": {}}}},
+        # Not ours
+        {"manager": "kubectl", "operation": "Update", "fieldsV1": {"f:data": {"f:foreign": {}}}},
+    ]
+    live["data"]["foreign"] = "y"
+    rendered = configmap("a", {"same": "1", "changed": "new", "added": "z"})
+
+    assert item_diff(rendered, live) == [
+        ("+", ".data.added"),
+        ("-", ".data.removed"),
+        ("~", ".data.changed"),
+    ]
+
+
+def test_diff_report():
+    informer = OwnedObjectInformer(keep_objects=True)
+    last = DeploymentState(vcenter=VCENTER)
+    state = DeploymentState(vcenter=VCENTER)
+    for name, data in (("changed", {"a": "new"}), ("unchanged", {"a": "1"}), ("new", {"a": "1"})):
+        state.items[("v1", "ConfigMap", name, NAMESPACE)] = StoredItem.from_item(
+            configmap(name, data), template="vcenter_cluster/namespace/a.yaml.j2")
+    state.items[("v1", "ConfigMap", "invalid", NAMESPACE)] = StoredItem.from_item(
+        configmap("invalid", 1), template="vcenter_cluster/namespace/b.yaml.j2", errors=[".data: expected object"])
+    last.items[("v1", "ConfigMap", "gone", NAMESPACE)] = StoredItem.from_item(
+        configmap("gone", {}), template="vcenter_cluster/namespace/b.yaml.j2")
+
+    informer._handle("ADDED", configmap("changed", {"a": "old"}, namespace=NAMESPACE))
+    unchanged = state.item_to_apply(("v1", "ConfigMap", "unchanged", NAMESPACE))
+    unchanged["metadata"]["annotations"] = {}
+    informer._handle("ADDED", dict(unchanged, metadata=dict(unchanged["metadata"], namespace=NAMESPACE)))
+
+    # Exists, but without our label, so it is not watched by the informer
+    state.items[("v1", "ConfigMap", "unlabelled", NAMESPACE)] = StoredItem.from_item(
+        configmap("unlabelled", {"a": "1"}), template="vcenter_cluster/namespace/a.yaml.j2")
+    client = MagicMock()
+
+    listed = configmap("unlabelled", {"a": "1"}, namespace=NAMESPACE)
+    # Items of a list do not carry their kind
+    del listed["kind"]
+    client.get.return_value.to_dict.return_value = {"items": [listed]}
+    delta = last.delta(state)
+    with patch.object(DeploymentState, "get_client", return_value=client), \
+            patch.object(DeploymentState, "get_resource", return_value=SimpleNamespace(namespaced=True)):
+        lines = diff_report(delta, informer, last)
+
+    # The ConfigMaps not watched by the informer are listed once
+    client.get.assert_called_once()
+    assert client.get.call_args.kwargs == {"namespace": NAMESPACE}
+
+    assert lines == [
+        f"Dry-run diff for {VCENTER}: 1 to create, 2 to change, 1 to delete, 1 invalid, 1 unchanged",
+        "  vcenter_cluster/namespace/a.yaml.j2",
+        "    ~ ConfigMap namespace/changed: +.metadata.annotations, +.metadata.labels, ~.data.a",
+        "    + ConfigMap namespace/new",
+        "    ~ ConfigMap namespace/unlabelled: +.metadata.annotations, +.metadata.labels",
+        "  vcenter_cluster/namespace/b.yaml.j2",
+        "    ! ConfigMap namespace/invalid: .data: expected object",
+        "    - ConfigMap namespace/gone",
+    ]
+
+
+def test_item_diff_string_data():
+    encoded = base64.b64encode(b"secret").decode()
+    live = {"apiVersion": "v1", "kind": "Secret", "metadata": {"name": "a"}, "data": {"password": encoded}}
+    live["metadata"]["managedFields"] = [
+        {"manager": "vcenter-operator", "operation": "Apply", "fieldsV1": {"f:stringData": {"f:password": {}}}},
+    ]
+    rendered = {"apiVersion": "v1", "kind": "Secret", "metadata": {"name": "a"}, "stringData": {"password": "secret"}}
+
+    assert item_diff(rendered, live) == []
+    rendered["stringData"]["password"] = "changed"
+    assert item_diff(rendered, live) == [("~", ".data.password")]
+
+
+def test_item_diff_server_defaults():
+    container = {"name": "nova", "image": "nova:1", "ports": [{"containerPort": 8080}],
+                 "volumeMounts": [{"name": "etc", "mountPath": "/etc/nova"}], "args": ["--debug"]}
+    rendered = {"apiVersion": "apps/v1", "kind": "Deployment", "metadata": {"name": "a"},
+                "spec": {"template": {"spec": {"containers": [container],
+                                               "volumes": [{"name": "etc", "configMap": {"name": "etc"}}]}}}}
+    live_container = dict(container, imagePullPolicy="IfNotPresent", terminationMessagePath="/dev/termination-log",
+                          ports=[{"containerPort": 8080, "protocol": "TCP"}])
+    live = {"apiVersion": "apps/v1", "kind": "Deployment", "metadata": {"name": "a"},
+            "spec": {"replicas": 1, "template": {"spec": {
+                "containers": [live_container],
+                "volumes": [{"name": "etc", "configMap": {"name": "etc", "defaultMode": 420}}]}}}}
+
+    assert item_diff(rendered, live) == []
+
+    container.update(image="nova:2", args=["--verbose"])
+    container["volumeMounts"].append({"name": "logs", "mountPath": "/var/log"})
+    live_container["volumeMounts"] = [{"name": "etc", "mountPath": "/etc/nova"},
+                                      {"name": "old", "mountPath": "/old"}]
+    containers = ".spec.template.spec.containers[name=nova]"
+    assert item_diff(rendered, live) == [
+        ("+", f"{containers}.volumeMounts[mountPath=/var/log]"),
+        ("-", f"{containers}.volumeMounts[mountPath=/old]"),
+        ("~", f"{containers}.args[0]"),
+        ("~", f"{containers}.image"),
+    ]
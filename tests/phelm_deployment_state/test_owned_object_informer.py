@@ -0,0 +1,133 @@
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from vcenter_operator.informer import OwnedObjectInformer
+from vcenter_operator.phelm import APPLIED_HASH_ANNOTATION, DeploymentState, StoredItem
+
+NAMESPACE = "namespace"
+
+
+def item(kind, name):
+    return {"apiVersion": "v1", "kind": kind, "metadata": {"name": name, "namespace": NAMESPACE}}
+
+
+def live(obj, digest, managed_fields=()):
+    metadata = dict(obj["metadata"], resourceVersion="1", annotations={APPLIED_HASH_ANNOTATION: digest},
+                    managedFields=list(managed_fields))
+    return dict(obj, metadata=metadata)
+
+
+def synced_informer(*kinds):
+    informer = OwnedObjectInformer()
+    for kind in kinds:
+        informer.synced[("v1", kind)] = threading.Event()
+        informer.synced[("v1", kind)].set()
+    return informer
+
+
+def state_with(*items):
+    state = DeploymentState()
+    for i in items:
+        state.items[("v1", i["kind"], i["metadata"]["name"], NAMESPACE)] = StoredItem.from_item(i)
+    return state
+
+
+def test_drifted_items():
+    a, b, c, d = item("Secret", "a"), item("Secret", "b"), item("Secret", "c"), item("ConfigMap", "d")
+    state = state_with(a, b, c, d)
+    informer = synced_informer("Secret")
+    digest = {_id[2]: stored.digest for _id, stored in state.items.items()}
+
+    informer._handle("ADDED", live(a, digest["a"]))
+    informer._handle("ADDED", live(b, "old-digest"))
+    # c is missing and d is not watched
+
+    assert informer.pop_drifted(state) == [("v1", "Secret", "b", NAMESPACE), ("v1", "Secret", "c", NAMESPACE)]
+
+
+def test_deleted_and_foreign_changes():
+    a, b = item("Secret", "a"), item("Secret", "b")
+    state = state_with(a, b)
+    informer = synced_informer("Secret")
+    digest = {_id[2]: stored.digest for _id, stored in state.items.items()}
+    ours = {"manager": "vcenter-operator", "time": "2026-01-01T00:00:00Z"}
+    kubectl = {"manager": "kubectl-edit", "time": "2026-01-02T00:00:00Z"}
+
+    informer._handle("ADDED", live(a, digest["a"], [ours, kubectl]))
+    informer._handle("ADDED", live(b, digest["b"], [ours]))
+    assert informer.pop_drifted(state) == [("v1", "Secret", "a", NAMESPACE)]
+
+    # Re-applying it does not count as another change, neither do status updates
+    status = {"manager": "kube-controller-manager", "time": "2026-01-03T00:00:00Z", "subresource": "status"}
+    informer._handle("MODIFIED", live(a, digest["a"], [ours, kubectl, status]))
+    assert informer.pop_drifted(state) == []
+
+    informer._handle("DELETED", live(b, digest["b"]))
+    assert informer.pop_drifted(state) == [("v1", "Secret", "b", NAMESPACE)]
+
+    # Deleted objects not rendered anymore are forgotten
+    informer._handle("DELETED", live(item("Secret", "c"), "digest"))
+    assert informer.pop_drifted(state) == [("v1", "Secret", "b", NAMESPACE)]
+    assert informer.drift == set()
+
+
+def test_watch_error_lists_again():
+    a = item("Secret", "a")
+    informer = OwnedObjectInformer()
+    client = MagicMock()
+    client.get.return_value.to_dict.return_value = {"items": []}
+    client.get.return_value.metadata.resourceVersion = "1"
+    gone = {"type": "ERROR", "raw_object": {"kind": "Status", "code": 410, "message": "too old resource version"}}
+    client.watch.side_effect = [[gone], [{"type": "ADDED", "raw_object": live(a, "digest")}], SystemExit]
+
+    with patch.object(DeploymentState, "get_client", return_value=client), \
+            patch("vcenter_operator.informer.LOG") as log, \
+            pytest.raises(SystemExit):
+        informer._run("v1", "Secret", threading.Event())
+
+    # The error event is no exception, the kind is listed again right away and watched from there
+    log.exception.assert_not_called()
+    assert client.get.call_count == 2
+    assert [c.kwargs["resource_version"] for c in client.watch.call_args_list] == ["1", "1", "1"]
+    assert informer.live_object(("v1", "Secret", "a", NAMESPACE)) is None
+    assert ("v1", "Secret", "a", NAMESPACE) in informer.objects
+
+
+def test_list_replaces_cached_objects():
+    a, b = item("Secret", "a"), item("Secret", "b")
+    state = state_with(a, b)
+    informer = synced_informer("Secret")
+    digest = {_id[2]: stored.digest for _id, stored in state.items.items()}
+    informer._handle("ADDED", live(a, digest["a"]))
+    informer._handle("ADDED", live(b, digest["b"]))
+
+    client = MagicMock()
+    # Items of a list do not carry their kind
+    listed = live(a, digest["a"])
+    del listed["kind"]
+    client.get.return_value.to_dict.return_value = {"items": [listed]}
+    client.get.return_value.metadata.resourceVersion = "2"
+
+    assert informer._list(client, MagicMock(), "v1", "Secret") == "2"
+    assert informer.applied_digests(("v1", "Secret", NAMESPACE)) == {"a": digest["a"]}
+    assert informer.applied_digests(("v1", "ConfigMap", NAMESPACE)) is None
+    assert informer.pop_drifted(state) == [("v1", "Secret", "b", NAMESPACE)]
+
+
+def test_without_applied_uses_informer():
+    a, b = item("Secret", "a"), item("ConfigMap", "b")
+    state = state_with(a, b)
+    informer = synced_informer("Secret")
+    informer._handle("ADDED", live(a, state.items[("v1", "Secret", "a", NAMESPACE)].digest))
+
+    with patch.object(DeploymentState, "_list_applied_digests", return_value={}) as fn_list:
+        unapplied = state.without_applied(informer)
+
+    # Only the kind not synced by the informer is listed
+    fn_list.assert_called_once_with(("v1", "ConfigMap", NAMESPACE))
+    assert list(unapplied.items) == [("v1", "ConfigMap", "b", NAMESPACE)]
+
+    unapplied.with_items(state, [("v1", "Secret", "a", NAMESPACE)])
+    assert list(unapplied.items) == [("v1", "Secret", "a", NAMESPACE), ("v1", "ConfigMap", "b", NAMESPACE)]
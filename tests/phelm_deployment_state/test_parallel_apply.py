@@ -0,0 +1,110 @@
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+from kubernetes import client as k8s_client
+
+from vcenter_operator.phelm import DeploymentState, StoredItem
+
+NAMESPACE = "namespace"
+
+
+def item(kind, name):
+    return {"apiVersion": "v1", "kind": kind, "metadata": {"name": name}}
+
+
+@pytest.fixture
+def state():
+    """Fixture to create a DeploymentState with Secrets, ConfigMaps, Deployments and Services"""
+    state = DeploymentState(workers=4)
+    for kind, count in (("Secret", 4), ("ConfigMap", 6), ("Deployment", 3), ("Service", 2)):
+        for i in range(count):
+            state.items[("v1", kind, f"{kind.lower()}-{i}", NAMESPACE)] = StoredItem.from_item(item(kind, i))
+    return state
+
+
+class Recorder:
+    """Records the time span of each apply call and the maximum of parallel calls"""
+
+    def __init__(self, duration=0.02, fail=None):
+        self.duration = duration
+        self.fail = fail or {}
+        self.spans = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, resource, resource_args, new_item):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        start = time.monotonic()
+        time.sleep(self.duration)
+        with self.lock:
+            self.running -= 1
+            self.spans.append((new_item["kind"], start, time.monotonic()))
+        status = self.fail.get(resource_args["name"])
+        if status:
+            self.fail.pop(resource_args["name"])
+            raise k8s_client.rest.ApiException(status=status)
+
+
+def resource_args(self, api_version, kind, name, namespace):
+    return MagicMock(kind=kind), {"name": name, "namespace": namespace}
+
+
+@patch.object(DeploymentState, "_id_to_k8s", resource_args)
+def test_phases_run_in_parallel_with_barrier(state):
+    recorder = Recorder()
+    with patch.object(DeploymentState, "_apply_item", side_effect=recorder):
+        state.apply()
+
+    assert len(recorder.spans) == 15
+    assert 1 < recorder.max_running <= 4
+
+    order = ["Secret", "ConfigMap", "Deployment", "Service"]
+    for earlier, later in zip(order, order[1:]):
+        last_end = max(end for kind, _, end in recorder.spans if kind == earlier)
+        first_start = min(start for kind, start, _ in recorder.spans if kind == later)
+        assert last_end <= first_start
+
+
+@patch.object(DeploymentState, "_id_to_k8s", resource_args)
+def test_unprocessable_items_retried(state):
+    recorder = Recorder(duration=0, fail={"configmap-1": 422})
+    with patch.object(DeploymentState, "_apply_item", side_effect=recorder):
+        state.apply()
+
+    assert len(recorder.spans) == 16
+
+
+@patch.object(DeploymentState, "_id_to_k8s", resource_args)
+def test_error_stops_after_phase(state):
+    recorder = Recorder(duration=0, fail={"secret-2": 500})
+    with patch.object(DeploymentState, "_apply_item", side_effect=recorder):
+        with pytest.raises(k8s_client.rest.ApiException):
+            state.apply()
+
+    assert sorted(kind for kind, _, _ in recorder.spans) == ["Secret"] * 4
+
+
+@patch.object(DeploymentState, "_id_to_k8s", resource_args)
+def test_parallel_deletes(state):
+    deleted = []
+
+    def delete(resource, **kwargs):
+        deleted.append(kwargs["name"])
+        if kwargs["name"] == "gone":
+            raise k8s_client.rest.ApiException(status=404)
+
+    state.items.clear()
+    for name in ("a", "b", "gone"):
+        state.actions[("v1", "ConfigMap", name, NAMESPACE)] = "delete"
+    state.actions[("v1", "ConfigMap", "c", NAMESPACE)] = "update"
+
+    with patch.object(DeploymentState, "get_client") as fn_client:
+        fn_client.return_value.delete.side_effect = delete
+        state.apply()
+
+    assert sorted(deleted) == ["a", "b", "gone"]
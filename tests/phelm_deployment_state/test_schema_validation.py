@@ -0,0 +1,166 @@
+import json
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from vcenter_operator.phelm import DeploymentState
+from vcenter_operator.schema import SchemaCache
+
+INT_OR_STRING = "io.k8s.apimachinery.pkg.util.intstr.IntOrString"
+APPS_V1 = {
+    "components": {
+        "schemas": {
+            "io.k8s.api.apps.v1.Deployment": {
+                "type": "object",
+                "properties": {
+                    "apiVersion": {"type": "string"},
+                    "kind": {"type": "string"},
+                    "metadata": {"allOf": [{"$ref": "#/components/schemas/io.k8s.ObjectMeta"}]},
+                    "spec": {"allOf": [{"$ref": "#/components/schemas/io.k8s.api.apps.v1.DeploymentSpec"}]},
+                },
+                "x-kubernetes-group-version-kind": [{"group": "apps", "kind": "Deployment", "version": "v1"}],
+            },
+            "io.k8s.api.apps.v1.DeploymentSpec": {
+                "type": "object",
+                "required": ["selector", "template"],
+                "properties": {
+                    "replicas": {"type": "integer"},
+                    "selector": {"type": "object"},
+                    "template": {"type": "object"},
+                    "strategy": {
+                        "type": "object",
+                        "properties": {
+                            "type": {"type": "string", "enum": ["Recreate", "RollingUpdate"]},
+                            "rollingUpdate": {
+                                "type": "object",
+                                "properties": {
+                                    "maxSurge": {"allOf": [{"$ref": "#/components/schemas/" + INT_OR_STRING}]},
+                                    # API servers emitting the oneOf form
+                                    "maxUnavailable": {"oneOf": [{"type": "integer"}, {"type": "string"}]},
+                                },
+                            },
+                        },
+                    },
+                },
+            },
+            INT_OR_STRING: {"type": "string", "format": "int-or-string"},
+            "io.k8s.ObjectMeta": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "labels": {"type": "object", "additionalProperties": {"type": "string"}},
+                },
+            },
+        }
+    }
+}
+INDEX = {"paths": {"apis/apps/v1": {"serverRelativeURL": "/openapi/v3/apis/apps/v1?hash=1"}}}
+DEPLOYMENT = """apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: {name}
+  labels:
+    version: "1"
+spec:
+  replicas: {replicas}
+  selector: {{}}
+  template: {{}}
+  strategy:
+    type: {strategy}
+    rollingUpdate:
+      maxSurge: 1
+      maxUnavailable: 25%
+"""
+
+
+@pytest.fixture
+def cache():
+    """Fixture to create a schema cache serving the schemas above"""
+    client = MagicMock()
+    documents = {"/openapi/v3": INDEX, "/openapi/v3/apis/apps/v1?hash=1": APPS_V1}
+    client.request.side_effect = lambda method, path, **kwargs: SimpleNamespace(
+        data=json.dumps(documents[path]).encode())
+    cache = SchemaCache(lambda: client)
+    cache.client = client
+    return cache
+
+
+def test_valid_item(cache):
+    state = DeploymentState(validator=cache)
+    state.add(DEPLOYMENT.format(name="a", replicas=1, strategy="RollingUpdate"), None, "namespace")
+    state.add(DEPLOYMENT.format(name="b", replicas=2, strategy="Recreate"), None, "namespace")
+
+    assert all(not stored.errors for stored in state.items.values())
+    # The index and the group version are fetched once
+    assert cache.client.request.call_count == 2
+
+
+def test_invalid_items_reported_and_not_applied(cache):
+    state = DeploymentState(validator=cache)
+    state.add(DEPLOYMENT.format(name="a", replicas="two", strategy="Sometimes"), None, "namespace", "a.yaml.j2")
+    state.add("apiVersion: apps/v1\nkind: Deployment\nmetadata:\n  name: b\nspec:\n  replicas: true\n",
+              None, "namespace")
+
+    assert state.items[("apps/v1", "Deployment", "a", "namespace")].errors == (
+        ".spec.replicas: expected integer, got str",
+        ".spec.strategy.type: 'Sometimes' is not one of ['Recreate', 'RollingUpdate']",
+    )
+    assert state.items[("apps/v1", "Deployment", "b", "namespace")].errors == (
+        ".spec.selector: required field missing",
+        ".spec.template: required field missing",
+        ".spec.replicas: expected integer, got bool",
+    )
+
+    with patch.object(DeploymentState, "_id_to_k8s", return_value=(MagicMock(), {})), \
+            patch.object(DeploymentState, "_apply_item") as fn_apply:
+        state.apply()
+    fn_apply.assert_not_called()
+
+
+def test_unknown_kinds_not_validated(cache):
+    state = DeploymentState(validator=cache)
+    state.add("apiVersion: v1\nkind: ConfigMap\nmetadata:\n  name: a\ndata: 1\n", None, "namespace")
+
+    assert not state.items[("v1", "ConfigMap", "a", "namespace")].errors
+
+
+def test_unavailable_schemas_fetched_again(cache):
+    documents = {"/openapi/v3": {"paths": {}}}
+    cache.client.request.side_effect = lambda method, path, **kwargs: SimpleNamespace(
+        data=json.dumps(documents[path]).encode())
+    invalid = DEPLOYMENT.format(name="a", replicas="two", strategy="Recreate")
+
+    with patch("vcenter_operator.schema.time.monotonic", return_value=1000.0) as fn_time:
+        state = DeploymentState(validator=cache)
+        state.add(invalid, None, "namespace")
+        # Not served yet, so not validated and not fetched again within the retry interval
+        assert not state.items[("apps/v1", "Deployment", "a", "namespace")].errors
+        state.add(invalid.replace("name: a", "name: b"), None, "namespace")
+        assert cache.client.request.call_count == 1
+
+        documents.update({"/openapi/v3": INDEX, "/openapi/v3/apis/apps/v1?hash=1": APPS_V1})
+        fn_time.return_value += 300
+        state.add(invalid.replace("name: a", "name: c"), None, "namespace")
+
+    # The index is fetched again and lists the group version now
+    assert cache.client.request.call_count == 3
+    assert state.items[("apps/v1", "Deployment", "c", "namespace")].errors == (
+        ".spec.replicas: expected integer, got str",
+    )
+
+
+def test_int_or_string(cache):
+    def deployment(name, max_surge, max_unavailable):
+        document = DEPLOYMENT.format(name=name, replicas=1, strategy="RollingUpdate")
+        document = document.replace("maxSurge: 1", f"maxSurge: {max_surge}")
+        return document.replace("maxUnavailable: 25%", f"maxUnavailable: {max_unavailable}")
+
+    state = DeploymentState(validator=cache)
+    state.add(deployment("a", "25%", 0), None, "namespace")
+    state.add(deployment("b", "true", "25%"), None, "namespace")
+
+    assert not state.items[("apps/v1", "Deployment", "a", "namespace")].errors
+    assert state.items[("apps/v1", "Deployment", "b", "namespace")].errors == (
+        ".spec.strategy.rollingUpdate.maxSurge: expected integer or string, got bool",
+    )
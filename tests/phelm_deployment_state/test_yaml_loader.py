@@ -0,0 +1,98 @@
+import os
+import time
+
+import pytest
+import yaml
+
+from vcenter_operator.phelm import DeploymentState, SafeLoader, load_all
+
+CONFIGMAP = """apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: nova-compute-{name}
+  labels:
+    system: openstack
+    component: nova
+data:
+  nova-compute.conf: |
+    [DEFAULT]
+    host = nova-compute-{name}
+{options}
+  vspc.conf: |
+    [DEFAULT]
+    serial_log_dir = /serial-logs
+"""
+DEPLOYMENT = """apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: nova-compute-{name}
+spec:
+  replicas: 1
+  template:
+    metadata:
+      annotations:
+        configmap-hash: "{name}"
+    spec:
+      containers:
+      - name: nova-compute
+        image: keppel.example.com/nova:2024-01-01
+        command: ["nova-compute", "--config-file", "/etc/nova/nova-compute.conf"]
+        env:
+{env}
+        volumeMounts:
+        - name: etc-nova
+          mountPath: /etc/nova
+      volumes:
+      - name: etc-nova
+        configMap:
+          name: nova-compute-{name}
+"""
+
+
+def rendered(clusters=20):
+    """Output like the one of the nova-compute VCenterTemplate, for a number of clusters"""
+    documents = []
+    for i in range(clusters):
+        name = f"bb{i}"
+        options = "\n".join(f"    option_{j} = {name}-value-{j}" for j in range(200))
+        env = "\n".join(f"        - name: VAR_{j}\n          value: \"{j}\"" for j in range(20))
+        documents.append(CONFIGMAP.format(name=name, options=options))
+        documents.append(DEPLOYMENT.format(name=name, env=env))
+    return "---\n".join(documents)
+
+
+def test_load_all_parses_like_safe_load_all():
+    result = rendered(2)
+    assert list(load_all(result)) == list(yaml.safe_load_all(result))
+
+    state = DeploymentState()
+    state.add(result, None, "monsoon3")
+    assert list(state.items) == [
+        ("v1", "ConfigMap", "nova-compute-bb0", "monsoon3"),
+        ("v1", "ConfigMap", "nova-compute-bb1", "monsoon3"),
+        ("apps/v1", "Deployment", "nova-compute-bb0", "monsoon3"),
+        ("apps/v1", "Deployment", "nova-compute-bb1", "monsoon3"),
+    ]
+
+
+def test_load_all_rejects_unsafe_tags():
+    with pytest.raises(yaml.YAMLError):
+        list(load_all("!!python/object/apply:os.system ['true']"))
+
+
+@pytest.mark.skipif(not os.environ.get("RUN_BENCHMARKS"), reason="Set RUN_BENCHMARKS to run the benchmarks")
+@pytest.mark.skipif(not yaml.__with_libyaml__, reason="PyYAML without libyaml")
+def test_benchmark_against_pure_python_loader():
+    result = rendered()
+    assert SafeLoader is yaml.CSafeLoader
+
+    start = time.perf_counter()
+    c_items = list(load_all(result))
+    c_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    python_items = list(yaml.load_all(result, Loader=yaml.SafeLoader))
+    python_time = time.perf_counter() - start
+
+    assert c_items == python_items
+    assert c_time < python_time, f"libyaml {c_time:.4f}s, pure Python {python_time:.4f}s"
@@ -0,0 +1,60 @@
+import os
+import time
+from collections import OrderedDict
+
+import pytest
+
+from vcenter_operator.phelm import DeploymentState, KindOrderedItems
+
+KINDS = ["Deployment", "ConfigMap", "Secret", "Service"]
+
+
+def cluster_ids(cluster, count):
+    return [("v1", KINDS[i % len(KINDS)], f"{cluster}-{i}", "namespace") for i in range(count)]
+
+
+def test_iterates_in_apply_order():
+    items = KindOrderedItems()
+    for _id in cluster_ids("a", 8):
+        items[_id] = _id[2]
+
+    assert [_id[1] for _id in items] == ["Secret"] * 2 + ["ConfigMap"] * 2 + ["Deployment"] * 2 + ["Service"] * 2
+    # Insertion order within a kind
+    assert [_id[2] for _id in items if _id[1] == "Secret"] == ["a-2", "a-6"]
+
+    del items[("v1", "Secret", "a-2", "namespace")]
+    items[("v1", "Secret", "a-6", "namespace")] = "replaced"
+    assert len(items) == 7
+    assert items[("v1", "Secret", "a-6", "namespace")] == "replaced"
+    assert ("v1", "Secret", "a-2", "namespace") not in items
+    assert items.keys() - {("v1", "Secret", "a-6", "namespace")} == set(items) - {("v1", "Secret", "a-6", "namespace")}
+
+    items.clear()
+    assert len(items) == 0
+    assert list(items) == []
+
+
+@pytest.mark.skipif(not os.environ.get("RUN_BENCHMARKS"), reason="Set RUN_BENCHMARKS to run the benchmarks")
+def test_benchmark_against_sorting_per_render():
+    """Adding the items of many clusters must not re-sort everything after each cluster"""
+    clusters = [cluster_ids(f"cluster{c}", 500) for c in range(40)]
+    state = DeploymentState()
+
+    start = time.perf_counter()
+    items = KindOrderedItems()
+    for ids in clusters:
+        for _id in ids:
+            items[_id] = None
+    store_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sorted_items = OrderedDict()
+    for ids in clusters:
+        for _id in ids:
+            sorted_items[_id] = None
+        # What rendering a cluster did before
+        sorted_items = OrderedDict((k, sorted_items[k]) for k in state._sort_resources(sorted_items.keys()))
+    sort_time = time.perf_counter() - start
+
+    assert list(items) == list(sorted_items)
+    assert store_time < sort_time, f"store {store_time:.4f}s, sorting {sort_time:.4f}s"
@@ -0,0 +1,113 @@
+from unittest import mock
+
+import pytest
+
+from vcenter_operator.vault import Vault
+
+URL = "http://random.com"
+TOKEN = "TOKEN"
+CONSTRAINTS = {
+    "length": 20,
+    "digits": 1,
+    "symbols": 1,
+}
+
+
+@pytest.fixture
+def vault():
+    """Fixture to create a Vault instance with a password pool"""
+    vault = Vault(dry_run=False)
+
+    vault.set_vault_url(URL)
+    vault.set_approle("APPROLE")
+    vault.set_mount_point_read("read")
+    vault.set_mount_point_write("write")
+    vault.set_password_constraints(CONSTRAINTS)
+    vault.set_password_pool_size(3)
+    vault.token = TOKEN
+    return vault
+
+
+def mocked_put(counter):
+    """Mock the vault password generation returning a new password on every call"""
+    class MockResponse:
+        status_code = 200
+
+        def __init__(self, value):
+            self.value = value
+
+        def json(self):
+            return {"data": {"value": self.value}}
+
+        def raise_for_status(self):
+            pass
+
+    def put(*args, **kwargs):
+        counter.append(kwargs["json"])
+        return MockResponse(f"password-{len(counter)}")
+
+    return put
+
+
+def test_fill_password_pool(vault):
+    calls = []
+    with mock.patch('requests.put', side_effect=mocked_put(calls)):
+        vault.fill_password_pool()
+        vault.password_pool.join()
+
+    assert list(vault.password_pool.passwords) == ["password-1", "password-2", "password-3"]
+    assert calls == [CONSTRAINTS] * 3
+
+
+def test_gen_password_uses_pool(vault):
+    calls = []
+    with mock.patch('requests.put', side_effect=mocked_put(calls)):
+        vault.fill_password_pool()
+        vault.password_pool.join()
+
+        assert vault.gen_password() == "password-1"
+        vault.password_pool.join()
+
+    # The taken password got replaced in the background
+    assert list(vault.password_pool.passwords) == ["password-2", "password-3", "password-4"]
+
+
+def test_gen_password_without_pool(vault):
+    vault.set_password_pool_size(0)
+    calls = []
+    with mock.patch('requests.put', side_effect=mocked_put(calls)):
+        assert vault.gen_password() == "password-1"
+        assert vault.gen_password() == "password-2"
+
+    assert not vault.password_pool.passwords
+
+
+def test_constraint_change_drains_pool(vault):
+    calls = []
+    with mock.patch('requests.put', side_effect=mocked_put(calls)):
+        vault.fill_password_pool()
+        vault.password_pool.join()
+
+    new_constraints = dict(CONSTRAINTS, length=30)
+    vault.set_password_constraints(new_constraints)
+    assert not vault.password_pool.passwords
+
+    with mock.patch('requests.put', side_effect=mocked_put(calls)):
+        # Nothing prefetched for the new constraints, so it is requested directly
+        assert vault.gen_password() == "password-4"
+        vault.password_pool.join()
+
+    assert calls[3:] == [new_constraints] * 4
+
+
+def test_constraints_changed_directly(vault):
+    calls = []
+    with mock.patch('requests.put', side_effect=mocked_put(calls)):
+        vault.fill_password_pool()
+        vault.password_pool.join()
+
+        vault.password_constraints = dict(CONSTRAINTS, symbols=5)
+        assert vault.gen_password() == "password-4"
+        vault.password_pool.join()
+
+    assert calls[3]["symbols"] == 5
@@ -0,0 +1,81 @@
+import time
+from unittest.mock import MagicMock, call
+
+import pytest
+
+from vcenter_operator.vault import ReplicationTracker
+
+PATH = "service/name"
+
+
+def metadata(*versions):
+    return {"data": {"versions": {str(version): {} for version in versions}}}
+
+
+@pytest.fixture
+def tracker():
+    """Fixture to create a ReplicationTracker with a mocked vault"""
+    vault = MagicMock()
+    return ReplicationTracker(vault, backoff=30, max_backoff=120)
+
+
+def test_request_coalesces_triggers(tracker):
+    assert tracker.request(PATH, "nsxt", "2")
+    assert not tracker.request(PATH, "nsxt", "2")
+    assert not tracker.request(PATH)
+
+    tracker.vault.trigger_replicate.assert_called_once_with(PATH, "nsxt")
+    assert tracker.is_pending(PATH)
+
+
+def test_request_backs_off(tracker):
+    backoffs = []
+    for _ in range(5):
+        tracker.request(PATH)
+        entry = tracker.pending[PATH]
+        backoffs.append(round(entry["next_trigger"] - time.time()))
+        # Pretend the backoff expired
+        entry["next_trigger"] = 0
+
+    assert tracker.vault.trigger_replicate.call_count == 5
+    assert backoffs == [30, 60, 120, 120, 120]
+
+
+def test_is_replicated_polls_read_mount(tracker):
+    tracker.request(PATH, "nsxt", "3")
+    tracker.vault.get_metadata.return_value = metadata(1, 2)
+
+    assert not tracker.is_replicated(PATH)
+    assert tracker.is_pending(PATH)
+    # Only the read mount point gets polled, the version is known and the backoff did not expire
+    tracker.vault.get_metadata.assert_called_once_with(PATH, read=True)
+    tracker.vault.trigger_replicate.assert_called_once()
+
+    tracker.vault.get_metadata.return_value = metadata(1, 2, 3)
+    assert tracker.is_replicated(PATH)
+    assert not tracker.is_pending(PATH)
+
+
+def test_is_replicated_without_version(tracker):
+    tracker.request(PATH, "nsxt")
+    tracker.vault.get_metadata.side_effect = [metadata(1, 2), metadata(1, 2)]
+
+    assert tracker.is_replicated(PATH)
+    assert tracker.vault.get_metadata.call_args_list == [
+        call(PATH, read=False, service_type="nsxt"),
+        call(PATH, read=True),
+    ]
+
+
+def test_is_replicated_retriggers_after_backoff(tracker):
+    tracker.request(PATH, None, "2")
+    tracker.vault.get_metadata.return_value = None
+
+    tracker.pending[PATH]["next_trigger"] = 0
+    assert not tracker.is_replicated(PATH)
+    assert tracker.vault.trigger_replicate.call_count == 2
+
+
+def test_not_pending_is_replicated(tracker):
+    assert tracker.is_replicated(PATH)
+    tracker.vault.get_metadata.assert_not_called()
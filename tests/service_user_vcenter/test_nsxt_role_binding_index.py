@@ -0,0 +1,97 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from vcenter_operator.nsxt_user_manager import NsxtUserAPIHelper
+
+ROLE_BINDINGS = [
+    {"name": "service0001", "user_id": 10001, "id": "rb-1", "_revision": 3,
+     "roles": [{"role": "enterprise_admin"}]},
+    {"name": "service0002", "user_id": 10002, "id": "rb-2", "_revision": 0,
+     "roles": [{"role": "auditor"}]},
+    # Group binding without a local user
+    {"name": "admins", "id": "rb-3", "_revision": 1, "roles": [{"role": "enterprise_admin"}]},
+]
+NODE_USERS = [
+    {"username": "admin", "userid": 10000},
+    {"username": "service0001", "userid": 10001},
+    {"username": "service0002", "userid": 10002},
+]
+
+
+def response(data):
+    res = MagicMock()
+    res.status_code = 200
+    res.json.return_value = data
+    return res
+
+
+def mocked_request(method, url, *args, **kwargs):
+    if method == "get" and url == "api/v1/aaa/role-bindings":
+        name = (kwargs.get("params") or {}).get("name")
+        if name:
+            return response({"results": [{"name": name, "user_id": 10003, "id": "rb-4", "_revision": 0,
+                                          "roles": [{"role": "auditor"}]}]})
+        if (kwargs.get("params") or {}).get("cursor"):
+            return response({"results": ROLE_BINDINGS[2:]})
+        return response({"results": ROLE_BINDINGS[:2], "cursor": "next"})
+    if method == "get" and url == "api/v1/node/users":
+        return response({"results": NODE_USERS})
+    if method == "put":
+        return response({"_revision": kwargs["json"]["_revision"] + 1})
+    return response({})
+
+
+@pytest.fixture
+def nsxt():
+    """Fixture to create a NSX-T helper with mocked HTTP requests"""
+    helper = NsxtUserAPIHelper(user="admin", password="admin", bb="bb085", region="random", dry_run=False)
+    with patch.object(NsxtUserAPIHelper, "_request", side_effect=mocked_request) as fn_request, \
+            patch.object(NsxtUserAPIHelper, "is_logged_in", return_value=True):
+        helper.fn_request = fn_request
+        yield helper
+
+
+def test_index_fetched_once(nsxt):
+    assert nsxt.list_users(prefix="service") == ["service0001", "service0002"]
+    assert nsxt.check_user_in_group("service0001", "enterprise_admin")
+    assert not nsxt.check_user_in_group("service0002", "enterprise_admin")
+    assert nsxt.get_user("service0002").role_mapping_id == "rb-2"
+
+    # Two pages of role-bindings and the node users
+    assert nsxt.fn_request.call_count == 3
+    assert "admins" not in nsxt.role_bindings
+
+
+def test_add_user_to_group_updates_index(nsxt):
+    nsxt.add_user_to_group("service0002", "enterprise_admin")
+
+    put_calls = [c for c in nsxt.fn_request.call_args_list if c.args[0] == "put"]
+    assert len(put_calls) == 1
+    assert put_calls[0].args[1] == "api/v1/aaa/role-bindings/rb-2"
+    assert put_calls[0].kwargs["json"]["_revision"] == 0
+
+    user = nsxt.get_user("service0002")
+    assert user.roles == ["enterprise_admin"]
+    assert user.revision == 1
+
+    # Already has the role, nothing to do
+    nsxt.add_user_to_group("service0002", "enterprise_admin")
+    assert len([c for c in nsxt.fn_request.call_args_list if c.args[0] == "put"]) == 1
+
+
+def test_create_and_delete_update_index(nsxt):
+    nsxt.list_users()
+
+    nsxt.create_service_user("service0003", "password")
+    assert "service0003" in nsxt.list_users(prefix="service")
+
+    # The role-binding of the new user is looked up by name
+    assert nsxt.get_user("service0003").role_mapping_id == "rb-4"
+
+    nsxt.delete_service_user("service0001")
+    assert nsxt.list_users(prefix="service") == ["service0002", "service0003"]
+    assert "service0001" not in nsxt.role_bindings
+
+    delete_calls = [c for c in nsxt.fn_request.call_args_list if c.args[0] == "delete"]
+    assert delete_calls[0].args[1] == "api/v1/node/users/10001"
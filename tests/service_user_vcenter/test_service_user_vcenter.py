@@ -4,6 +4,7 @@ from unittest.mock import MagicMock
 import pytest
 
 from vcenter_operator.configurator import Configurator
+from vcenter_operator.vcenter_sso import SSOSkippedError
 
 
 @pytest.fixture
@@ -99,3 +100,31 @@ def test_service_user_missing_state(configurator):
         configurator.vcenter_service_user_tracker[cr_name]["test_host"]["1"]
         < time.time()
     )
+
+
+def test_service_users_added_to_group_in_one_call(configurator):
+    """Test that service-users missing in the Administrators group are added with one call per host"""
+    configurator.vcenter_sso.list_service_users.return_value = ["service_a0001", "service_b0001"]
+    configurator.vcenter_sso.check_users_in_group.return_value = False
+    configurator.vcenter_sso.add_users_to_group.return_value = {"service_a0001": True, "service_b0001": True}
+
+    configurator._check_service_user_vcenter("service_a", "cr_a", "test_service", "test_host", "path_a", "1")
+    configurator._check_service_user_vcenter("service_b", "cr_b", "test_service", "test_host", "path_b", "1")
+
+    configurator.vcenter_sso.add_user_to_group.assert_not_called()
+    assert configurator.pending_sso_group_members["test_host"] == ["service_a0001", "service_b0001"]
+
+    configurator._add_pending_users_to_group("test_host")
+
+    configurator.vcenter_sso.add_users_to_group.assert_called_once_with(
+        "test_host", ["service_a0001", "service_b0001"])
+    assert "test_host" not in configurator.pending_sso_group_members
+
+
+def test_service_users_added_to_group_failure(configurator):
+    """Test that a failure to add a service-user to the Administrators group skips the host"""
+    configurator.pending_sso_group_members["test_host"] = ["service_a0001", "service_b0001"]
+    configurator.vcenter_sso.add_users_to_group.return_value = {"service_a0001": True, "service_b0001": False}
+
+    with pytest.raises(SSOSkippedError):
+        configurator._add_pending_users_to_group("test_host")
@@ -0,0 +1,63 @@
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from vcenter_operator.vcenter_sso import VCenterSSO
+
+HOST = "vc-a-0.test_domain"
+
+
+def principal(name):
+    return SimpleNamespace(id=SimpleNamespace(name=name, domain="vsphere.local"))
+
+
+@pytest.fixture
+def sso():
+    """Fixture to create a VCenterSSO instance with a mocked SSO admin API"""
+    sso = VCenterSSO(dry_run=False)
+    api = MagicMock()
+    sso.sso_admin_instances[HOST] = {"api": api, "retry": 0, "last_retry": 0, "login_time": time.time()}
+    with patch("vcenter_operator.vcenter_sso.pyVmomi"):
+        yield sso, api
+
+
+def test_add_users_to_group_in_one_call(sso):
+    sso, api = sso
+    users = {"service_a0001": principal("service_a0001"), "service_b0001": principal("service_b0001")}
+    api.principalDiscoveryService.FindUsers.return_value = list(users.values())
+    api.principalManagementService.AddUsersToLocalGroup.return_value = [True, False]
+
+    # Listing the service-users remembers their principal ids
+    sso.list_service_users(HOST, "service_")
+    results = sso.add_users_to_group(HOST, ["service_a0001", "service_b0001"])
+
+    assert results == {"service_a0001": True, "service_b0001": False}
+    api.principalDiscoveryService.FindUsers.assert_called_once()
+    api.principalManagementService.AddUsersToLocalGroup.assert_called_once_with(
+        userIds=[users["service_a0001"].id, users["service_b0001"].id], groupName="Administrators")
+
+
+def test_add_users_to_group_looks_up_unknown_users(sso):
+    sso, api = sso
+    user = principal("service_a0001")
+    api.principalDiscoveryService.FindUsers.side_effect = [[user], []]
+    api.principalManagementService.AddUsersToLocalGroup.return_value = [True]
+
+    results = sso.add_users_to_group(HOST, ["service_a0001", "service_b0001"])
+
+    assert results == {"service_a0001": True, "service_b0001": False}
+    assert api.principalDiscoveryService.FindUsers.call_count == 2
+    api.principalManagementService.AddUsersToLocalGroup.assert_called_once_with(
+        userIds=[user.id], groupName="Administrators")
+    assert sso.principal_ids[HOST] == {"service_a0001": user.id}
+
+
+def test_add_users_to_group_dry_run(sso):
+    sso, api = sso
+    sso.dry_run = True
+    sso.principal_ids[HOST]["service_a0001"] = principal("service_a0001").id
+
+    assert sso.add_users_to_group(HOST, ["service_a0001"]) == {"service_a0001": True}
+    api.principalManagementService.AddUsersToLocalGroup.assert_not_called()
@@ -0,0 +1,97 @@
+import time
+from unittest.mock import patch
+
+import pytest
+
+from vcenter_operator.vcenter_sso import SSOSkippedError, VCenterSSO, _is_authentication_fault, _saml_token_expiry
+
+HOST = "vc-a-0.test_domain"
+
+
+def saml_token(not_on_or_after):
+    return (
+        '<saml2:Assertion xmlns:saml2="urn:oasis:names:tc:SAML:2.0:assertion" ID="_1">'
+        f'<saml2:Conditions NotBefore="2026-01-01T10:00:00.000Z" NotOnOrAfter="{not_on_or_after}"/>'
+        '</saml2:Assertion>'
+    )
+
+
+def future_token(seconds=3600):
+    expiry = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(time.time() + seconds))
+    return saml_token(expiry)
+
+
+class NotAuthenticated(Exception):  # noqa: N818 - named like the pyVmomi fault
+    pass
+
+
+@pytest.fixture
+def sso():
+    """Fixture to create a VCenterSSO instance with mocked STS and SSO admin API"""
+    sso = VCenterSSO(dry_run=False)
+    sso.set_ad_ttu_credentials("user@domain", "password")
+    with patch("vcenter_operator.vcenter_sso.sso") as fn_sso, patch("vcenter_operator.vcenter_sso.pyVmomi"):
+        sso.fn_get_token = fn_sso.SsoAuthenticator.return_value.get_bearer_saml_assertion
+        sso.fn_get_token.return_value = future_token()
+        yield sso
+
+
+def test_saml_token_expiry():
+    assert _saml_token_expiry(saml_token("2026-01-01T11:00:00.000Z")) == 1767265200
+    assert _saml_token_expiry("not a token") is None
+    assert _saml_token_expiry(saml_token("garbage")) is None
+
+
+def test_is_authentication_fault():
+    assert _is_authentication_fault(NotAuthenticated())
+    assert not _is_authentication_fault(ConnectionResetError())
+
+
+def test_token_reused_for_reconnect(sso):
+    sso.connect(HOST)
+    del sso.sso_admin_instances[HOST]
+    sso.connect(HOST)
+
+    sso.fn_get_token.assert_called_once()
+
+
+def test_expired_token_renewed(sso):
+    sso.fn_get_token.return_value = future_token(seconds=30)
+    sso.connect(HOST)
+    sso.connect(HOST)
+
+    assert sso.fn_get_token.call_count == 2
+
+
+def test_session_renewed_proactively(sso):
+    api = sso._get_api_instance(HOST)
+    sso.sso_admin_instances[HOST]["login_time"] -= 60 * 60
+
+    with patch.object(VCenterSSO, "connect", wraps=sso.connect) as fn_connect:
+        sso._get_api_instance(HOST)
+        fn_connect.assert_called_once_with(HOST)
+
+    assert api is not None
+    sso.fn_get_token.assert_called_once()
+
+
+def test_transient_error_keeps_session(sso):
+    api = sso._get_api_instance(HOST)
+    api.principalDiscoveryService.FindUsers.side_effect = ConnectionResetError()
+
+    with pytest.raises(SSOSkippedError):
+        sso.list_service_users(HOST, "service_")
+
+    assert sso.sso_admin_instances[HOST]["api"] is api
+    assert HOST in sso.saml_tokens
+
+
+def test_authentication_fault_drops_session(sso):
+    api = sso._get_api_instance(HOST)
+    api.principalDiscoveryService.FindUsers.side_effect = NotAuthenticated()
+
+    with pytest.raises(SSOSkippedError):
+        sso.list_service_users(HOST, "service_")
+
+    assert HOST not in sso.sso_admin_instances
+    assert HOST not in sso.saml_tokens
@@ -0,0 +1,46 @@
+from unittest.mock import patch
+
+import pytest
+
+from vcenter_operator.templates import K8sEnvironment, TemplateBytecodeCache
+
+CUSTOM = {"variable_start_string": "{=", "variable_end_string": "=}"}
+SOURCE = "name: {{ name }} {= name =}"
+
+
+def environment(cache_dir, mapping):
+    env = K8sEnvironment()
+    env.bytecode_cache = TemplateBytecodeCache(str(cache_dir))
+    env.loaders[0].mapping = mapping
+    return env
+
+
+@pytest.fixture
+def mapping():
+    return {
+        "vcenter_cluster/ns/default.yaml.j2": ("1", SOURCE, {}, None),
+        "vcenter_cluster/ns/custom.yaml.j2": ("1", SOURCE, dict(CUSTOM), None),
+    }
+
+
+def test_restart_loads_compiled_templates(tmp_path, mapping):
+    first = environment(tmp_path, mapping)
+    assert first.get_template("vcenter_cluster/ns/default.yaml.j2").render(name="a") == "name: a {= name =}"
+    assert first.get_template("vcenter_cluster/ns/custom.yaml.j2").render(name="a") == "name: {{ name }} a"
+    assert len(list(tmp_path.iterdir())) == 2
+
+    # After a restart
+    restarted = environment(tmp_path, dict(mapping))
+    with patch.object(K8sEnvironment, "compile", side_effect=AssertionError("compiled")):
+        assert restarted.get_template("vcenter_cluster/ns/default.yaml.j2").render(name="b") == "name: b {= name =}"
+        assert restarted.get_template("vcenter_cluster/ns/custom.yaml.j2").render(name="b") == "name: {{ name }} b"
+
+
+def test_changed_options_compile_again(tmp_path, mapping):
+    environment(tmp_path, mapping).get_template("vcenter_cluster/ns/custom.yaml.j2")
+
+    # Same source, but other delimiters
+    mapping["vcenter_cluster/ns/custom.yaml.j2"] = ("2", SOURCE, {}, None)
+    restarted = environment(tmp_path, mapping)
+    assert restarted.get_template("vcenter_cluster/ns/custom.yaml.j2").render(name="b") == "name: b {= name =}"
+    assert len(list(tmp_path.iterdir())) == 2
@@ -0,0 +1,54 @@
+from vcenter_operator.phelm import DeploymentState
+from vcenter_operator.templates import env
+
+YAML = """apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: {{ name }}-yaml
+data:
+  nova.conf: |
+{{ config | indent(4, true) }}
+"""
+JSON = """[
+  {"apiVersion": "v1", "kind": "ConfigMap", "metadata": {"name": "{{ name }}-json"},
+   "data": {"nova.conf": {{ config | tojson }}}}{% for i in range(2) %},
+  {"apiVersion": "v1", "kind": "Secret", "metadata": {"name": "{{ name }}-{{ i }}"}}{% endfor %}
+]
+"""
+SINGLE = '{"apiVersion": "v1", "kind": "ConfigMap", "metadata": {"name": {{ name | tojson }}}}'
+
+
+TEMPLATES = {
+    "vcenter_cluster/ns/yaml.yaml.j2": ("21", YAML, {}, None),
+    "vcenter_cluster/ns/json.yaml.j2": ("22", JSON, {"output-format": "json"}, None),
+    "vcenter_cluster/ns/single.yaml.j2": ("23", SINGLE, {"output-format": "json"}, None),
+}
+
+
+def test_json_output_format(templates):
+    config = "[DEFAULT]\nhost = \"nova-compute-bb1\"\n"
+    state = DeploymentState()
+    state.render("vcenter_cluster", {"name": "bb1", "config": config}, {}, {})
+
+    assert sorted(state.items) == [
+        ("v1", "ConfigMap", "bb1", "ns"),
+        ("v1", "ConfigMap", "bb1-json", "ns"),
+        ("v1", "ConfigMap", "bb1-yaml", "ns"),
+        ("v1", "Secret", "bb1-0", "ns"),
+        ("v1", "Secret", "bb1-1", "ns"),
+    ]
+    # Both formats result in the same data
+    assert state.items[("v1", "ConfigMap", "bb1-json", "ns")].load()["data"] == \
+        state.items[("v1", "ConfigMap", "bb1-yaml", "ns")].load()["data"] == {"nova.conf": config}
+
+
+def test_invalid_json_output(templates, caplog):
+    templates["vcenter_cluster/ns/single.yaml.j2"] = ("24", "{'not': 'json'}", {"output-format": "json"}, None)
+    templates["vcenter_cluster/ns/json.yaml.j2"] = ("25", JSON, {"output-format": "toml"}, None)
+    env.loaders[0].mapping = dict(templates)
+    state = DeploymentState()
+    state.render("vcenter_cluster", {"name": "bb1", "config": ""}, {}, {})
+
+    assert list(state.items) == [("v1", "ConfigMap", "bb1-yaml", "ns")]
+    assert "Failed to render vcenter_cluster/ns/single.yaml.j2" in caplog.text
+    assert "Unknown output-format toml" in caplog.text
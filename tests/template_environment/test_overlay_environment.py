@@ -0,0 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from vcenter_operator.templates import K8sEnvironment
+
+CUSTOM = {"variable_start_string": "{=", "variable_end_string": "=}"}
+
+
+@pytest.fixture
+def env():
+    """Fixture to create an environment with templates with and without jinja2_options"""
+    env = K8sEnvironment()
+    env.loaders[0].mapping = {
+        "vcenter_cluster/ns/default.yaml.j2": ("1", "name: {{ name }} {= name =}", {}, None),
+        "vcenter_cluster/ns/custom.yaml.j2": ("1", "name: {{ name }} {= name =}", dict(CUSTOM), None),
+        "vcenter_cluster/ns/same.yaml.j2": ("1", "other: {= name =}", dict(CUSTOM, **{"uses-service-user": "x"}),
+                                            None),
+        "vcenter_cluster/ns/include.yaml.j2": ("1", "{= name | render('vcenter_cluster/ns/default.yaml.j2') =}",
+                                               dict(CUSTOM), None),
+    }
+    env.filters["render"] = lambda name, template_name: env.get_template(template_name).render(name=name)
+    return env
+
+
+def test_options_do_not_leak(env):
+    assert env.get_template("vcenter_cluster/ns/custom.yaml.j2").render(name="a") == "name: {{ name }} a"
+    assert env.get_template("vcenter_cluster/ns/default.yaml.j2").render(name="a") == "name: a {= name =}"
+
+    # The shared environment is untouched
+    assert env.variable_start_string == "{{"
+
+
+def test_overlay_per_option_set(env):
+    custom = env.get_template("vcenter_cluster/ns/custom.yaml.j2")
+    same = env.get_template("vcenter_cluster/ns/same.yaml.j2")
+
+    assert custom.environment is same.environment
+    assert custom.environment is not env
+    assert len(env.overlays) == 1
+    # Compiled once
+    assert env.get_template("vcenter_cluster/ns/custom.yaml.j2") is custom
+
+
+def test_included_templates_use_their_own_options(env):
+    assert env.get_template("vcenter_cluster/ns/include.yaml.j2").render(name="a") == "name: a {= name =}"
+
+
+def test_recompiled_on_new_version(env):
+    custom = env.get_template("vcenter_cluster/ns/custom.yaml.j2")
+    env.loaders[0].mapping["vcenter_cluster/ns/custom.yaml.j2"] = ("2", "changed: {= name =}", dict(CUSTOM), None)
+
+    template = env.get_template("vcenter_cluster/ns/custom.yaml.j2")
+    assert template is not custom
+    assert template.render(name="a") == "changed: a"
+
+
+def test_concurrent_rendering(env):
+    names = ["vcenter_cluster/ns/custom.yaml.j2", "vcenter_cluster/ns/default.yaml.j2"] * 50
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda name: env.get_template(name).render(name="a"), names))
+
+    assert results == ["name: {{ name }} a", "name: a {= name =}"] * 50
@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+
+from vcenter_operator.phelm import APPLYSET_PART_OF_LABEL, VCENTER_LABEL, DeploymentState
+from vcenter_operator.render_pool import RenderPool
+from vcenter_operator.templates import env
+
+VCENTER = "vc-a-0.cc.region.cloud.sap"
+CONFIGMAP = """apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: {{ name }}-config
+data:
+  value: "{{ value }}"
+"""
+SECRET = """apiVersion: v1
+kind: Secret
+metadata:
+  name: {{ name }}-secret
+"""
+
+
+TEMPLATES = {
+    "vcenter_cluster/ns/config.yaml.j2": ("1", CONFIGMAP, {}, None),
+    "vcenter_cluster/ns/secret.yaml.j2": ("1", SECRET, {}, None),
+    "vcenter_datacenter/ns/config.yaml.j2": ("1", CONFIGMAP, {}, None),
+}
+
+
+def render_in_process(jobs):
+    state = DeploymentState(compress=True, vcenter=VCENTER, applyset=SimpleNamespace(id="applyset-x-v1"))
+    for scope, options in jobs:
+        state.render(scope, options, {}, {})
+    return state
+
+
+def test_render_pool_matches_in_process_rendering(templates):
+    jobs = [("vcenter_cluster", {"name": f"bb{i}", "value": i}) for i in range(6)]
+    jobs.append(("vcenter_datacenter", {"name": "az", "value": "dc"}))
+    expected = render_in_process(jobs)
+    pool = RenderPool(2)
+    try:
+        state = DeploymentState(compress=True, vcenter=VCENTER, applyset=SimpleNamespace(id="applyset-x-v1"))
+        pool.render(state, jobs, {}, {})
+        executor = pool.executor
+
+        # Same templates, same workers
+        pool.render(DeploymentState(), jobs[:1], {}, {})
+        assert pool.executor is executor
+
+        # New templates, new workers
+        templates["vcenter_cluster/ns/config.yaml.j2"] = ("2", CONFIGMAP + "  other: x\n", {}, None)
+        env.loaders[0].mapping = dict(templates)
+        changed = DeploymentState()
+        pool.render(changed, jobs[:1], {}, {})
+        assert pool.executor is not executor
+    finally:
+        pool.shutdown()
+
+    assert list(state.items) == list(expected.items)
+    assert [stored.digest for stored in state.items.values()] == [stored.digest for stored in expected.items.values()]
+
+    labels = state.items[("v1", "ConfigMap", "bb0-config", "ns")].load()["metadata"]["labels"]
+    assert labels[VCENTER_LABEL] == VCENTER
+    assert labels[APPLYSET_PART_OF_LABEL] == "applyset-x-v1"
+    assert changed.items[("v1", "ConfigMap", "bb0-config", "ns")].load()["data"]["other"] == "x"
+
+
+def test_render_pool_replaced_after_worker_died(templates):
+    jobs = [("vcenter_cluster", {"name": f"bb{i}", "value": i}) for i in range(4)]
+    expected = render_in_process(jobs)
+    pool = RenderPool(2)
+    try:
+        pool.render(DeploymentState(), jobs[:1], {}, {})
+        for process in list(pool.executor._processes.values()):
+            process.kill()
+            process.join()
+
+        state = DeploymentState(compress=True, vcenter=VCENTER, applyset=SimpleNamespace(id="applyset-x-v1"))
+        pool.render(state, jobs, {}, {})
+        # Rendered in the operator process instead, the broken pool is dropped
+        assert pool.executor is None
+        assert [stored.digest for stored in state.items.values()] == [
+            stored.digest for stored in expected.items.values()]
+
+        state = DeploymentState()
+        pool.render(state, jobs[:1], {}, {})
+        assert pool.executor is not None
+        assert list(state.items) == [("v1", "Secret", "bb0-secret", "ns"), ("v1", "ConfigMap", "bb0-config", "ns")]
+    finally:
+        pool.shutdown()
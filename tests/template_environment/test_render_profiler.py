@@ -0,0 +1,62 @@
+from vcenter_operator.phelm import DeploymentState
+from vcenter_operator.profiler import DURATION_BUCKETS, RenderProfiler, TemplateCost, profiler
+
+CONFIGMAP = """apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: {{ name }}-config
+data:
+  value: "{{ value }}"
+"""
+
+
+TEMPLATES = {
+    "vcenter_cluster/ns/config.yaml.j2": ("31", CONFIGMAP, {}, None),
+    "vcenter_cluster/ns/secrets.yaml.j2": ("32", "{% for i in range(3) %}---\napiVersion: v1\nkind: Secret\n"
+                                                 "metadata:\n  name: {{ name }}-{{ i }}\n{% endfor %}", {}, None),
+}
+
+
+def test_render_records_costs(templates):
+    profiler.reset()
+    last = None
+    for _ in range(2):
+        state = DeploymentState(last_renders=last.renders if last else {})
+        for name in ("bb1", "bb2"):
+            state.render("vcenter_cluster", {"name": name, "value": "a"}, {}, {})
+        last = state
+
+    config = profiler.current[("vcenter_cluster/ns/config.yaml.j2", "vcenter_cluster")]
+    secrets = profiler.current[("vcenter_cluster/ns/secrets.yaml.j2", "vcenter_cluster")]
+    # The second loop reused the renders of the first one
+    assert (config.renders, config.reused, config.items) == (2, 2, 2)
+    assert (secrets.renders, secrets.reused, secrets.items) == (2, 2, 6)
+    assert secrets.output_chars > config.output_chars > 0
+    assert config.render_seconds > 0 and config.parse_seconds > 0
+    assert sum(profiler.histograms["render"]) == 4
+    assert sum(profiler.histograms["compile"]) == 8
+
+
+def test_report_over_last_loops():
+    profiler = RenderProfiler(loops=2)
+    for seconds in (10.0, 1.0, 2.0):
+        profiler.record("slow.yaml.j2", "vcenter_cluster", "render", seconds)
+        profiler.record_output("slow.yaml.j2", "vcenter_cluster", 100, 1)
+        profiler.record("fast.yaml.j2", "vcenter_datacenter", "parse", 0.0005)
+        profiler.end_loop()
+
+    # The first loop is forgotten
+    assert profiler.costs()[("slow.yaml.j2", "vcenter_cluster")] == TemplateCost(
+        renders=2, render_seconds=3.0, output_chars=200, items=2)
+    assert profiler.histograms["render"][len(DURATION_BUCKETS)] == 1
+
+    lines = profiler.report(top=1)
+    assert lines[0] == "Render cost of the last 2 loops, top 1 of 2 templates and scopes:"
+    assert lines[1].startswith("  slow.yaml.j2 (vcenter_cluster): 3.000s,")
+    assert lines[-1].startswith("  parse durations: <=0.001s: 3, <=0.005s: 0")
+
+    worker = RenderProfiler()
+    worker.record("slow.yaml.j2", "vcenter_cluster", "render", 0.2)
+    profiler.merge(worker.current, worker.histograms)
+    assert profiler.current[("slow.yaml.j2", "vcenter_cluster")].render_seconds == 0.2
+    assert profiler.histograms["render"][DURATION_BUCKETS.index(0.5)] == 1
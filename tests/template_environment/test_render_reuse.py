@@ -0,0 +1,105 @@
+from unittest.mock import patch
+
+from vcenter_operator.phelm import RENDER_MEMO_BYTES, VCENTER_LABEL, DeploymentState, load_all, render_memo
+from vcenter_operator.templates import env
+
+CONFIGMAP = """apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: {{ name }}-config
+data:
+  value: "{{ value }}"
+{% include 'vcenter_cluster/ns/labels.j2' %}
+"""
+CONTEXT = """apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: {{ context()['name'] }}-context
+"""
+LABELS = """  labels: "{{ labels }}"
+"""
+
+
+TEMPLATES = {
+    "vcenter_cluster/ns/config.yaml.j2": ("11", CONFIGMAP, {}, None),
+    "vcenter_cluster/ns/context.yaml.j2": ("12", CONTEXT, {}, None),
+    "vcenter_cluster/ns/labels.j2": ("13", LABELS, {}, None),
+}
+
+
+def test_template_dependencies(templates):
+    dependencies = env.template_dependencies("vcenter_cluster/ns/config.yaml.j2")
+    assert dependencies.variables == {"name", "value", "labels"}
+    assert dependencies.versions == (
+        ("vcenter_cluster/ns/config.yaml.j2", "11"), ("vcenter_cluster/ns/labels.j2", "13"))
+
+    assert env.template_dependencies("vcenter_cluster/ns/context.yaml.j2").variables is None
+
+    templates["vcenter_cluster/ns/labels.j2"] = ("14", "{{ 'vcenter_cluster/ns/other.j2' | render }}", {}, None)
+    templates["vcenter_cluster/ns/other.j2"] = ("15", "{{ other | derive_password }}", {}, None)
+    dependencies = env.template_dependencies("vcenter_cluster/ns/config.yaml.j2")
+    assert dependencies.variables == {"name", "value", "other", "username", "host", "master_password"}
+    assert [path for path, _ in dependencies.versions] == [
+        "vcenter_cluster/ns/config.yaml.j2", "vcenter_cluster/ns/labels.j2", "vcenter_cluster/ns/other.j2"]
+
+
+def render(options, last=None):
+    state = DeploymentState(last_renders=last.renders if last else {})
+    state.render("vcenter_cluster", options, {}, {})
+    return state
+
+
+def test_reuse_unchanged_renders(templates):
+    options = {"name": "bb1", "value": "a", "labels": "x", "unrelated": 1}
+    first = render(options)
+
+    with patch("jinja2.Template.render", side_effect=AssertionError("rendered")):
+        second = render(dict(options), first)
+    assert list(second.items) == list(first.items)
+    assert not first.delta(second).items
+
+    # The template referencing the whole context is rendered again
+    with patch.object(DeploymentState, "_add_items", autospec=True,
+                      side_effect=DeploymentState._add_items) as fn_render:
+        third = render(dict(options, unrelated=3), second)
+    assert [call.args[4] for call in fn_render.call_args_list] == ["vcenter_cluster/ns/context.yaml.j2"]
+
+    # So is a template including a changed template
+    templates["vcenter_cluster/ns/labels.j2"] = ("16", '  labels: "{{ labels }}-2"\n', {}, None)
+    fourth = render(dict(options, unrelated=3), third)
+    changed = third.delta(fourth)
+    assert list(changed.items) == [("v1", "ConfigMap", "bb1-config", "ns")]
+    assert changed.items[("v1", "ConfigMap", "bb1-config", "ns")].load()["data"]["labels"] == "x-2"
+
+    # And one with a changed option it references
+    fifth = render(dict(options, value="b", unrelated=3), fourth)
+    assert list(fourth.delta(fifth).items) == [("v1", "ConfigMap", "bb1-config", "ns")]
+
+
+def test_render_memo_shared_between_vcenters(templates):
+    options = {"name": "bb1", "value": "a", "labels": "x"}
+    render_memo.clear()
+    render_memo.hits = render_memo.misses = 0
+
+    first = DeploymentState(vcenter="vc-a-0")
+    first.render("vcenter_cluster", dict(options, vcenter_name="vc-a-0"), {}, {})
+    with patch("vcenter_operator.phelm.load_all", wraps=load_all) as fn_parse:
+        second = DeploymentState(vcenter="vc-b-0")
+        second.render("vcenter_cluster", dict(options, vcenter_name="vc-b-0"), {}, {})
+
+    # Only the template referencing the whole context is rendered for both
+    assert fn_parse.call_count == 1
+    assert (render_memo.hits, render_memo.misses) == (1, 3)
+    _id = ("v1", "ConfigMap", "bb1-config", "ns")
+    assert second.items[_id].load()["metadata"]["labels"][VCENTER_LABEL] == "vc-b-0"
+    assert first.items[_id].load()["data"] == second.items[_id].load()["data"]
+
+    # Kept compressed, the least recently used entries are dropped to stay within the bytes
+    assert render_memo.size == sum(len(data) for data in render_memo.entries.values())
+    render_memo.max_bytes = render_memo.size
+    render_memo.put(("other", (), ""), [{"data": "x" * 10000}])
+    assert render_memo.size <= render_memo.max_bytes
+    assert len(render_memo.entries[("other", (), "")]) < 1000
+    assert render_memo.get(("other", (), "")) == [{"data": "x" * 10000}]
+    assert len(render_memo.entries) < 4
+    render_memo.max_bytes = RENDER_MEMO_BYTES
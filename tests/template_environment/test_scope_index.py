@@ -0,0 +1,64 @@
+from unittest.mock import patch
+
+from vcenter_operator.templates import K8sEnvironment, VCenterTemplateCRDLoader
+
+OWNER = {"kind": "VCenterTemplate", "name": "a"}
+
+
+def mapping():
+    return {
+        "vcenter_cluster/ns/b.yaml.j2": ("1", "b", {}, OWNER),
+        "vcenter_cluster/ns/a.yaml.j2": ("1", "a", {"uses-service-user": "x"}, OWNER),
+        "vcenter_datacenter/ns/c.yaml.j2": ("1", "c", {}, None),
+        "vcenter_cluster/ns/macros.j2": ("1", "", {}, None),
+    }
+
+
+def test_list_scope_templates():
+    env = K8sEnvironment()
+    env.loaders[0].mapping = mapping()
+
+    assert env.list_scope_templates("vcenter_cluster") == [
+        ("vcenter_cluster/ns/a.yaml.j2", {"uses-service-user": "x"}, OWNER),
+        ("vcenter_cluster/ns/b.yaml.j2", {}, OWNER),
+    ]
+    assert [path for path, _, _ in env.list_scope_templates("vcenter_datacenter")] == [
+        "vcenter_datacenter/ns/c.yaml.j2"]
+    assert env.list_scope_templates("vcenter_unknown") == []
+    assert env.get_jinja2_options("vcenter_cluster/ns/a.yaml.j2") == {"uses-service-user": "x"}
+    assert env.get_source_owner("vcenter_cluster/ns/b.yaml.j2") == OWNER
+    assert env.get_source_owner("vcenter_cluster/ns/unknown.yaml.j2") is None
+
+
+def test_index_rebuilt_only_on_new_mapping():
+    env = K8sEnvironment()
+    env.loaders[0].mapping = mapping()
+
+    with patch.object(VCenterTemplateCRDLoader, "_build_index", wraps=env.loaders[0]._build_index) as fn_build:
+        for _ in range(3):
+            env.list_scope_templates("vcenter_cluster")
+            env.get_jinja2_options("vcenter_cluster/ns/a.yaml.j2")
+        assert fn_build.call_count == 1
+
+        env.loaders[0].mapping = {"vcenter_cluster/ns/d.yaml.j2": ("1", "d", {}, None)}
+        assert [path for path, _, _ in env.list_scope_templates("vcenter_cluster")] == [
+            "vcenter_cluster/ns/d.yaml.j2"]
+        assert fn_build.call_count == 2
+
+
+def test_index_kept_on_unchanged_poll():
+    env = K8sEnvironment()
+    env.loaders[0].mapping = mapping()
+    index = env.template_index()
+    generation = env.loaders[0].generation
+
+    # Polling sets an equal, but new mapping
+    env.loaders[0].mapping = mapping()
+    assert env.loaders[0].generation == generation
+    assert env.template_index() is index
+
+    changed = mapping()
+    changed["vcenter_cluster/ns/b.yaml.j2"] = ("2", "b", {"uses-service-user": "y"}, OWNER)
+    env.loaders[0].mapping = changed
+    assert env.template_index() is not index
+    assert env.get_jinja2_options("vcenter_cluster/ns/b.yaml.j2") == {"uses-service-user": "y"}
@@ -0,0 +1,174 @@
+import base64
+import hashlib
+import json
+import logging
+
+from kubernetes import client as k8s_client
+from kubernetes import dynamic
+
+from vcenter_operator.phelm import (
+    APPLYSET_PART_OF_LABEL,
+    FIELD_MANAGER,
+    METADATA_LIST_ACCEPT,
+    TEMPLATE_LABEL,
+    DeploymentState,
+    label_value,
+)
+
+LOG = logging.getLogger(__name__)
+
+# See https://kubernetes.io/docs/reference/labels-annotations-taints/#applyset-kubernetes-io-id
+APPLYSET_ID_LABEL = "applyset.kubernetes.io/id"
+APPLYSET_TOOLING_ANNOTATION = "applyset.kubernetes.io/tooling"
+APPLYSET_GROUP_KINDS_ANNOTATION = "applyset.kubernetes.io/contains-group-kinds"
+APPLYSET_NAMESPACES_ANNOTATION = "applyset.kubernetes.io/additional-namespaces"
+APPLYSET_TOOLING = "vcenter-operator/v1"
+
+
+def _group_kind(api_version, kind):
+    """Return the group kind as used in the ApplySet annotations, e.g. Deployment.apps or Secret"""
+    group = api_version.rpartition('/')[0]
+    return f"{kind}.{group}" if group else kind
+
+
+def _split_list(value):
+    return {v for v in (value or '').split(',') if v}
+
+
+class ApplySet:
+    """The set of objects applied for one vCenter, recorded in a parent ConfigMap in our namespace
+
+    The members are labelled with the id of the set, so the objects no longer rendered can be found
+    and pruned with label-selected list calls over the kinds and namespaces recorded in the parent,
+    even if they were rendered by a template removed while the operator was not running.
+    """
+
+    def __init__(self, vcenter, namespace):
+        self.name = f"vcenter-operator-applyset-{vcenter.lower()}"
+        self.namespace = namespace
+        key = f"{self.name}.{self.namespace}.ConfigMap."
+        digest = base64.urlsafe_b64encode(hashlib.sha256(key.encode('utf-8')).digest()).decode('ascii')
+        self.id = f"applyset-{digest.rstrip('=')}-v1"
+        # The group kinds and namespaces recorded in the parent, fetched on first use
+        self.recorded = None
+
+    def _resource(self):
+        return DeploymentState.get_resource(api_version='v1', kind='ConfigMap')
+
+    def _fetch(self):
+        """Return the group kinds and namespaces recorded in the parent"""
+        try:
+            parent = DeploymentState.get_client().get(self._resource(), name=self.name, namespace=self.namespace)
+        except k8s_client.rest.ApiException as e:
+            if e.status == 404:
+                return set(), set()
+            raise
+        annotations = parent.metadata.annotations or {}
+        return (_split_list(annotations.get(APPLYSET_GROUP_KINDS_ANNOTATION)),
+                _split_list(annotations.get(APPLYSET_NAMESPACES_ANNOTATION)))
+
+    def _record(self, group_kinds, namespaces, dry_run):
+        namespaces = namespaces - {self.namespace}
+        parent = {
+            'apiVersion': 'v1',
+            'kind': 'ConfigMap',
+            'metadata': {
+                'name': self.name,
+                'namespace': self.namespace,
+                'labels': {APPLYSET_ID_LABEL: self.id},
+                'annotations': {
+                    APPLYSET_TOOLING_ANNOTATION: APPLYSET_TOOLING,
+                    APPLYSET_GROUP_KINDS_ANNOTATION: ','.join(sorted(group_kinds)),
+                    APPLYSET_NAMESPACES_ANNOTATION: ','.join(sorted(namespaces)),
+                },
+            },
+        }
+        resource_args = {'name': self.name, 'namespace': self.namespace, 'field_manager': FIELD_MANAGER}
+        if dry_run:
+            resource_args['dry_run'] = "All"
+        else:
+            self.recorded = (set(group_kinds), namespaces)
+        DeploymentState.get_client().server_side_apply(self._resource(), parent, force_conflicts=True,
+                                                       **resource_args)
+
+    @staticmethod
+    def _contents(ids):
+        group_kinds = {_group_kind(api_version, kind) for api_version, kind, _, _ in ids}
+        namespaces = {namespace for _, _, _, namespace in ids if namespace}
+        return group_kinds, namespaces
+
+    def extend(self, state):
+        """Record the group kinds and namespaces of the state in the parent before applying it.
+           The ones recorded before are kept until they have been pruned.
+        """
+        self.extend_ids(state.items, state.dry_run)
+
+    def extend_ids(self, ids, dry_run=False):
+        """Record the group kinds and namespaces of the items with the ids, if not recorded yet"""
+        if self.recorded is None:
+            self.recorded = self._fetch()
+        group_kinds, namespaces = self._contents(ids)
+        if group_kinds <= self.recorded[0] and namespaces - {self.namespace} <= self.recorded[1]:
+            return
+        self._record(group_kinds | self.recorded[0], namespaces | self.recorded[1], dry_run)
+
+    def members(self, resource, namespace):
+        """Return the names and template labels of the members of the resource in the namespace,
+           listing only their metadata
+        """
+        resp = DeploymentState.get_client().get(resource, namespace=namespace if resource.namespaced else None,
+                                                label_selector=f"{APPLYSET_PART_OF_LABEL}={self.id}",
+                                                header_params={'Accept': METADATA_LIST_ACCEPT}, serialize=False)
+        return [(item['metadata']['name'], (item['metadata'].get('labels') or {}).get(TEMPLATE_LABEL))
+                for item in json.loads(resp.data).get('items') or []]
+
+    def prune(self, state):
+        """Delete the members which are not in the state anymore, then record only the contents of the state.
+           Members of templates which failed to render are kept, as they are missing from the state as well.
+           Returns the number of pruned objects.
+        """
+        if self.recorded is None:
+            self.recorded = self._fetch()
+        failed = {label_value(template) for template, _ in state.failed}
+        group_kinds, namespaces = self._contents(state.items)
+        group_kinds |= self.recorded[0]
+        namespaces |= self.recorded[1] | {self.namespace}
+
+        rendered = set()
+        for api_version, kind, name, namespace in state.items:
+            rendered.add((_group_kind(api_version, kind), name, namespace))
+            # Cluster-scoped objects carry the namespace of their template in the state
+            rendered.add((_group_kind(api_version, kind), name, None))
+
+        pruned = state._derive()
+        kept = 0
+        try:
+            for group_kind in sorted(group_kinds):
+                kind, _, group = group_kind.partition('.')
+                resource = DeploymentState.get_client().resources.get(group=group, kind=kind, preferred=True)
+                for namespace in sorted(namespaces) if resource.namespaced else [None]:
+                    for name, template in self.members(resource, namespace):
+                        if (group_kind, name, namespace) in rendered:
+                            continue
+                        if template in failed:
+                            kept += 1
+                        else:
+                            pruned.actions[(resource.group_version, kind, name, namespace)] = 'delete'
+        except (k8s_client.rest.ApiException, dynamic.exceptions.ResourceNotFoundError) as e:
+            # Rather keep the recorded contents as they are than forgetting about objects to prune
+            LOG.warning("Could not list the members of %s for pruning: %s", self.name, e)
+            return 0
+
+        if kept:
+            LOG.warning("Not pruning %d objects of the %d templates which failed to render for %s",
+                        kept, len(failed), state.vcenter)
+        if pruned.actions:
+            LOG.info("Pruning %d objects no longer rendered for %s", len(pruned.actions), state.vcenter)
+            pruned.apply()
+        group_kinds, namespaces = self._contents(state.items)
+        if failed:
+            # The kept members have to stay recorded to be pruned after their template renders again
+            group_kinds |= self.recorded[0]
+            namespaces |= self.recorded[1]
+        self._record(group_kinds, namespaces, state.dry_run)
+        return len(pruned.actions)
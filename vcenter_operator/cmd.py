@@ -13,6 +13,8 @@ from vcenter_operator.configurator import Configurator
 
 # Import discovery before configurator as there is some monkeypatching going on
 from vcenter_operator.discovery import DnsDiscovery
+from vcenter_operator.profiler import profiler
+from vcenter_operator.templates import TemplateBytecodeCache, env
 
 LOG = logging.getLogger(__name__)
 
@@ -22,12 +24,23 @@ def handle_term(signum, frame):
     sys.exit(0)
 
 
+def handle_report(signum, frame):
+    profiler.log_report()
+
+
 signal.signal(signal.SIGTERM, handle_term)
+# kill -USR1 <pid> logs which templates take the most time to render
+signal.signal(signal.SIGUSR1, handle_report)
 
 
 def _build_arg_parser():
     args = argparse.ArgumentParser()
     args.add_argument('--dry-run', action='store_true', default=False)
+    args.add_argument('--dry-run-mode', choices=['client', 'server'], default='client',
+                      help="client: report a diff against the live objects without requests per item, "
+                           "server: send each item as server-side dry-run")
+    args.add_argument('--bytecode-cache-dir', default=os.environ.get('BYTECODE_CACHE_DIR'),
+                      help="directory to keep the compiled templates in across restarts, e.g. an emptyDir")
     return args
 
 
@@ -36,7 +49,7 @@ def main():
     extend_pyvmomi()
 
     args = _build_arg_parser().parse_args(sys.argv[1:])
-    global_options = {'dry_run': str(args.dry_run)}
+    global_options = {'dry_run': str(args.dry_run), 'dry_run_mode': args.dry_run_mode}
 
     log_level = logging.INFO
     if 'LOG_LEVEL' in os.environ:
@@ -79,6 +92,10 @@ def main():
         region = domain.split('.')[1]
         global_options['region'] = region
 
+    if args.bytecode_cache_dir:
+        os.makedirs(args.bytecode_cache_dir, exist_ok=True)
+        env.bytecode_cache = TemplateBytecodeCache(args.bytecode_cache_dir)
+
     if 'SERVICE_DOMAIN' in os.environ:
         domain = os.environ['SERVICE_DOMAIN']
 
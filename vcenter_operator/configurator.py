@@ -18,11 +18,19 @@ from pyVim.connect import Disconnect, SmartConnect
 from pyVmomi import vim
 
 import vcenter_operator.vcenter_util as vcu
+from vcenter_operator.applyset import ApplySet
+from vcenter_operator.diff import diff_report
+from vcenter_operator.informer import OwnedObjectInformer
+from vcenter_operator.limiter import AdaptiveLimiter
 from vcenter_operator.nsxt_user_manager import NotAuthorizedError, NSXTSkippedError, NsxtUserAPIHelper
-from vcenter_operator.phelm import DeploymentState
+from vcenter_operator.phelm import RENDER_MEMO_BYTES, DeploymentState, render_memo
+from vcenter_operator.pipeline import ApplyPipeline
+from vcenter_operator.profiler import profiler
+from vcenter_operator.render_pool import RenderPool
+from vcenter_operator.schema import SchemaCache
 from vcenter_operator.templates import env, vcenter_service_user_crd_loader
 from vcenter_operator.util import parse_buildingblock
-from vcenter_operator.vault import Vault, VaultSecretNotReplicatedError, VaultUnavailableError
+from vcenter_operator.vault import Vault, VaultSecretNotReplicatedError, VaultUnavailableError, latest_secret_version
 from vcenter_operator.vault_cache import NSXTCacheError, NSXTManagementCache
 from vcenter_operator.vcenter_sso import SSOSkippedError, VCenterSSO
 
@@ -76,7 +84,22 @@ class Configurator:
         self.service_users = dict()
         self.last_service_user_check = dict()
         self.vcenter_service_user_tracker = defaultdict(lambda: defaultdict(dict))
+        # NSX-T user management helpers per BB, their user index is valid for one pass
+        self.nsxt_helpers = dict()
+        # Service-users to add to the Administrators group per vCenter, added in one call per pass
+        self.pending_sso_group_members = defaultdict(list)
         self.states = dict()
+        # Watches the objects we applied to re-apply the ones changed or deleted by someone else
+        self.informer = None
+        # ApplySets per vCenter and when their members were last pruned
+        self.applysets = dict()
+        self.last_prune = dict()
+        # OpenAPI schemas to validate the rendered items with before applying them
+        self.schema_cache = SchemaCache(DeploymentState.get_client)
+        # Renders the templates in worker processes, if enabled
+        self.render_pool = None
+        # Adapts the number of parallel writes to the Kubernetes API over all vCenters
+        self.write_limiter = AdaptiveLimiter(1)
         self.vault = Vault(dry_run=self.global_options.get('dry_run', 'False') == 'True')
         self.nsxt_vaultcache = NSXTManagementCache(self.global_options['region'], self.vault,
                                                    cache_lifetime=60 * 30)
@@ -319,6 +342,9 @@ class Configurator:
             if self.vault.password_constraints != password_constraints:
                 self.vault.set_password_constraints(password_constraints)
 
+            # The number of passwords to prefetch from Vault for creating and rotating service-users, 0 disables it
+            self.vault.set_password_pool_size(int(b64decode(secret.data.pop('password_pool_size', "")) or 0))
+
             secret_id = b64decode(secret.data.pop('secret_id', ""))
             role_id = b64decode(secret.data.pop('role_id', ""))
             ad_ttu_username = b64decode(secret.data.pop('ad_ttu_username', ""))
@@ -357,6 +383,7 @@ class Configurator:
                 self.vcenter_sso.set_ad_ttu_credentials(ad_ttu_username_complete, ad_ttu_password)
 
             self.vault.login()
+            self.vault.fill_password_pool()
 
         username = b64decode(secret.data.pop('username', '')) or None
         password = b64decode(secret.data.pop('password', '')) or None
@@ -407,6 +434,41 @@ class Configurator:
 
         return True
 
+    def _get_applyset(self, host):
+        applyset = self.applysets.get(host)
+        if applyset is None:
+            applyset = self.applysets[host] = ApplySet(host, self.namespace)
+        return applyset
+
+    def _get_render_pool(self):
+        """Return the pool of render processes, None if rendering in this process"""
+        processes = int(self.global_options.get('render_processes', 0))
+        if self.render_pool and self.render_pool.processes != processes:
+            self.render_pool.shutdown()
+            self.render_pool = None
+        if processes > 0 and self.render_pool is None:
+            self.render_pool = RenderPool(processes)
+        return self.render_pool
+
+    def _client_side_dry_run(self):
+        return self.global_options.get('dry_run', 'False') == 'True' and \
+            self.global_options.get('dry_run_mode', 'client') == 'client'
+
+    def _get_informer(self):
+        """Return the informer of the applied objects, None if drift detection is disabled.
+           In a client-side dry-run, it keeps the whole objects to diff the rendered items against.
+        """
+        if self._client_side_dry_run():
+            if self.informer is None:
+                self.informer = OwnedObjectInformer(keep_objects=True)
+            return self.informer
+        if self.global_options.get('dry_run', 'False') == 'True' or \
+                not self.global_options.get('detect_drift', True):
+            return None
+        if self.informer is None:
+            self.informer = OwnedObjectInformer()
+        return self.informer
+
     def poll(self):
         self.poll_config()
         if not self._poll_nova_cells():
@@ -423,6 +485,7 @@ class Configurator:
                 LOG.warning('Polling service user templates failed. Discontinuing current configuration run.')
                 return
 
+        render_memo.max_bytes = int(self.global_options.get('render_memo_bytes', RENDER_MEMO_BYTES))
         for host in self.vcenters:
             try:
                 values = self._poll(host)
@@ -430,21 +493,80 @@ class Configurator:
                 vc_cluster_names = list(values["clusters"])
                 self._reconcile_service_users(host, vc_cluster_names)
 
-                state = DeploymentState(dry_run=(self.global_options.get('dry_run', 'False') == 'True'))
-
-                for options in values['clusters'].values():
-                    state.render('vcenter_cluster', options, self.service_users, self.vcenter_service_user_tracker)
-
-                for options in values['datacenters'].values():
-                    state.render('vcenter_datacenter', options, self.service_users, self.vcenter_service_user_tracker)
-
+                workers = int(self.global_options.get('apply_workers', 1))
+                self.write_limiter.set_max_limit(workers)
+                validator = self.schema_cache if self.global_options.get('validate_items', True) else None
                 last = self.states.get(host)
+                last_renders = last.renders if last and self.global_options.get('reuse_renders', True) else {}
+                state = DeploymentState(dry_run=(self.global_options.get('dry_run', 'False') == 'True'),
+                                        compress=self.global_options.get('compress_state', True),
+                                        workers=workers,
+                                        vcenter=host,
+                                        limiter=self.write_limiter,
+                                        applyset=self._get_applyset(host),
+                                        validator=validator,
+                                        last_renders=last_renders)
+
+                pipeline = None
+                if last and self.global_options.get('stream_apply', False) and not self._client_side_dry_run():
+                    # Apply the changed Secrets and ConfigMaps while rendering
+                    pipeline = state.sink = ApplyPipeline(state, last)
+
+                jobs = [('vcenter_cluster', options) for options in values['clusters'].values()]
+                jobs += [('vcenter_datacenter', options) for options in values['datacenters'].values()]
+                render_pool = self._get_render_pool()
+                try:
+                    if render_pool:
+                        render_pool.render(state, jobs, self.service_users, self.vcenter_service_user_tracker)
+                    else:
+                        for scope, options in jobs:
+                            state.render(scope, options, self.service_users, self.vcenter_service_user_tracker)
+                except Exception:
+                    if pipeline:
+                        # The last state stays the baseline, so it has to know what got applied already
+                        pipeline.close(failed=True)
+                        pipeline = None
+                    raise
+                finally:
+                    if pipeline:
+                        pipeline.close()
+                    state.sink = None
+
+                informer = self._get_informer()
+                if informer:
+                    informer.watch_items(state.items)
 
                 if last:
                     delta = last.delta(state)
-                    delta.apply()
                 else:
-                    state.apply()
+                    # After a restart, only apply what differs from the last applied state
+                    delta = state.without_applied(informer)
+
+                if self._client_side_dry_run():
+                    # Nothing got applied, so always compare the whole state to the live objects
+                    if last:
+                        preview = state.without_applied(informer)
+                        preview.actions.update(delta.actions)
+                        preview.delete_collections.extend(delta.delete_collections)
+                        delta = preview
+                    delta.with_items(state, informer.pop_drifted(state))
+                    LOG.info("\n".join(diff_report(delta, informer, last)))
+                    self.states[host] = state
+                    continue
+
+                if pipeline:
+                    pipeline.remove_applied(delta)
+                if informer:
+                    delta.with_items(state, informer.pop_drifted(state))
+
+                state.applyset.extend(state)
+                delta.apply()
+
+                # Objects rendered by templates removed while we were not running are only found by pruning
+                if time.time() - self.last_prune.get(host, 0) > \
+                        int(self.global_options.get('prune_interval', 60 * 60)):
+                    state.applyset.prune(state)
+                    self.last_prune[host] = time.time()
 
                 self.states[host] = state
             except VcConnectionFailedError:
@@ -462,6 +584,11 @@ class Configurator:
             except http.client.HTTPException as e:
                 LOG.warning("%s: %r", host, e)
 
+        render_memo.log_stats()
+        profiler.end_loop()
+        if LOG.isEnabledFor(logging.DEBUG):
+            profiler.log_report(level=logging.DEBUG)
+
     def _reconcile_service_users(self, host, vc_cluster_names):
         """
         Ensures that service-users are consistent across Vault, NSX-T Manager and vCenter for the given host
@@ -474,6 +601,8 @@ class Configurator:
             return
 
         user_crds = vcenter_service_user_crd_loader.get_mapping()
+        self.nsxt_helpers.clear()
+        self.pending_sso_group_members.pop(host, None)
 
         # service matches the name of the custom resource
         for cr_name, (_, spec, _) in user_crds.items():
@@ -507,6 +636,20 @@ class Configurator:
                 self._check_service_user_vcenter(service_username_template, cr_name, service_type,
                                                  host, path, latest_version)
 
+        self._add_pending_users_to_group(host)
+
+    def _add_pending_users_to_group(self, host):
+        """Add all service-users collected for the host to the Administrators group in one call"""
+        usernames = self.pending_sso_group_members.pop(host, None)
+        if not usernames:
+            return
+
+        results = self.vcenter_sso.add_users_to_group(host, usernames)
+        failed = [username for username, added in results.items() if not added]
+        if failed:
+            LOG.error("Failed to add service-users %s to Administrators group in vcenter %s", failed, host)
+            raise SSOSkippedError()
+
     def _check_vault_user(self, path, service_username_template, cr_name, service_type):
         """Ensure that the vault user exists and is periodically revalidated according to the defined interval.
            Returns the latest user version.
@@ -525,6 +668,11 @@ class Configurator:
     def _check_service_user_vault(self, path, service_username_template, cr_name, service_type):
         """Generates ground thruth for service-users and checks for new versions in vault"""
         LOG.debug("Checking service-user under path %s in vault", path)
+        # Only poll the read mount point while a triggered replication is pending
+        if self.vault.replication.is_pending(path) and not self.vault.replication.is_replicated(path):
+            LOG.info("Service-user in vault is still being replicated for path %s", path)
+            raise VaultSecretNotReplicatedError()
+
         metadata_write = self.vault.get_metadata(path, read=False, service_type=service_type)
 
         # Create service_user in vault, if not exists
@@ -538,24 +686,17 @@ class Configurator:
         # Check if replicated
         if not metadata_read:
             LOG.info("Service-user in vault is not replicated - triggering replication")
-            self.vault.trigger_replicate(path, service_type)
+            self.vault.replication.request(path, service_type, latest_secret_version(metadata_write))
             raise VaultSecretNotReplicatedError()
 
         # Check if metadata is up to date
-        versions_read = metadata_read['data']['versions']
-        versions_write = metadata_write['data']['versions']
-        latest_version_read = max(
-            (int(version) for version, meta in versions_read.items() if not meta.get("deletion_time")),
-            default=0
-        )
-        latest_version_write = max(
-            (int(version) for version, meta in versions_write.items() if not meta.get("deletion_time")),
-            default=0
-        )
+        latest_version_read = latest_secret_version(metadata_read)
+        latest_version_write = latest_secret_version(metadata_write)
         if latest_version_write > latest_version_read:
             LOG.warning("Service-user of path %s in vault is not up to date - triggering replication", path)
-            self.vault.trigger_replicate(path, service_type)
+            self.vault.replication.request(path, service_type, latest_version_write)
             raise VaultSecretNotReplicatedError()
+        self.vault.replication.done(path)
 
         if latest_version_read > latest_version_write:
             LOG.error(
@@ -612,16 +753,15 @@ class Configurator:
             secret = self.vault.get_secret(path)
             if secret["username"] != current_username:
                 LOG.warning("Username in vault does not match the current username")
-                self.vault.trigger_replicate(path, service_type)
+                self.vault.replication.request(path, service_type, latest_version)
                 raise VaultSecretNotReplicatedError()
 
             self.vcenter_sso.create_service_user(host, secret["username"], secret["password"], cr_name)
-            self.vcenter_sso.add_user_to_group(host, secret["username"])
+            self.pending_sso_group_members[host].append(current_username)
             self.vcenter_service_user_tracker[cr_name][host][latest_version] = time.time()
-
-        if not self.vcenter_sso.check_users_in_group(host, current_username):
+        elif not self.vcenter_sso.check_users_in_group(host, current_username):
             LOG.info("Adding service-user %s to Administrators group in vcenter", current_username)
-            self.vcenter_sso.add_user_to_group(host, current_username)
+            self.pending_sso_group_members[host].append(current_username)
 
         # Check if service-user can be removed
         for service_user in service_users_in_vcenter:
@@ -719,11 +859,15 @@ class Configurator:
 
         current_username = service_user_prefix + str(latest_version).zfill(4)
         dry_run = self.global_options.get('dry_run', "False") == 'True'
-        nsxt = NsxtUserAPIHelper(user=management_user["username"], password=management_user["password"],
-                                 bb=bb, region=region, dry_run=dry_run)
+        nsxt = self.nsxt_helpers.get(bb)
+        if nsxt is None or (nsxt.user, nsxt.password) != (management_user["username"], management_user["password"]):
+            nsxt = NsxtUserAPIHelper(user=management_user["username"], password=management_user["password"],
+                                     bb=bb, region=region, dry_run=dry_run)
+            self.nsxt_helpers[bb] = nsxt
         try:
             active_users = nsxt.list_users(prefix=service_user_prefix)
         except NotAuthorizedError:
+            del self.nsxt_helpers[bb]
             try:
                 self.nsxt_vaultcache.renew_pw(bb)
             except NSXTCacheError as e:
@@ -739,7 +883,7 @@ class Configurator:
 
             if secret['username'] != current_username:
                 LOG.warning("NSXT service-user in vault does not match the current username")
-                self.vault.trigger_replicate(path, service_type)
+                self.vault.replication.request(path, service_type, latest_version)
                 raise VaultSecretNotReplicatedError
 
             try:
@@ -0,0 +1,191 @@
+import base64
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from kubernetes import client as k8s_client
+
+from vcenter_operator.phelm import APPLIED_HASH_ANNOTATION, FIELD_MANAGER
+
+LOG = logging.getLogger(__name__)
+
+# Changed paths listed per item, the rest is only counted
+MAX_PATHS = 5
+_IGNORED_PATHS = frozenset({
+    f".metadata.annotations.{APPLIED_HASH_ANNOTATION}",
+})
+# Fields identifying the elements of lists of objects, tried in this order, like the merge keys of the API types
+_MERGE_KEYS = ('mountPath', 'devicePath', 'name', 'containerPort', 'port', 'ip')
+
+
+def _changed_paths(rendered, live, path=""):
+    """Yield (op, path) of the fields of the rendered item which are added (+) or changed (~) in the live object.
+       Fields only in the live object, e.g. defaulted by the API server, are no change.
+    """
+    for key, value in rendered.items():
+        field_path = f"{path}.{key}"
+        if key not in live:
+            yield '+', field_path
+        else:
+            yield from _changed_value(value, live[key], field_path)
+
+
+def _changed_value(value, live, path):
+    if isinstance(value, dict) and isinstance(live, dict):
+        yield from _changed_paths(value, live, path)
+    elif isinstance(value, list) and isinstance(live, list):
+        yield from _changed_elements(value, live, path)
+    elif value != live:
+        yield '~', path
+
+
+def _merge_key(rendered, live):
+    """Return the field identifying the elements of both lists, None if there is none"""
+    for key in _MERGE_KEYS:
+        if all(isinstance(element, dict) and isinstance(element.get(key), (str, int)) for element in rendered + live) \
+                and len({element[key] for element in rendered}) == len(rendered):
+            return key
+    return None
+
+
+def _changed_elements(rendered, live, path):
+    """Yield (op, path) of the elements of the rendered list which are added (+), changed (~) or removed (-)
+       in the live list, matched by their merge key, or else by their index
+    """
+    key = _merge_key(rendered, live)
+    if key is None:
+        if len(rendered) != len(live):
+            yield '~', path
+            return
+        for i, (value, live_value) in enumerate(zip(rendered, live)):
+            yield from _changed_value(value, live_value, f"{path}[{i}]")
+        return
+
+    live_elements = {element[key]: element for element in live}
+    for element in rendered:
+        element_path = f"{path}[{key}={element[key]}]"
+        if element[key] in live_elements:
+            yield from _changed_paths(element, live_elements.pop(element[key]), element_path)
+        else:
+            yield '+', element_path
+    for value in live_elements:
+        yield '-', f"{path}[{key}={value}]"
+
+
+def _removed_paths(rendered, fields, path=""):
+    """Yield ('-', path) of the fields we applied before, according to our managed fields, not rendered anymore.
+       Lists are compared as a whole, so only the fields of objects are followed.
+    """
+    for key, children in fields.items():
+        if not key.startswith('f:'):
+            continue
+        name = key[2:]
+        field_path = f"{path}.{name}"
+        if name not in rendered:
+            yield '-', field_path
+        elif isinstance(rendered[name], dict) and children:
+            yield from _removed_paths(rendered[name], children, field_path)
+
+
+def _with_string_data(rendered):
+    """Return the rendered item with its stringData merged into data, as stored by the API server"""
+    if not isinstance(rendered.get('stringData'), dict):
+        return rendered
+    data = dict(rendered.get('data') or {})
+    for key, value in rendered['stringData'].items():
+        data[key] = base64.b64encode(str(value).encode('utf-8')).decode('ascii')
+    rendered = dict(rendered, data=data)
+    del rendered['stringData']
+    return rendered
+
+
+def item_diff(rendered, live):
+    """Return the sorted (op, path) of the differences between the rendered item and the live object"""
+    stored = _with_string_data(rendered)
+    diff = set(_changed_paths(stored, live))
+    for managed_fields in live.get('metadata', {}).get('managedFields') or []:
+        if managed_fields.get('manager') == FIELD_MANAGER and managed_fields.get('operation') == 'Apply' \
+                and not managed_fields.get('subresource'):
+            # Applied fields of either form are still rendered
+            diff.update(_removed_paths({**rendered, **stored}, managed_fields.get('fieldsV1') or {}))
+    return sorted((op, path) for op, path in diff if path not in _IGNORED_PATHS)
+
+
+def _describe(_id):
+    api_version, kind, name, namespace = _id
+    return f"{kind} {namespace}/{name}" if namespace else f"{kind} {name}"
+
+
+def _list_live(state, group):
+    """Return the live objects of the (api_version, kind, namespace) group by name, listed with one request"""
+    api_version, kind, namespace = group
+    try:
+        resource = state.get_resource(api_version=api_version, kind=kind)
+        resp = state.get_client().get(resource, namespace=namespace if resource.namespaced else None)
+    except k8s_client.rest.ApiException as e:
+        LOG.warning("Could not list %s/%s in %s, reporting them as to create: %s", *group, e)
+        return {}
+    # Items of a list do not carry their kind
+    return {obj['metadata']['name']: dict(obj, apiVersion=api_version, kind=kind)
+            for obj in resp.to_dict()['items']}
+
+
+def diff_report(delta, informer, last=None):
+    """Return the lines of a report of what applying the delta would change, grouped by template.
+       The live objects are taken from the informer. The ones not watched by it, e.g. existing objects
+       without our managed-by label, are listed once per kind and namespace.
+    """
+    live_objects = {}
+    for _id in delta.items:
+        if informer.live_object(_id) is None:
+            live_objects.setdefault((_id[0], _id[1], _id[3]), {})
+    groups = list(live_objects)
+    with ThreadPoolExecutor(max_workers=max(1, delta.workers), thread_name_prefix="list") as executor:
+        live_objects.update(zip(groups, executor.map(lambda group: _list_live(delta, group), groups)))
+
+    templates = {}
+    counts = dict.fromkeys(('create', 'change', 'unchanged', 'delete', 'invalid'), 0)
+
+    def add(template, line):
+        templates.setdefault(template or "(unknown template)", []).append(line)
+
+    for _id in sorted(delta.items):
+        stored = delta.items[_id]
+        if stored.errors:
+            counts['invalid'] += 1
+            add(stored.template, f"! {_describe(_id)}: {'; '.join(stored.errors)}")
+            continue
+
+        live = informer.live_object(_id)
+        if live is None:
+            live = live_objects[(_id[0], _id[1], _id[3])].get(_id[2])
+        if live is None:
+            counts['create'] += 1
+            add(stored.template, f"+ {_describe(_id)}")
+            continue
+
+        diff = item_diff(delta.item_to_apply(_id), live)
+        if not diff:
+            counts['unchanged'] += 1
+            continue
+        counts['change'] += 1
+        paths = ", ".join(f"{op}{path}" for op, path in diff[:MAX_PATHS])
+        if len(diff) > MAX_PATHS:
+            paths += f" and {len(diff) - MAX_PATHS} more"
+        add(stored.template, f"~ {_describe(_id)}: {paths}")
+
+    for _id, action in sorted(delta.actions.items()):
+        if action == 'delete':
+            counts['delete'] += 1
+            stored = last.items.get(_id) if last else None
+            add(stored.template if stored else None, f"- {_describe(_id)}")
+
+    for api_version, kind, namespace, template in delta.delete_collections:
+        counts['delete'] += 1
+        add(template, f"- all {kind} in {namespace} of the template")
+
+    lines = [f"Dry-run diff for {delta.vcenter}: {counts['create']} to create, {counts['change']} to change, "
+             f"{counts['delete']} to delete, {counts['invalid']} invalid, {counts['unchanged']} unchanged"]
+    for template, template_lines in sorted(templates.items()):
+        lines.append(f"  {template}")
+        lines.extend(f"    {line}" for line in template_lines)
+    return lines
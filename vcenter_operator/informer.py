@@ -0,0 +1,198 @@
+import logging
+import threading
+import time
+
+import attr
+from kubernetes import client as k8s_client
+
+from vcenter_operator.phelm import (
+    APPLIED_HASH_ANNOTATION,
+    FIELD_MANAGER,
+    MANAGED_BY,
+    MANAGED_BY_LABEL,
+    DeploymentState,
+)
+
+LOG = logging.getLogger(__name__)
+
+# Seconds after which a watch gets restarted from the last seen resourceVersion
+WATCH_TIMEOUT = 5 * 60
+# Seconds to wait before listing again after a failed list or watch
+RELIST_DELAY = 10
+# Seconds to wait for the initial list of a newly watched kind
+SYNC_TIMEOUT = 30
+# Field managers changing the objects on their own, which is no drift
+IGNORED_FIELD_MANAGERS = frozenset({
+    FIELD_MANAGER,
+    "kube-controller-manager",
+})
+
+
+@attr.s(slots=True)
+class LiveObject:
+    digest = attr.ib()
+    resource_version = attr.ib()
+    # Time of the latest change by a foreign field manager, as RFC 3339 string
+    foreign_change = attr.ib(default=None)
+    # The whole object, only kept if requested
+    obj = attr.ib(default=None, repr=False)
+
+
+def _object_id(obj):
+    metadata = obj['metadata']
+    return obj['apiVersion'], obj['kind'], metadata['name'], metadata.get('namespace')
+
+
+def _foreign_change(obj):
+    """Return the time of the latest change of the object by a field manager other than us, if any"""
+    latest = None
+    for managed_fields in obj['metadata'].get('managedFields') or []:
+        if managed_fields.get('subresource') or managed_fields.get('manager') in IGNORED_FIELD_MANAGERS:
+            continue
+        changed = managed_fields.get('time')
+        if changed and (latest is None or changed > latest):
+            latest = changed
+    return latest
+
+
+class OwnedObjectInformer:
+    """Watch cache of the objects managed by the operator, selected by their managed-by label
+
+    It records the objects which drifted from what we applied: deleted ones and ones changed by
+    another field manager. Each kind is listed once and then watched in a background thread.
+    With keep_objects, the whole objects are kept as well, e.g. to diff them against rendered items.
+    """
+
+    def __init__(self, label_selector=f"{MANAGED_BY_LABEL}={MANAGED_BY}", keep_objects=False):
+        self.label_selector = label_selector
+        self.keep_objects = keep_objects
+        self.objects = {}
+        self.drift = set()
+        self.synced = {}
+        self._lock = threading.Lock()
+
+    def watch(self, api_version, kind):
+        """Start watching the kind, unless already done, and wait for its initial list"""
+        with self._lock:
+            synced = self.synced.get((api_version, kind))
+            if synced is None:
+                synced = self.synced[(api_version, kind)] = threading.Event()
+                threading.Thread(target=self._run, args=(api_version, kind, synced),
+                                 name=f"informer-{kind}", daemon=True).start()
+
+        if not synced.wait(SYNC_TIMEOUT):
+            LOG.warning("Initial list of %s/%s did not finish within %d seconds", api_version, kind, SYNC_TIMEOUT)
+        return synced.is_set()
+
+    def watch_items(self, ids):
+        """Start watching all kinds of the given item ids"""
+        for api_version, kind in sorted({(_id[0], _id[1]) for _id in ids}):
+            self.watch(api_version, kind)
+
+    def is_synced(self, api_version, kind):
+        synced = self.synced.get((api_version, kind))
+        return synced is not None and synced.is_set()
+
+    def _run(self, api_version, kind, synced):
+        while True:
+            try:
+                client = DeploymentState.get_client()
+                resource = client.resources.get(api_version=api_version, kind=kind)
+                resource_version = self._list(client, resource, api_version, kind)
+                synced.set()
+                while resource_version:
+                    for event in client.watch(resource, label_selector=self.label_selector,
+                                              resource_version=resource_version, timeout=WATCH_TIMEOUT):
+                        obj = event['raw_object']
+                        if event['type'] == 'ERROR':
+                            # A Status instead of an object, e.g. 410 Gone for an expired resourceVersion
+                            LOG.debug("Watching %s/%s ended, listing again: %s", api_version, kind, obj.get('message'))
+                            resource_version = None
+                            break
+                        resource_version = obj['metadata']['resourceVersion']
+                        self._handle(event['type'], obj)
+                continue
+            except k8s_client.rest.ApiException as e:
+                # An expired resourceVersion ends up here as well
+                LOG.debug("Watching %s/%s ended, listing again: %s", api_version, kind, e)
+            except Exception:
+                LOG.exception("Watching %s/%s failed, listing again", api_version, kind)
+            time.sleep(RELIST_DELAY)
+
+    def _list(self, client, resource, api_version, kind):
+        """Replace the cached objects of the kind with a fresh list and return its resourceVersion"""
+        resp = client.get(resource, label_selector=self.label_selector)
+        items = resp.to_dict()['items']
+        seen = set()
+        for obj in items:
+            # Items of a list do not carry their kind
+            obj = dict(obj, apiVersion=api_version, kind=kind)
+            seen.add(_object_id(obj))
+            self._handle('ADDED', obj)
+
+        with self._lock:
+            for _id in [_id for _id in self.objects if _id[:2] == (api_version, kind) and _id not in seen]:
+                del self.objects[_id]
+                self.drift.add(_id)
+
+        return resp.metadata.resourceVersion
+
+    def _handle(self, event_type, obj):
+        _id = _object_id(obj)
+        with self._lock:
+            if event_type == 'DELETED':
+                self.objects.pop(_id, None)
+                self.drift.add(_id)
+                return
+
+            if event_type not in ('ADDED', 'MODIFIED'):
+                return
+
+            metadata = obj['metadata']
+            foreign_change = _foreign_change(obj)
+            last = self.objects.get(_id)
+            if foreign_change and (last is None or last.foreign_change is None or foreign_change > last.foreign_change):
+                LOG.info("%s/%s %s in %s was changed by another field manager", *_id)
+                self.drift.add(_id)
+
+            self.objects[_id] = LiveObject(
+                digest=(metadata.get('annotations') or {}).get(APPLIED_HASH_ANNOTATION),
+                resource_version=metadata.get('resourceVersion'),
+                foreign_change=foreign_change,
+                obj=obj if self.keep_objects else None,
+            )
+
+    def live_object(self, _id):
+        """Return the cached object of the item id, None if missing or not kept"""
+        with self._lock:
+            live = self.objects.get(_id) or self.objects.get(_id[:3] + (None,))
+        return live.obj if live else None
+
+    def applied_digests(self, group):
+        """Return the applied digest per name of the cached objects of the group,
+           None if the kind is not synced (yet).
+        """
+        api_version, kind, namespace = group
+        if not self.is_synced(api_version, kind):
+            return None
+
+        with self._lock:
+            return {_id[2]: live.digest for _id, live in self.objects.items()
+                    if _id[:2] == (api_version, kind) and _id[3] in (namespace, None)}
+
+    def pop_drifted(self, state):
+        """Return the ids of the items of the state which drifted from what got applied and forget about them.
+           These are items deleted, changed by someone else or not carrying their digest.
+        """
+        drifted = []
+        with self._lock:
+            for _id, stored in state.items.items():
+                if not self.is_synced(_id[0], _id[1]):
+                    continue
+                live = self.objects.get(_id) or self.objects.get(_id[:3] + (None,))
+                if _id in self.drift or live is None or live.digest != stored.digest:
+                    drifted.append(_id)
+            self.drift.difference_update(state.items.keys())
+            # Missing objects count as drifted anyway, this forgets the ones not rendered anymore, e.g. deleted by us
+            self.drift.intersection_update(self.objects.keys())
+        return drifted
@@ -0,0 +1,99 @@
+import logging
+import threading
+import time
+
+from kubernetes import client as k8s_client
+
+LOG = logging.getLogger(__name__)
+
+# Responses after which a request is sent again, once the limiter lets it
+RETRY_STATUS = frozenset({429, 502, 503, 504})
+# How often a request gets retried before giving up
+MAX_RETRIES = 3
+# Seconds to wait before a retry if the server did not tell us with Retry-After
+RETRY_BACKOFF_SECONDS = 1
+MAX_RETRY_AFTER_SECONDS = 60
+# Requests taking longer than that count as sign of an overloaded API server or slow admission webhooks
+LATENCY_TARGET_SECONDS = 2.0
+# Factor to shrink the limit by on errors, and on slow requests
+ERROR_DECREASE = 0.5
+LATENCY_DECREASE = 0.9
+
+
+def _retry_after(e):
+    """Return the seconds the server asked us to wait with Retry-After, None if not given as seconds"""
+    try:
+        value = (e.headers or {}).get('Retry-After')
+        return min(float(value), MAX_RETRY_AFTER_SECONDS) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter:
+    """Limits the number of concurrent requests to the Kubernetes API additive-increase/multiplicative-decrease.
+
+    The limit grows by one per limit successful requests, up to max_limit, and shrinks on throttled
+    (429) or failed (5xx) requests and on requests slower than latency_target.
+    After a 429 or 503, no request is sent until the time given by Retry-After has passed.
+    """
+
+    def __init__(self, max_limit, min_limit=1, latency_target=LATENCY_TARGET_SECONDS):
+        self.max_limit = max(min_limit, max_limit)
+        self.min_limit = min_limit
+        self.latency_target = latency_target
+        self.limit = float(min_limit)
+        self.in_flight = 0
+        self.blocked_until = 0
+        self._cond = threading.Condition()
+
+    def set_max_limit(self, max_limit):
+        with self._cond:
+            self.max_limit = max(self.min_limit, max_limit)
+            self.limit = min(self.limit, self.max_limit)
+            self._cond.notify_all()
+
+    def _acquire(self):
+        with self._cond:
+            while True:
+                wait = self.blocked_until - time.monotonic()
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                self._cond.wait(wait if wait > 0 else None)
+
+    def _release(self, latency=None, status=None, retry_after=None):
+        with self._cond:
+            self.in_flight -= 1
+            if status == 429 or (status and status >= 500):
+                self.limit = max(self.min_limit, self.limit * ERROR_DECREASE)
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+                LOG.debug("Kubernetes API answered %s, lowering the concurrency to %d", status, self.limit)
+            elif latency is not None and latency > self.latency_target:
+                self.limit = max(self.min_limit, self.limit * LATENCY_DECREASE)
+            elif latency is not None:
+                self.limit = min(self.max_limit, self.limit + 1 / int(self.limit))
+            self._cond.notify_all()
+
+    def call(self, fn, *args, **kwargs):
+        """Call fn once a slot is free, retrying it on throttling and transient server errors"""
+        for attempt in range(MAX_RETRIES + 1):
+            self._acquire()
+            start = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            except k8s_client.rest.ApiException as e:
+                retry_after = _retry_after(e)
+                if e.status not in RETRY_STATUS or attempt == MAX_RETRIES:
+                    self._release(status=e.status)
+                    raise
+                if retry_after is None:
+                    retry_after = RETRY_BACKOFF_SECONDS * 2 ** attempt
+                self._release(status=e.status, retry_after=retry_after)
+                LOG.info("Kubernetes API answered %s, retrying in %.1f seconds", e.status, retry_after)
+                continue
+            except BaseException:
+                self._release()
+                raise
+            self._release(latency=time.monotonic() - start)
+            return result
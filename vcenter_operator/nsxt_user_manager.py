@@ -100,6 +100,18 @@ class NsxtLoginHelper:
 
         return res
 
+    def get_all(self, url, params=None):
+        """Fetch all pages of a paginated list"""
+        params = dict(params or {})
+        results = []
+        while True:
+            res = self._request("get", url, params=params).json()
+            results.extend(res.get("results", []))
+            cursor = res.get("cursor")
+            if not cursor:
+                return results
+            params["cursor"] = cursor
+
     def delete(self, url):
         if self.dry_run:
             LOG.debug("Dry run, Not executing Delete request")
@@ -132,6 +144,12 @@ class User:
     def __repr__(self):
         return f"{self.id}: {self.name}: {self.roles}"
 
+    @classmethod
+    def from_role_binding(cls, role_binding):
+        roles = [role["role"] for role in role_binding.get('roles', [])]
+        return cls(name=role_binding["name"], id=role_binding["user_id"], roles=roles,
+                   role_mapping_id=role_binding["id"], revision=role_binding["_revision"])
+
     def has_all_roles(self, expected_roles):
         if isinstance(expected_roles, str):
             expected_roles = [expected_roles]
@@ -145,12 +163,42 @@ class User:
 
 
 class NsxtUserAPIHelper(NsxtLoginHelper):
+    """User management of a NSX-T Manager
+
+    All role-bindings and node users are fetched once into an index on first use,
+    which is kept up to date with our own writes. Create a new helper to refresh it.
+    """
+
     def __init__(self, user, password, bb, region, dry_run):
         super().__init__(user=user, password=password, bb=bb, region=region,
                          verify_ssl=False, dry_run=dry_run)
+        self.role_bindings = None
+        self.node_users = None
+
+    def _load_index(self):
+        """Fetch all role-bindings and node users, unless already done"""
+        if self.role_bindings is not None:
+            return
+
+        role_bindings = {}
+        for role_binding in self.get_all("api/v1/aaa/role-bindings"):
+            if "user_id" not in role_binding:
+                # Group or identity firewall bindings
+                continue
+            user = User.from_role_binding(role_binding)
+            role_bindings[user.name] = user
+
+        self.node_users = [u["username"] for u in self.get("api/v1/node/users")]
+        self.role_bindings = role_bindings
 
     def get_user(self, username):
         "Fetch user and role mapping information for the given username"
+        self._load_index()
+        user = self.role_bindings.get(username)
+        if user:
+            return user
+
+        # Not indexed yet, e.g. the role-binding for a freshly created user
         path = "api/v1/aaa/role-bindings"
         params = {"name": username}
 
@@ -160,15 +208,9 @@ class NsxtUserAPIHelper(NsxtLoginHelper):
             # On creation user gets the auditor role assigned
             raise NSXTUserError(f"User {username} has no roles")
 
-        user_role_mappping = user_role_mappping[0]
-        roles = [role["role"] for role in user_role_mappping.get('roles', [])]
-        name = user_role_mappping["name"]
-        user_id = user_role_mappping["user_id"]
-        role_mapping_id = user_role_mappping["id"]
-        revision = user_role_mappping["_revision"]
-
-        return User(name=name, id=user_id, roles=roles,
-                 role_mapping_id=role_mapping_id, revision=revision)
+        user = User.from_role_binding(user_role_mappping[0])
+        self.role_bindings[user.name] = user
+        return user
 
     def list_user_role_mappings(self):
         path = "policy/api/v1/aaa/role-bindings"
@@ -179,14 +221,12 @@ class NsxtUserAPIHelper(NsxtLoginHelper):
         return self.get(path)
 
     def list_users(self, prefix="nsxt"):
-        path = "api/v1/node/users"
-
-        users = self.get(path)
+        self._load_index()
 
         if not prefix:
-            return [u["username"] for u in users]
+            return list(self.node_users)
 
-        return [u["username"] for u in users if u["username"].startswith(prefix)]
+        return [u for u in self.node_users if u.startswith(prefix)]
 
     def check_user_in_group(self, user, groups):
         if isinstance(user, str):
@@ -225,7 +265,12 @@ class NsxtUserAPIHelper(NsxtLoginHelper):
             ]
         }
 
-        self.put(path, data=role_mapping)
+        res = self.put(path, data=role_mapping)
+        if self.dry_run:
+            return
+
+        user.roles = [groupname]
+        user.revision = res.json().get("_revision", user.revision + 1)
 
     def create_service_user(self, username, password):
         path = "api/v1/node/users"
@@ -246,8 +291,23 @@ class NsxtUserAPIHelper(NsxtLoginHelper):
         except ObjectAlreadyExistsError:
             LOG.debug(f"User {username} already exists")
 
+        if self.dry_run or self.node_users is None:
+            return
+
+        if username not in self.node_users:
+            self.node_users.append(username)
+        # The role-binding gets created by NSX-T, so it is fetched on the next get_user
+        self.role_bindings.pop(username, None)
+
     def delete_service_user(self, username):
         path = "api/v1/node/users/{}"
         user = self.get_user(username)
         if user:
             self.delete(path.format(user.id))
+
+        if self.dry_run:
+            return
+
+        self.role_bindings.pop(username, None)
+        if username in self.node_users:
+            self.node_users.remove(username)
@@ -1,7 +1,15 @@
-import io
+import datetime
+import hashlib
 import json
 import logging
+import re
+import threading
+import time
+import zlib
 from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
 
 import attr
 import yaml
@@ -10,9 +18,17 @@ from kubernetes import client as k8s_client
 from kubernetes import dynamic
 from yaml.error import YAMLError
 
+from vcenter_operator.limiter import AdaptiveLimiter
+from vcenter_operator.profiler import profiler
 from vcenter_operator.templates import env, vcenter_service_user_crd_loader
 from vcenter_operator.util import parse_buildingblock
 
+try:
+    # libyaml, several times faster on large ConfigMaps
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 LOG = logging.getLogger(__name__)
 
 RESOURCE_ORDER = {
@@ -21,6 +37,33 @@ RESOURCE_ORDER = {
     "Deployment": 2,
 }
 
+# Digest of the rendered item, set on every object we apply to skip unchanged ones after a restart
+APPLIED_HASH_ANNOTATION = "vcenter-operator.stable.sap.cc/applied-hash"
+# Field manager and label of every object we apply, the label selects them for the informer
+FIELD_MANAGER = "vcenter-operator"
+MANAGED_BY_LABEL = "app.kubernetes.io/managed-by"
+MANAGED_BY = "vcenter-operator"
+# Labels of the rendered objects, identifying the template and the vCenter they were rendered for
+TEMPLATE_LABEL = "vcenter-operator.stable.sap.cc/template"
+VCENTER_LABEL = "vcenter-operator.stable.sap.cc/vcenter"
+# Labels the members of the ApplySet of the vCenter
+APPLYSET_PART_OF_LABEL = "applyset.kubernetes.io/part-of"
+# Minimum number of deleted items of one template and kind in a namespace to delete them with one request
+DELETE_COLLECTION_THRESHOLD = 10
+
+# Bytes of compressed template outputs kept by the RenderMemo
+RENDER_MEMO_BYTES = 64 * 1024 * 1024
+# Lists only the metadata of the objects
+METADATA_LIST_ACCEPT = "application/json;as=PartialObjectMetadataList;g=meta.k8s.io;v=v1"
+
+# The dynamic client discovers the API resources on creation, so it is kept per thread
+_thread_local = threading.local()
+
+
+def _resource_rank(kind):
+    """Position of the kind in the apply order, kinds not in RESOURCE_ORDER go last"""
+    return RESOURCE_ORDER.get(kind, len(RESOURCE_ORDER))
+
 
 class ServiceUserNotFoundError(Exception):
     """Raised when a required service-user or service-user path is missing for rendering."""
@@ -36,36 +79,274 @@ class VersionNotFoundError(Exception):
     """Raised when no compatible vault service-user version is found in the target system (NSX-T or vCenter)"""
 
 
+def label_value(value):
+    """Return the value usable as label value: invalid characters replaced and,
+       if longer than 63 characters, shortened with a hash suffix to keep it unique.
+    """
+    value = re.sub(r'[^A-Za-z0-9_.-]', '.', value).strip('-_.')
+    if len(value) > 63:
+        suffix = hashlib.sha256(value.encode('utf-8')).hexdigest()[:10]
+        value = value[:52].rstrip('-_.') + '-' + suffix
+    return value
+
+
+def _json_default(value):
+    # YAML parses timestamps to datetime objects
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def load_all(result):
+    """Parse the YAML documents of the rendered result, with libyaml if available"""
+    return yaml.load_all(result, Loader=SafeLoader)
+
+
+def load_output(result, output_format=None):
+    """Return the items of the rendered result, given the output-format of the template in its jinja2_options.
+       With 'json', the template renders a JSON object or array of objects, e.g. with the tojson filter,
+       which is parsed a lot faster than YAML.
+    """
+    if output_format is None or output_format == 'yaml':
+        return load_all(result)
+    if output_format == 'json':
+        items = json.loads(result)
+        return items if isinstance(items, list) else [items]
+    raise TemplateError(f"Unknown output-format {output_format}")
+
+
+def _fingerprint_default(value):
+    # The cells are a set
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=repr)
+    return repr(value)
+
+
+class RenderMemo:
+    """The items parsed from the output of templates, shared by the states of all vCenters
+
+    Keyed by the template, the versions of the templates it uses and the digest of the options it references,
+    so templates rendering the same for many clusters or availability zones, e.g. ones only referencing
+    the global options, are rendered and parsed only once. The least recently used entries are dropped
+    when the entries exceed max_bytes.
+    """
+
+    def __init__(self, max_bytes=RENDER_MEMO_BYTES):
+        self.max_bytes = max_bytes
+        # render key -> the items as compressed JSON, so every hit gets its own copy
+        self.entries = OrderedDict()
+        # Bytes of the entries
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return a copy of the items rendered for the key, None if not known"""
+        if key is None or not self.max_bytes:
+            return None
+        with self._lock:
+            data = self.entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return json.loads(zlib.decompress(data))
+
+    def put(self, key, items):
+        if key is None or not self.max_bytes:
+            return
+        data = zlib.compress(json.dumps(items, separators=(',', ':'), default=_json_default).encode('utf-8'), 1)
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            replaced = self.entries.pop(key, None)
+            if replaced is not None:
+                self.size -= len(replaced)
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, dropped = self.entries.popitem(last=False)
+                self.size -= len(dropped)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
+
+    def log_stats(self):
+        """Log the hit ratio since the last call"""
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            self.hits = self.misses = 0
+        if hits or misses:
+            LOG.info("Render memo: %d hits, %d misses (%.0f%% hit ratio), %d entries, %d bytes",
+                     hits, misses, 100.0 * hits / (hits + misses), len(self.entries), self.size)
+
+
+render_memo = RenderMemo()
+
+
+@attr.s(frozen=True, slots=True)
+class StoredItem:
+    """A rendered item kept as its canonical JSON serialization, optionally compressed, and the digest thereof"""
+    digest = attr.ib()
+    payload = attr.ib(repr=False)
+    compressed = attr.ib(default=False)
+    # Name of the template the item was rendered from
+    template = attr.ib(default=None)
+    # Schema validation errors, the item is not applied if there are any
+    errors = attr.ib(default=())
+
+    @classmethod
+    def from_item(cls, item, compress=False, template=None, errors=()):
+        data = json.dumps(item, sort_keys=True, separators=(',', ':'), default=_json_default).encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        if compress:
+            data = zlib.compress(data, 1)
+        return cls(digest, data, compress, template, tuple(errors))
+
+    def load(self):
+        """Return the item as dict"""
+        data = zlib.decompress(self.payload) if self.compressed else self.payload
+        return json.loads(data)
+
+
+class KindOrderedItems(MutableMapping):
+    """Mapping of item ids to items, iterating in the apply order of RESOURCE_ORDER.
+       The items are kept in one bucket per rank in insertion order, so no sorting is needed.
+    """
+
+    def __init__(self, items=()):
+        self._buckets = [OrderedDict() for _ in range(len(RESOURCE_ORDER) + 1)]
+        self._len = 0
+        self.update(items)
+
+    def _bucket(self, _id):
+        return self._buckets[_resource_rank(_id[1])]
+
+    def __getitem__(self, _id):
+        return self._bucket(_id)[_id]
+
+    def __setitem__(self, _id, item):
+        bucket = self._bucket(_id)
+        if _id not in bucket:
+            self._len += 1
+        bucket[_id] = item
+
+    def __delitem__(self, _id):
+        del self._bucket(_id)[_id]
+        self._len -= 1
+
+    def __contains__(self, _id):
+        return _id in self._bucket(_id)
+
+    def __iter__(self):
+        for bucket in self._buckets:
+            yield from bucket
+
+    def __len__(self):
+        return self._len
+
+    def clear(self):
+        for bucket in self._buckets:
+            bucket.clear()
+        self._len = 0
+
+    def __repr__(self):
+        return f"{type(self).__name__}({list(self.items())!r})"
+
+
 @attr.s
 class DeploymentState:
     dry_run = attr.ib(default=False)
-    items = attr.ib(default=attr.Factory(OrderedDict))
+    # Store the items compressed, trading some CPU on apply for a smaller memory footprint
+    compress = attr.ib(default=False)
+    # Number of parallel requests while applying the items of one kind and deleting items
+    workers = attr.ib(default=1)
+    # Limits the requests in flight below workers, shared between the states to keep what it learned
+    limiter = attr.ib(default=None, eq=False, repr=False)
+    # The vCenter the items are rendered for, labelled on them to delete them in bulk
+    vcenter = attr.ib(default=None)
+    # The ApplySet of the vCenter, which the items are labelled as members of
+    applyset = attr.ib(default=None, eq=False, repr=False)
+    # Validates the rendered items against the OpenAPI schema of their kind, see SchemaCache
+    validator = attr.ib(default=None, eq=False, repr=False)
+    # Kept in apply order
+    items = attr.ib(default=attr.Factory(KindOrderedItems))
     actions = attr.ib(default=attr.Factory(OrderedDict))
+    # (api_version, kind, namespace, template) of the items to delete by their labels
+    delete_collections = attr.ib(default=attr.Factory(list))
+    # Render fingerprint -> [(id, StoredItem)] rendered from the template, see _render_fingerprint
+    renders = attr.ib(default=attr.Factory(dict), eq=False, repr=False)
+    # The renders of the previous state, reused instead of rendering the template again
+    last_renders = attr.ib(default=attr.Factory(dict), eq=False, repr=False)
+    # Called with the id and StoredItem of every item added, e.g. the ApplyPipeline applying them right away
+    sink = attr.ib(default=None, eq=False, repr=False)
+    # (template, scope) of the templates which failed to render, their objects are neither deleted nor pruned
+    failed = attr.ib(default=attr.Factory(set), eq=False, repr=False)
+
+    def _derive(self):
+        """Return an empty state with the same settings"""
+        return attr.evolve(self, items=KindOrderedItems(), actions=OrderedDict(), delete_collections=[],
+                           renders={}, last_renders={}, sink=None, failed=set())
+
+    @staticmethod
+    def _render_key(template_name, options):
+        """Return (template_name, versions, digest of the referenced options) identifying the output of the
+           template, None if unknown. Only the options referenced by the template are part of it, so e.g.
+           a changed option of another cluster does not cause a render.
+        """
+        dependencies = env.template_dependencies(template_name)
+        if dependencies is None:
+            return None
+        if dependencies.variables is not None:
+            options = {k: options[k] for k in dependencies.variables if k in options}
+        try:
+            data = json.dumps(options, sort_keys=True, default=_fingerprint_default)
+        except (TypeError, ValueError):
+            return None
+        return template_name, dependencies.versions, hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def _render_fingerprint(self, render_key, owner):
+        """Return a digest of everything the items rendered from the template depend on, None if unknown"""
+        if render_key is None:
+            return None
+        data = json.dumps([render_key, owner, self.compress, self.vcenter,
+                           self.applyset.id if self.applyset else None, self.validator is not None],
+                          sort_keys=True, default=_fingerprint_default)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
 
     def render(self, scope, options, service_users, vcenter_service_user_tracker):
-        template_names = env.list_templates(filter_func=lambda x: (x.startswith(scope) and x.endswith(".yaml.j2")))
         service_user_crds = vcenter_service_user_crd_loader.get_mapping()
-        for template_name in template_names:
+        for template_name, jinja2_options, owner in env.list_scope_templates(scope):
             try:
+                start = time.perf_counter()
                 template = env.get_template(template_name)
+                # Only takes time if the template was not compiled yet
+                profiler.record(template_name, scope, 'compile', time.perf_counter() - start)
                 # e.g. vcenter_cluster/namespace/cr-name
                 namespace = template_name.split("/")[1]
-                jinja2_options = env.get_jinja2_options(template_name)
 
                 if "uses-service-user" in jinja2_options:
                     LOG.debug("Template %s requires service-user management", template.name)
+                    start = time.perf_counter()
                     result = self._inject_service_user_info_and_render(
                         template, service_users, vcenter_service_user_tracker, service_user_crds, options, jinja2_options
                     )
+                    profiler.record(template_name, scope, 'render', time.perf_counter() - start)
+                    items = self._parse(result, template_name, scope, jinja2_options.get("output-format"))
+                    self._add_items(items, owner, namespace, template_name)
                 else:
                     LOG.debug("Template %s does not require service-user management", template.name)
-                    result = template.render(options)
-
-                owner = env.get_source_owner(template_name)
-                self.add(result, owner, namespace)
-            except (TemplateError, YAMLError):
+                    self._render_or_reuse(template, scope, options, owner, namespace,
+                                          jinja2_options.get("output-format"))
+            except (TemplateError, YAMLError, json.JSONDecodeError):
+                self.failed.add((template_name, scope))
                 LOG.exception("Failed to render %s", template_name)
             except (ServiceUserPathNotFoundError, VersionNotFoundError) as e:
+                self.failed.add((template_name, scope))
                 match scope:
                     case "vcenter_cluster":
                         scope_name = options['name']
@@ -74,8 +355,42 @@ class DeploymentState:
                     case _:
                         raise NotImplementedError(f"Scope {scope} is not known to this part of the code")
                 LOG.error("Could not render %s for %s %s: %s", template_name, scope, scope_name, e)
-        # Order the item by kind to ensure that Secrets are created before ConfigMaps and Deployments
-        self.order_items()
+
+    @staticmethod
+    def _parse(result, template_name, scope, output_format=None):
+        """Return the items of the rendered result, recording the cost with the profiler"""
+        start = time.perf_counter()
+        items = list(load_output(result, output_format))
+        profiler.record(template_name, scope, 'parse', time.perf_counter() - start)
+        profiler.record_output(template_name, scope, len(result), len(items))
+        return items
+
+    def _render_or_reuse(self, template, scope, options, owner, namespace, output_format=None):
+        """Render the template, or reuse the items of the previous state if nothing the template depends on changed.
+           The output of templates rendered the same for another cluster or vCenter is taken from the render_memo.
+           The service-user templates also depend on the service-users and their tracker, so they are always rendered.
+        """
+        render_key = self._render_key(template.name, options)
+        fingerprint = self._render_fingerprint(render_key, owner)
+        rendered = self.last_renders.get(fingerprint)
+        if rendered is None:
+            items = render_memo.get(render_key)
+            if items is None:
+                start = time.perf_counter()
+                result = template.render(options)
+                profiler.record(template.name, scope, 'render', time.perf_counter() - start)
+                items = self._parse(result, template.name, scope, output_format)
+                render_memo.put(render_key, items)
+            else:
+                profiler.record_reuse(template.name, scope)
+            rendered = self._add_items(items, owner, namespace, template.name)
+        else:
+            LOG.debug("Reusing the items of %s, nothing it depends on changed", template.name)
+            profiler.record_reuse(template.name, scope)
+            for _id, stored in rendered:
+                self._store(_id, stored)
+        if fingerprint is not None:
+            self.renders[fingerprint] = rendered
 
     def _inject_service_user_info_and_render(
         self, template, service_users, vcenter_service_user_tracker, service_user_crds, options, jinja2_options
@@ -165,31 +480,90 @@ class DeploymentState:
                                    "Service has versions "
                                    f"{vcenter_service_user_tracker[cr_name][host].keys()}")
 
-    def add(self, result, owner, namespace):
-        stream = io.StringIO(result)
-        for item in yaml.safe_load_all(stream):
+    def add(self, result, owner, namespace, template=None, output_format=None):
+        """Add the items of the rendered result and return them as [(id, StoredItem)]"""
+        return self._add_items(load_output(result, output_format), owner, namespace, template)
+
+    def _add_items(self, items, owner, namespace, template=None):
+        """Add the parsed items and return them as [(id, StoredItem)]"""
+        rendered = []
+        for item in items:
             if owner:
                 item["metadata"]["ownerReferences"] = [owner]
+            labels = {}
+            if template:
+                labels[TEMPLATE_LABEL] = label_value(template)
+            if self.vcenter:
+                labels[VCENTER_LABEL] = label_value(self.vcenter)
+            if self.applyset:
+                labels[APPLYSET_PART_OF_LABEL] = self.applyset.id
+            if labels:
+                item["metadata"]["labels"] = dict(item["metadata"].get("labels") or {}, **labels)
             _id = (item['apiVersion'], item['kind'], item['metadata']['name'], namespace)
-            if _id in self.items:
-                LOG.warning(f"Duplicate item #{_id}")
-            self.items[_id] = item
+            errors = self.validator.validate(item) if self.validator else ()
+            if errors:
+                LOG.error("Invalid %s/%s %s in %s rendered from %s: %s",
+                          *_id, template, "; ".join(errors))
+            stored = StoredItem.from_item(item, compress=self.compress, template=template, errors=errors)
+            self._store(_id, stored)
+            rendered.append((_id, stored))
+        return rendered
+
+    def add_stored(self, _id, stored):
+        """Add an item rendered elsewhere, e.g. by the RenderPool, and validate it"""
+        errors = self.validator.validate(stored.load()) if self.validator else ()
+        if errors:
+            LOG.error("Invalid %s/%s %s in %s rendered from %s: %s",
+                      *_id, stored.template, "; ".join(errors))
+            stored = attr.evolve(stored, errors=tuple(errors))
+        self._store(_id, stored)
+
+    def _store(self, _id, stored):
+        if _id in self.items:
+            LOG.warning(f"Duplicate item #{_id}")
+        self.items[_id] = stored
+        if self.sink is not None:
+            self.sink(_id, stored)
 
     def delta(self, other):
-        delta = DeploymentState()
+        delta = self._derive()
+        deletes = OrderedDict()
+        # Their items are missing from the other state as well, but still wanted
+        failed = {template for template, _ in other.failed}
         for k in self.items.keys() - other.items.keys():
-            delta.actions[k] = 'delete'
+            api_version, kind, _, namespace = k
+            template = self.items[k].template
+            if template in failed:
+                continue
+            deletes.setdefault((api_version, kind, namespace, template), []).append(k)
+
+        # Groups of the other state, which must not be deleted by their labels
+        remaining = {(k[0], k[1], k[3], stored.template) for k, stored in other.items.items()}
+        for group, ids in deletes.items():
+            if self.vcenter and group[3] and len(ids) >= DELETE_COLLECTION_THRESHOLD and group not in remaining:
+                delta.delete_collections.append(group)
+            else:
+                for k in ids:
+                    delta.actions[k] = 'delete'
         for k in (self.items.keys() & other.items.keys()):
-            if self.items[k] != other.items[k]:
+            if self.items[k].digest != other.items[k].digest:
                 delta.actions[k] = 'update'
                 delta.items[k] = other.items[k]
             # Nothing to do otherwise
-        for k in (self.items.keys() - other.items.keys()):
+        for k in (other.items.keys() - self.items.keys()):
             delta.items[k] = other.items[k]
 
-        delta.order_items()
         return delta
 
+    def with_items(self, other, ids):
+        """Add the items of the other state with the given ids, e.g. the ones which drifted in the cluster"""
+        added = [_id for _id in ids if _id not in self.items]
+        for _id in added:
+            self.items[_id] = other.items[_id]
+        if added:
+            LOG.info("Applying %d drifted items again", len(added))
+        return self
+
     def _sort_resources(self, items):
         """
         Sort the resources in the order defined by RESOURCE_ORDER.
@@ -197,16 +571,9 @@ class DeploymentState:
         """
         return sorted(
             items,
-            key=lambda x: RESOURCE_ORDER.get(x[1], len(RESOURCE_ORDER)),
+            key=lambda x: _resource_rank(x[1]),
         )
 
-    def order_items(self):
-        """
-        Orders self.items (an OrderedDict) by resource kind using RESOURCE_ORDER.
-        """
-        sorted_keys = self._sort_resources(self.items.keys())
-        self.items = OrderedDict((k, self.items[k]) for k in sorted_keys)
-
     def _apply_item(self, resource, resource_args, new_item):
         client = self.get_client()
         metadata_name = new_item['metadata']['name']
@@ -234,7 +601,10 @@ class DeploymentState:
 
     @staticmethod
     def get_client():
-        return dynamic.DynamicClient(k8s_client.api_client.ApiClient())
+        client = getattr(_thread_local, 'client', None)
+        if client is None:
+            client = _thread_local.client = dynamic.DynamicClient(k8s_client.api_client.ApiClient())
+        return client
 
     @staticmethod
     def get_resource(*, api_version=None, kind=None):
@@ -246,7 +616,7 @@ class DeploymentState:
 
         resource_args = {
             'name': name,
-            'field_manager': 'vcenter-operator',
+            'field_manager': FIELD_MANAGER,
         }
 
         if resource.namespaced:
@@ -257,36 +627,133 @@ class DeploymentState:
 
         return resource, resource_args
 
-    def apply(self):
-        retry_list = []
-        client = self.get_client()
+    def _apply_id(self, _id, stored=None):
+        """Apply the item with the id, or the given StoredItem for it"""
+        stored = stored or self.items[_id]
+        if stored.errors:
+            # Reported when rendering, the API server would reject it anyway
+            LOG.debug("Not applying invalid %s/%s %s in %s", *_id)
+            return
+        api_version, kind, name, namespace = _id
+        resource, resource_args = self._id_to_k8s(api_version, kind, name, namespace)
+        self._apply_item(resource, resource_args, self.item_to_apply(_id, stored))
+
+    def item_to_apply(self, _id, stored=None):
+        """Return the item as applied, with the digest annotation and our label"""
+        stored = stored or self.items[_id]
+        item = stored.load()
+        metadata = item['metadata']
+        metadata['annotations'] = dict(metadata.get('annotations') or {}, **{APPLIED_HASH_ANNOTATION: stored.digest})
+        metadata['labels'] = dict(metadata.get('labels') or {}, **{MANAGED_BY_LABEL: MANAGED_BY})
+        return item
+
+    def _list_applied_digests(self, group):
+        """Return the applied digest per name of the live objects of the group, listing only their metadata"""
+        api_version, kind, namespace = group
+        resource = self.get_resource(api_version=api_version, kind=kind)
+        resp = self.get_client().get(resource, namespace=namespace if resource.namespaced else None,
+                                     header_params={'Accept': METADATA_LIST_ACCEPT}, serialize=False)
+        digests = {}
+        for item in json.loads(resp.data).get('items') or []:
+            metadata = item['metadata']
+            # Objects applied before we labelled them are not watched by the informer, so apply them again
+            if (metadata.get('labels') or {}).get(MANAGED_BY_LABEL) != MANAGED_BY:
+                continue
+            digests[metadata['name']] = (metadata.get('annotations') or {}).get(APPLIED_HASH_ANNOTATION)
+        return digests
 
-        for (api_version, kind, name, namespace), target in self.items.items():
-            resource, resource_args = self._id_to_k8s(api_version, kind, name, namespace)
+    def without_applied(self, informer=None):
+        """Return a state with only the items whose live object was not applied with the same digest.
+           Used after a restart instead of applying everything again.
+           The digests are taken from the informer for the kinds it has synced, otherwise listed.
+        """
+        groups = OrderedDict()
+        for _id in self.items:
+            api_version, kind, _, namespace = _id
+            groups.setdefault((api_version, kind, namespace), []).append(_id)
+
+        def applied_digests(group):
+            digests = informer.applied_digests(group) if informer else None
+            if digests is not None:
+                return digests
             try:
-                self._apply_item(resource, resource_args, target)
+                return self._list_applied_digests(group)
             except k8s_client.rest.ApiException as e:
-                if e.status == 422:
-                    retry_list.append((resource, resource_args, target))
-                else:
-                    raise
-
-        for resource, resource_args, target in retry_list:
-            try:
-                self._apply_item(resource, resource_args, target)
-            except k8s_client.rest.ApiException:
-                LOG.exception("Could not apply change")
+                LOG.warning("Could not list %s/%s in %s, applying all of them: %s", *group, e)
+                return {}
+
+        state = self._derive()
+        with ThreadPoolExecutor(max_workers=max(1, self.workers), thread_name_prefix="list") as executor:
+            for ids, digests in zip(groups.values(), executor.map(applied_digests, groups)):
+                for _id in ids:
+                    if digests.get(_id[2]) != self.items[_id].digest:
+                        state.items[_id] = self.items[_id]
+
+        LOG.info("%d of %d items changed since they were last applied", len(state.items), len(self.items))
+        return state
+
+    def _delete_id(self, _id):
+        api_version, kind, name, namespace = _id
+        resource, resource_args = self._id_to_k8s(api_version, kind, name, namespace)
+        try:
+            LOG.debug(f"Delete: {resource}/{name} in {namespace}")
+            self.get_client().delete(resource, **resource_args)
+        except k8s_client.rest.ApiException as e:
+            if e.status == 404:
+                pass
+            else:
+                raise
+
+    def _delete_collection(self, group):
+        """Delete all objects of the template and kind in the namespace rendered for our vCenter"""
+        api_version, kind, namespace, template = group
+        resource = self.get_resource(api_version=api_version, kind=kind)
+        label_selector = ",".join([
+            f"{MANAGED_BY_LABEL}={MANAGED_BY}",
+            f"{TEMPLATE_LABEL}={label_value(template)}",
+            f"{VCENTER_LABEL}={label_value(self.vcenter)}",
+        ])
+        resource_args = {'label_selector': label_selector}
+        if resource.namespaced:
+            resource_args['namespace'] = namespace
+        if self.dry_run:
+            resource_args['dry_run'] = "All"
 
-        for (api_version, kind, name, namespace), action in self.actions.items():
-            if action != 'delete':
-                continue
+        LOG.info(f"Delete collection: {resource} with {label_selector} in {namespace}")
+        self.get_client().delete(resource, **resource_args)
 
-            resource, resource_args = self._id_to_k8s(api_version, kind, name, namespace)
-            try:
-                LOG.debug(f"Delete: {resource}/{name} in {namespace}")
-                client.delete(resource, **resource_args)
-            except k8s_client.rest.ApiException as e:
-                if e.status == 404:
-                    pass
-                else:
-                    raise
+    def apply(self):
+        """Apply the items phase by phase in the order of RESOURCE_ORDER, then delete the deleted ones.
+           Within a phase, the requests are sent in parallel by up to the configured number of workers,
+           as many as the limiter allows.
+        """
+        retry_list = []
+        limiter = self.limiter or AdaptiveLimiter(max(1, self.workers))
+
+        with ThreadPoolExecutor(max_workers=max(1, self.workers), thread_name_prefix="apply") as executor:
+            for _, phase in groupby(self.items, key=lambda _id: _resource_rank(_id[1])):
+                phase = list(phase)
+                error = None
+                futures = [executor.submit(limiter.call, self._apply_id, _id) for _id in phase]
+                # Wait for the whole phase before starting the next one
+                for _id, future in zip(phase, futures):
+                    try:
+                        future.result()
+                    except k8s_client.rest.ApiException as e:
+                        if e.status == 422:
+                            retry_list.append(_id)
+                        elif error is None:
+                            error = e
+                if error:
+                    raise error
+
+            for _id in retry_list:
+                try:
+                    limiter.call(self._apply_id, _id)
+                except k8s_client.rest.ApiException:
+                    LOG.exception("Could not apply change")
+
+            deletes = [_id for _id, action in self.actions.items() if action == 'delete']
+            # Consume the results to raise the first error
+            list(executor.map(lambda group: limiter.call(self._delete_collection, group), self.delete_collections))
+            list(executor.map(lambda _id: limiter.call(self._delete_id, _id), deletes))
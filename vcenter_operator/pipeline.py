@@ -0,0 +1,105 @@
+import logging
+import queue
+import threading
+
+from kubernetes import client as k8s_client
+
+from vcenter_operator.limiter import AdaptiveLimiter
+from vcenter_operator.phelm import RESOURCE_ORDER
+
+LOG = logging.getLogger(__name__)
+
+# Items rendered but not applied yet, rendering waits when the apply workers fall behind
+STREAM_QUEUE_SIZE = 100
+# Kinds applied by the pipeline, the Deployments referencing them and the rest after
+STREAMED_KINDS = frozenset(kind for kind, rank in RESOURCE_ORDER.items() if rank < RESOURCE_ORDER["Deployment"])
+# Only the first of them is applied while rendering, the others once all before them in RESOURCE_ORDER are applied
+FIRST_RANK = min(RESOURCE_ORDER[kind] for kind in STREAMED_KINDS)
+
+
+class ApplyPipeline:
+    """Applies the Secrets and ConfigMaps of a state while and right after its templates are rendered
+
+    Set as sink of the state, it gets every rendered item and passes the ones changed compared to the last
+    state through a bounded queue to the apply workers. The Secrets are applied while rendering, the ConfigMaps
+    are held back until rendering is done and all Secrets are applied, keeping the order of RESOURCE_ORDER.
+    Everything else, i.e. the kinds which may reference them, the items failing to apply and the deletes,
+    is left to applying the delta after rendering, which skips the items applied here.
+    """
+
+    def __init__(self, state, last, queue_size=STREAM_QUEUE_SIZE):
+        self.state = state
+        self.last = last
+        self.limiter = state.limiter or AdaptiveLimiter(max(1, state.workers))
+        # id -> StoredItem of the items applied
+        self.applied = {}
+        # rank -> [(id, StoredItem)] of the items to apply after the ones of lower ranks
+        self.held = {}
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = [threading.Thread(target=self._work, name=f"stream-apply-{i}", daemon=True)
+                        for i in range(max(1, state.workers))]
+        for thread in self.threads:
+            thread.start()
+
+    def __call__(self, _id, stored):
+        if _id[1] not in STREAMED_KINDS or stored.errors:
+            return
+        last = self.last.items.get(_id)
+        if last is not None and last.digest == stored.digest:
+            return
+        if self.state.applyset and not self.state.dry_run:
+            try:
+                # The parent has to know the kind and namespace before the object gets applied
+                self.state.applyset.extend_ids([_id])
+            except k8s_client.rest.ApiException as e:
+                LOG.debug("Could not record %s/%s %s in %s in the ApplySet, applying it after rendering: %s",
+                          *_id, e)
+                return
+        rank = RESOURCE_ORDER[_id[1]]
+        if rank == FIRST_RANK:
+            self.queue.put((_id, stored))
+        else:
+            self.held.setdefault(rank, []).append((_id, stored))
+
+    def _work(self):
+        while True:
+            entry = self.queue.get()
+            try:
+                if entry is None:
+                    return
+                _id, stored = entry
+                self.limiter.call(self.state._apply_id, _id, stored)
+                self.applied[_id] = stored
+            except k8s_client.rest.ApiException as e:
+                LOG.debug("Could not apply %s/%s %s in %s while rendering, retrying after: %s", *_id, e)
+            except Exception:
+                LOG.exception("Could not apply %s/%s %s in %s while rendering", *_id)
+            finally:
+                self.queue.task_done()
+
+    def close(self, failed=False):
+        """Apply the held back items after the ones before them, wait for them and stop the workers.
+           If rendering failed, the held back items are dropped and the applied ones are recorded
+           in the last state, which is kept instead of the incomplete state.
+        """
+        for rank in sorted(self.held) if not failed else []:
+            self.queue.join()
+            for entry in self.held[rank]:
+                self.queue.put(entry)
+        self.held.clear()
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if failed:
+            for _id, stored in self.applied.items():
+                self.last.items[_id] = stored
+        LOG.info("Applied %d items of %s while rendering", len(self.applied), self.state.vcenter)
+
+    def remove_applied(self, delta):
+        """Remove the items applied here from the delta, unless they changed since"""
+        for _id, applied in self.applied.items():
+            stored = delta.items.get(_id)
+            if stored is not None and stored.digest == applied.digest:
+                del delta.items[_id]
+                delta.actions.pop(_id, None)
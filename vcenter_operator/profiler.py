@@ -0,0 +1,124 @@
+import logging
+from collections import deque
+
+import attr
+
+LOG = logging.getLogger(__name__)
+
+# Number of loops the costs are kept for
+PROFILE_LOOPS = 10
+PHASES = ('compile', 'render', 'parse')
+# Upper bounds in seconds of the buckets of the duration histograms, the last bucket is unbounded
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+@attr.s(slots=True)
+class TemplateCost:
+    """What rendering a template for a scope cost in one or more loops"""
+    renders = attr.ib(default=0)
+    # Renders skipped as the items of the previous loop or another cluster were reused
+    reused = attr.ib(default=0)
+    compile_seconds = attr.ib(default=0.0)
+    render_seconds = attr.ib(default=0.0)
+    parse_seconds = attr.ib(default=0.0)
+    output_chars = attr.ib(default=0)
+    items = attr.ib(default=0)
+
+    @property
+    def total_seconds(self):
+        return self.compile_seconds + self.render_seconds + self.parse_seconds
+
+    def update(self, other):
+        for field in attr.fields(TemplateCost):
+            setattr(self, field.name, getattr(self, field.name) + getattr(other, field.name))
+
+
+def _bucket(seconds):
+    for i, bound in enumerate(DURATION_BUCKETS):
+        if seconds <= bound:
+            return i
+    return len(DURATION_BUCKETS)
+
+
+class RenderProfiler:
+    """Records the cost of rendering per (template, scope) over the last loops, and histograms of the durations
+
+    There is no lock, the report may be requested by a signal handler interrupting the recording thread.
+    It is only built from copies, so at worst it misses the cost being recorded.
+    """
+
+    def __init__(self, loops=PROFILE_LOOPS):
+        self.loops = deque(maxlen=loops)
+        # (template, scope) -> TemplateCost of the running loop
+        self.current = {}
+        # phase -> count per bucket of DURATION_BUCKETS, since the start
+        self.histograms = {}
+        self.reset()
+
+    def _cost(self, template, scope):
+        cost = self.current.get((template, scope))
+        if cost is None:
+            cost = self.current[(template, scope)] = TemplateCost()
+        return cost
+
+    def record(self, template, scope, phase, seconds):
+        """Record the seconds one of the PHASES took"""
+        cost = self._cost(template, scope)
+        setattr(cost, f"{phase}_seconds", getattr(cost, f"{phase}_seconds") + seconds)
+        self.histograms[phase][_bucket(seconds)] += 1
+
+    def record_output(self, template, scope, output_chars, items):
+        cost = self._cost(template, scope)
+        cost.renders += 1
+        cost.output_chars += output_chars
+        cost.items += items
+
+    def record_reuse(self, template, scope):
+        self._cost(template, scope).reused += 1
+
+    def reset(self):
+        """Forget the costs of the running loop and the histograms, e.g. in a worker process per job"""
+        self.current = {}
+        self.histograms = {phase: [0] * (len(DURATION_BUCKETS) + 1) for phase in PHASES}
+
+    def merge(self, current, histograms):
+        """Add the costs and histograms recorded by another profiler, e.g. in a worker process"""
+        for key, cost in current.items():
+            self._cost(*key).update(cost)
+        for phase, counts in histograms.items():
+            self.histograms[phase] = [a + b for a, b in zip(self.histograms[phase], counts)]
+
+    def end_loop(self):
+        self.loops.append(self.current)
+        self.current = {}
+
+    def costs(self):
+        """Return the TemplateCost per (template, scope) summed over the last loops"""
+        costs = {}
+        for loop in list(self.loops):
+            for key, cost in list(loop.items()):
+                costs.setdefault(key, TemplateCost()).update(cost)
+        return costs
+
+    def report(self, top=10):
+        """Return the lines of a report of the most expensive templates and the duration histograms"""
+        costs = sorted(self.costs().items(), key=lambda item: item[1].total_seconds, reverse=True)
+        lines = [f"Render cost of the last {len(self.loops)} loops, top {min(top, len(costs))} "
+                 f"of {len(costs)} templates and scopes:"]
+        for (template, scope), cost in costs[:top]:
+            lines.append(f"  {template} ({scope}): {cost.total_seconds:.3f}s, "
+                         f"compile {cost.compile_seconds:.3f}s, render {cost.render_seconds:.3f}s, "
+                         f"parse {cost.parse_seconds:.3f}s, {cost.renders} renders, {cost.reused} reused, "
+                         f"{cost.output_chars} characters, {cost.items} items")
+        for phase in PHASES:
+            counts = list(self.histograms[phase])
+            buckets = [f"<={bound}s: {count}" for bound, count in zip(DURATION_BUCKETS, counts)]
+            buckets.append(f">{DURATION_BUCKETS[-1]}s: {counts[-1]}")
+            lines.append(f"  {phase} durations: {', '.join(buckets)}")
+        return lines
+
+    def log_report(self, top=10, level=logging.INFO):
+        LOG.log(level, "\n".join(self.report(top)))
+
+
+profiler = RenderProfiler()
@@ -0,0 +1,115 @@
+import logging
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from types import SimpleNamespace
+
+from vcenter_operator.phelm import DeploymentState
+from vcenter_operator.profiler import profiler
+from vcenter_operator.templates import TemplateBytecodeCache, env, vcenter_service_user_crd_loader
+
+LOG = logging.getLogger(__name__)
+
+
+def _init_worker(template_mapping, service_user_mapping, log_level, bytecode_cache_dir=None):
+    """Set up a worker process with the templates, shipped once per pool"""
+    logging.basicConfig(
+        level=log_level,
+        format='%(asctime)-15s %(process)d %(levelname)s %(name)s %(message)s')
+    if bytecode_cache_dir:
+        # The workers are replaced when the templates change, so they compile unchanged ones only once
+        env.bytecode_cache = TemplateBytecodeCache(bytecode_cache_dir)
+    env.loaders[0].mapping = template_mapping
+    vcenter_service_user_crd_loader.mapping = service_user_mapping
+
+
+def _render_job(settings, scope, options, service_users, vcenter_service_user_tracker):
+    """Render the templates of the scope in a worker process and return the stored items and failed templates"""
+    tracker = defaultdict(lambda: defaultdict(dict))
+    for cr_name, hosts in vcenter_service_user_tracker.items():
+        tracker[cr_name].update(hosts)
+
+    applyset_id = settings.pop('applyset_id')
+    # Only the id of the ApplySet is needed to label the items
+    state = DeploymentState(applyset=SimpleNamespace(id=applyset_id) if applyset_id else None, **settings)
+    profiler.reset()
+    state.render(scope, options, service_users, tracker)
+    return list(state.items.items()), state.failed, profiler.current, profiler.histograms
+
+
+class RenderPool:
+    """Renders the (scope, options) jobs of a vCenter in parallel worker processes
+
+    The workers are started with the current templates and get replaced when the templates change,
+    so the template sources are only shipped once per resourceVersion. The rendered items are
+    returned as StoredItem, i.e. as their serialized and optionally compressed payload.
+    """
+
+    def __init__(self, processes):
+        self.processes = processes
+        self.executor = None
+        self.versions = None
+
+    def _get_executor(self):
+        template_mapping = env.loaders[0].get_mapping()
+        service_user_mapping = vcenter_service_user_crd_loader.get_mapping()
+        versions = (
+            {path: version for path, (version, *_) in template_mapping.items()},
+            {name: version for name, (version, *_) in service_user_mapping.items()},
+        )
+        if self.executor is not None and versions == self.versions:
+            return self.executor
+
+        self.shutdown()
+        LOG.info("Starting %d render processes for %d templates", self.processes, len(template_mapping))
+        # Not forking, the parent runs threads
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(template_mapping, service_user_mapping, logging.getLogger().getEffectiveLevel(),
+                      env.bytecode_cache.directory if env.bytecode_cache else None),
+        )
+        self.versions = versions
+        return self.executor
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def render(self, state, jobs, service_users, vcenter_service_user_tracker):
+        """Render the (scope, options) jobs into the state, in the order of the jobs"""
+        executor = self._get_executor()
+        settings = {
+            'compress': state.compress,
+            'vcenter': state.vcenter,
+            'applyset_id': state.applyset.id if state.applyset else None,
+        }
+        tracker = {cr_name: dict(hosts) for cr_name, hosts in vcenter_service_user_tracker.items()}
+        try:
+            futures = [executor.submit(_render_job, dict(settings), scope, options, service_users, tracker)
+                       for scope, options in jobs]
+        except BrokenProcessPool:
+            futures = []
+        broken = len(futures) < len(jobs)
+        for i, (scope, options) in enumerate(jobs):
+            if not broken:
+                try:
+                    items, failed, costs, histograms = futures[i].result()
+                except BrokenProcessPool:
+                    broken = True
+                else:
+                    state.failed.update(failed)
+                    profiler.merge(costs, histograms)
+                    for _id, stored in items:
+                        state.add_stored(_id, stored)
+                    continue
+            # Rather render the rest here than not at all, a pool with a dead worker takes no more jobs
+            state.render(scope, options, service_users, vcenter_service_user_tracker)
+
+        if broken:
+            LOG.warning("A render process died, rendered the jobs of %s in the operator process instead, "
+                        "starting new render processes next time", state.vcenter)
+            self.shutdown()
@@ -0,0 +1,179 @@
+import datetime
+import json
+import logging
+import threading
+import time
+
+from kubernetes import client as k8s_client
+
+LOG = logging.getLogger(__name__)
+
+OPENAPI_V3_PATH = "/openapi/v3"
+REF_PREFIX = "#/components/schemas/"
+# Errors reported per item, the first ones are usually enough to find the problem in the template
+MAX_ERRORS = 10
+# Seconds after which a schema not available is fetched again, as well as the index missing its group version
+RETRY_INTERVAL = 5 * 60
+
+_TYPES = {
+    'object': dict,
+    'array': list,
+    # YAML parses timestamps to datetime objects, they are serialized as strings
+    'string': (str, datetime.date),
+    'boolean': bool,
+    'integer': int,
+    'number': (int, float),
+}
+
+
+def _group_version_path(api_version):
+    return f"apis/{api_version}" if '/' in api_version else f"api/{api_version}"
+
+
+class SchemaCache:
+    """OpenAPI v3 schemas of the kinds we apply, fetched once per group version from the API server,
+    or again after RETRY_INTERVAL if not available
+
+    Validates rendered items locally, so invalid ones can be reported per template instead of
+    being rejected by the API server with a 422. The validation covers what the API server would
+    reject for sure: wrong types, missing required fields and values not in an enum.
+    Unknown fields are ignored, as the server drops them without failing.
+    """
+
+    def __init__(self, get_client):
+        self.get_client = get_client
+        self.paths = None
+        self.paths_fetched = None
+        # Components per group version path
+        self.components = {}
+        # Time of the last failed fetch per group version path, retried after RETRY_INTERVAL
+        self.unavailable = {}
+        # Name of the schema per (api_version, kind), None if not available
+        self.schema_names = {}
+        self._lock = threading.Lock()
+
+    def _get(self, path):
+        resp = self.get_client().request('get', path, serialize=False)
+        return json.loads(resp.data)
+
+    def _load_components(self, api_version):
+        path = _group_version_path(api_version)
+        if path in self.components:
+            return self.components[path]
+        now = time.monotonic()
+        if path in self.unavailable and now - self.unavailable[path] < RETRY_INTERVAL:
+            return None
+
+        components = None
+        try:
+            if self.paths is None or (path not in self.paths and now - self.paths_fetched >= RETRY_INTERVAL):
+                # Group versions served since the last fetch, e.g. of a new CRD, are only in a fresh index
+                self.paths = self._get(OPENAPI_V3_PATH).get('paths') or {}
+                self.paths_fetched = now
+            url = (self.paths.get(path) or {}).get('serverRelativeURL')
+            if url:
+                components = self._get(url).get('components', {}).get('schemas') or {}
+        except (k8s_client.rest.ApiException, ValueError) as e:
+            LOG.warning("Could not fetch the OpenAPI schema of %s, not validating it: %s", api_version, e)
+
+        if components is None:
+            self.unavailable[path] = now
+        else:
+            self.components[path] = components
+            self.unavailable.pop(path, None)
+        return components
+
+    def _schema_name(self, api_version, kind, components):
+        group, _, version = api_version.rpartition('/')
+        for name, schema in components.items():
+            for gvk in schema.get('x-kubernetes-group-version-kind') or []:
+                if gvk.get('group', '') == group and gvk.get('version') == version and gvk.get('kind') == kind:
+                    return name
+        return None
+
+    def validate(self, item):
+        """Return the validation errors of the item, empty if valid or if no schema is known for its kind"""
+        api_version, kind = item.get('apiVersion'), item.get('kind')
+        if not api_version or not kind:
+            return ["apiVersion and kind are required"]
+
+        with self._lock:
+            components = self._load_components(api_version)
+            if not components:
+                return []
+            key = (api_version, kind)
+            if key not in self.schema_names:
+                self.schema_names[key] = self._schema_name(api_version, kind, components)
+            name = self.schema_names[key]
+
+        if name is None:
+            return []
+
+        errors = []
+        _validate(item, components[name], components, "", errors)
+        return errors[:MAX_ERRORS]
+
+
+def _resolve(schema, components):
+    while True:
+        if '$ref' in schema:
+            schema = components.get(schema['$ref'][len(REF_PREFIX):], {})
+        # References with siblings are wrapped in allOf by the API server
+        elif len(schema.get('allOf') or []) == 1 and 'type' not in schema and 'properties' not in schema:
+            schema = schema['allOf'][0]
+        else:
+            return schema
+
+
+def _is_int_or_string(schema):
+    """Whether the schema is an IntOrString, as published for built-in types (format, or oneOf if the API server
+       emits it) or for CRDs (extension). The format alone may come with type string, which must not be checked.
+    """
+    if schema.get('x-kubernetes-int-or-string') or schema.get('format') == 'int-or-string':
+        return True
+    types = {one.get('type') for one in schema.get('oneOf') or []}
+    return types == {'integer', 'string'}
+
+
+def _validate(value, schema, components, path, errors):
+    if len(errors) >= MAX_ERRORS:
+        return
+    schema = _resolve(schema, components)
+
+    if value is None:
+        # null is dropped by the API server unless it is a required field
+        return
+    if _is_int_or_string(schema):
+        if not isinstance(value, (int, str)) or isinstance(value, bool):
+            errors.append(f"{path or '.'}: expected integer or string, got {type(value).__name__}")
+        return
+
+    expected = schema.get('type')
+    if expected in _TYPES:
+        valid = isinstance(value, _TYPES[expected])
+        # bool is an int in Python, but not in JSON
+        if expected in ('integer', 'number') and isinstance(value, bool):
+            valid = False
+        if not valid:
+            errors.append(f"{path or '.'}: expected {expected}, got {type(value).__name__}")
+            return
+
+    if 'enum' in schema and value not in schema['enum']:
+        errors.append(f"{path or '.'}: {value!r} is not one of {schema['enum']}")
+
+    if isinstance(value, dict):
+        if schema.get('x-kubernetes-preserve-unknown-fields'):
+            return
+        for field in schema.get('required') or []:
+            if field not in value:
+                errors.append(f"{path}.{field}: required field missing")
+        properties = schema.get('properties') or {}
+        additional = schema.get('additionalProperties')
+        for field, field_value in value.items():
+            if field in properties:
+                _validate(field_value, properties[field], components, f"{path}.{field}", errors)
+            elif isinstance(additional, dict):
+                _validate(field_value, additional, components, f"{path}.{field}", errors)
+    elif isinstance(value, list) and 'items' in schema:
+        for i, element in enumerate(value):
+            _validate(element, schema['items'], components, f"{path}[{i}]", errors)
@@ -1,9 +1,23 @@
 import base64
 import hashlib
+import json
 import logging
+import threading
 
+import attr
 import urllib3.exceptions
-from jinja2 import BaseLoader, ChoiceLoader, Environment, TemplateNotFound, pass_context
+from jinja2 import (
+    BaseLoader,
+    ChoiceLoader,
+    Environment,
+    FileSystemBytecodeCache,
+    TemplateError,
+    TemplateNotFound,
+    meta,
+    nodes,
+    pass_context,
+)
+from jinja2.bccache import Bucket
 from kubernetes import client
 from masterpassword.masterpassword import MasterPassword
 
@@ -69,22 +83,13 @@ def _b64enc(data):
     return base64.b64encode(data).decode('utf-8')
 
 
-_SAVED_DEFAULTS = {}
+# Size of the compiled template cache of each overlay environment
+OVERLAY_CACHE_SIZE = 400
 
-
-def restore_defaults(env):
-    global _SAVED_DEFAULTS
-    for k in _SAVED_DEFAULTS:
-        setattr(env, k, _SAVED_DEFAULTS[k])
-    _SAVED_DEFAULTS.clear()
-
-
-def store_default(env, k):
-    global _SAVED_DEFAULTS
-    if k in _SAVED_DEFAULTS:
-        return
-
-    _SAVED_DEFAULTS[k] = getattr(env, k)
+# Variables of the context read by filters taking the context
+CONTEXT_FILTER_VARIABLES = {
+    'derive_password': frozenset({'username', 'host', 'master_password'}),
+}
 
 
 def _owner_from_obj(item):
@@ -124,6 +129,39 @@ def _create_or_patch_crd(crd: client.V1CustomResourceDefinition):
             LOG.exception("Failed to create custom resource definition %s", name)
 
 
+class TemplateBytecodeCache(FileSystemBytecodeCache):
+    """Keeps the compiled templates in a directory, e.g. an emptyDir, so they are not compiled again after a restart.
+
+    The bytecode is keyed by the name and source of the template and the jinja2_options of the environment compiling
+    it, as the same source compiles differently e.g. with other delimiters.
+    """
+
+    def get_bucket(self, environment, name, filename, source):
+        options = getattr(environment, 'options_key', '')
+        key = self.get_source_checksum(f"{name}\0{options}\0{source}")
+        bucket = Bucket(environment, key, key)
+        self.load_bytecode(bucket)
+        return bucket
+
+
+@attr.s(frozen=True, slots=True)
+class TemplateDependencies:
+    """What the output of a template depends on, besides the filters and globals of the environment"""
+    # Names of the variables of the context referenced, None if the template can read any of them
+    variables = attr.ib()
+    # Sorted (path, version) of the template and the templates it includes, imports or renders
+    versions = attr.ib()
+
+
+@attr.s(frozen=True, slots=True)
+class TemplateIndex:
+    """Lookup tables of the templates of a mapping, built once per mapping"""
+    # path -> (jinja2_options, owner)
+    by_path = attr.ib(factory=dict)
+    # scope, e.g. vcenter_cluster -> [(path, jinja2_options, owner)] sorted by path
+    by_scope = attr.ib(factory=dict)
+
+
 class PollingLoader(BaseLoader):
     API_GROUP = 'vcenter-operator.stable.sap.cc'
 
@@ -131,6 +169,33 @@ class PollingLoader(BaseLoader):
         self.mapping = {}
         self._crd = None
 
+    @property
+    def mapping(self):
+        return self._mapping
+
+    @mapping.setter
+    def mapping(self, mapping):
+        # Any change of a template changes its resourceVersion, so the versions tell if the mapping changed
+        versions = {path: version for path, (version, *_) in mapping.items()}
+        self._mapping = mapping
+        if versions == getattr(self, '_versions', None):
+            # Polling sets a new mapping every time, mostly an unchanged one
+            return
+        self._versions = versions
+        self._index = None
+        # Counts the changes of the mapping, so indexes built from it can tell if they are outdated
+        self.generation = getattr(self, 'generation', 0) + 1
+
+    def template_index(self):
+        """Return the index of the templates, built on first use after the mapping changed"""
+        index = self._index
+        if index is None:
+            index = self._index = self._build_index(self._mapping)
+        return index
+
+    def _build_index(self, mapping):
+        return TemplateIndex()
+
     def poll(self):
         raise NotImplementedError()
 
@@ -148,14 +213,8 @@ class VCenterTemplateCRDLoader(PollingLoader):
 
     def get_source(self, environment, template):
         if template in self.mapping:
+            # The jinja2_options are applied by K8sEnvironment, which compiles the template in an overlay
             version, source, jinja2_options, owner = self.mapping[template]
-            restore_defaults(environment)
-
-            for k in jinja2_options:
-                if hasattr(environment, k):
-                    store_default(environment, k)
-                    setattr(environment, k, jinja2_options[k])
-
             return source, None, lambda: \
                 template in self.mapping and \
                 (version, source, jinja2_options, owner) == self.mapping.get(template)
@@ -168,6 +227,17 @@ class VCenterTemplateCRDLoader(PollingLoader):
         _, _, _, owner = self.mapping[template_name]
         return owner
 
+    def _build_index(self, mapping):
+        index = TemplateIndex()
+        for path in sorted(mapping):
+            _, _, jinja2_options, owner = mapping[path]
+            index.by_path[path] = (jinja2_options, owner)
+            if path.endswith('.yaml.j2'):
+                # e.g. vcenter_cluster/namespace/cr-name.yaml.j2
+                scope = path.split('/', 1)[0]
+                index.by_scope.setdefault(scope, []).append((path, jinja2_options, owner))
+        return index
+
     def _read_options_v1(self, item):
         options = {
             'scope': item['metadata']['scope'],
@@ -384,12 +454,146 @@ class VCenterServiceUserCRDLoader(PollingLoader):
 
 
 class K8sEnvironment(Environment):
+    """Environment loading the templates from the cluster.
+
+    Templates with jinja2_options are compiled and cached in an overlay of the environment per set of options,
+    so the shared environment is never changed and templates can be rendered concurrently.
+    """
+
     def __init__(self):
         self.loaders = [
             VCenterTemplateCRDLoader(),
         ]
+        self.overlays = {}
+        self._overlays_lock = threading.Lock()
+        self._index = (None, TemplateIndex())
+        # path -> TemplateDependencies
+        self._dependencies = {}
         super().__init__(loader=ChoiceLoader(self.loaders))
 
+    def template_index(self):
+        """Return the index of the templates of all loaders, rebuilt only if the mapping of one changed"""
+        root = self.linked_to if self.overlayed else self
+        generations = tuple(loader.generation for loader in root.loaders)
+        built_for, index = root._index
+        if built_for == generations:
+            return index
+
+        if len(root.loaders) == 1:
+            index = root.loaders[0].template_index()
+        else:
+            # The first loader having a template wins, like in the ChoiceLoader
+            index = TemplateIndex()
+            for loader in root.loaders:
+                for path, info in loader.template_index().by_path.items():
+                    index.by_path.setdefault(path, info)
+            for path in sorted(index.by_path):
+                if path.endswith('.yaml.j2'):
+                    index.by_scope.setdefault(path.split('/', 1)[0], []).append((path, *index.by_path[path]))
+        root._index = (generations, index)
+        return index
+
+    def list_scope_templates(self, scope):
+        """Return (path, jinja2_options, owner) of the templates of the scope, sorted by path"""
+        return self.template_index().by_scope.get(scope, [])
+
+    def _environment_options(self, jinja2_options):
+        """Return the options applying to the environment, e.g. variable_start_string"""
+        return {k: v for k, v in (jinja2_options or {}).items() if hasattr(self, k)}
+
+    def environment_for(self, name):
+        """Return the environment to compile the template with, an overlay if it has jinja2_options"""
+        root = self.linked_to if self.overlayed else self
+        options = root._environment_options(root.get_jinja2_options(name))
+        if not options:
+            return root
+
+        key = json.dumps(options, sort_keys=True, default=repr)
+        with root._overlays_lock:
+            overlay = root.overlays.get(key)
+            if overlay is None:
+                overlay = root.overlay(cache_size=OVERLAY_CACHE_SIZE)
+                for k, v in options.items():
+                    setattr(overlay, k, v)
+                # Part of the key of the bytecode of the templates compiled by the overlay
+                overlay.options_key = key
+                root.overlays[key] = overlay
+        return overlay
+
+    def get_template(self, name, parent=None, globals=None):
+        if isinstance(name, str):
+            if parent is not None:
+                name = self.join_path(name, parent)
+            environment = self.environment_for(name)
+            if environment is not self:
+                return environment.get_template(name, globals=globals)
+        return super().get_template(name, globals=globals)
+
+    def template_version(self, name):
+        """Return the version of the template, None if no loader has it"""
+        root = self.linked_to if self.overlayed else self
+        for loader in root.loaders:
+            if name in loader.mapping:
+                return loader.mapping[name][0]
+        return None
+
+    def template_dependencies(self, name):
+        """Return the TemplateDependencies of the template, None if they cannot be determined.
+           They are found by parsing the template, and kept as long as the versions of the templates are the same.
+        """
+        root = self.linked_to if self.overlayed else self
+        dependencies = root._dependencies.get(name)
+        if dependencies is not None and \
+                all(root.template_version(path) == version for path, version in dependencies.versions):
+            return dependencies
+
+        variables = set()
+        versions = {}
+        try:
+            root._find_dependencies(name, variables, versions)
+        except TemplateError:
+            LOG.debug("Cannot determine the dependencies of %s", name, exc_info=True)
+            return None
+        dependencies = TemplateDependencies(
+            None if None in variables else frozenset(variables),
+            tuple(sorted(versions.items())),
+        )
+        root._dependencies[name] = dependencies
+        return dependencies
+
+    def _find_dependencies(self, name, variables, versions):
+        """Add the variables referenced by the template and the versions of the templates it uses.
+           None is added to the variables if the template can read any variable, e.g. through context().
+        """
+        versions[name] = self.template_version(name)
+        environment = self.environment_for(name)
+        source, _, _ = self.loader.get_source(self, name)
+        ast = environment.parse(source, name)
+
+        variables.update(meta.find_undeclared_variables(ast))
+        # The global context() returns the whole context
+        if any(node.name == 'context' for node in ast.find_all(nodes.Name)):
+            variables.add(None)
+
+        used = []
+        for template_name in meta.find_referenced_templates(ast):
+            if template_name is None:
+                # Only known when rendering
+                variables.add(None)
+            else:
+                used.append(template_name)
+        for node in ast.find_all(nodes.Filter):
+            variables.update(CONTEXT_FILTER_VARIABLES.get(node.name, ()))
+            if node.name == 'render':
+                if isinstance(node.node, nodes.Const) and isinstance(node.node.value, str):
+                    used.append(node.node.value)
+                else:
+                    variables.add(None)
+
+        for template_name in used:
+            if template_name not in versions:
+                self._find_dependencies(template_name, variables, versions)
+
     def poll_loaders(self):
         all = True
         for loader in self.loaders:
@@ -401,16 +605,12 @@ class K8sEnvironment(Environment):
         return all
 
     def get_source_owner(self, template_name):
-        for loader in self.loaders:
-            owner = loader.get_source_owner(template_name)
-            if owner:
-                return owner
-        return None
+        info = self.template_index().by_path.get(template_name)
+        return info[1] if info else None
 
     def get_jinja2_options(self, path):
-        for loader in self.loaders:
-            if path in loader.mapping:
-                return loader.mapping[path][2]
+        info = self.template_index().by_path.get(path)
+        return info[0] if info else None
 
 
 env = K8sEnvironment()
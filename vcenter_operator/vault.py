@@ -1,6 +1,8 @@
 import logging
 import string
+import threading
 import time
+from collections import deque
 from datetime import datetime, timedelta
 from functools import wraps
 
@@ -10,6 +12,8 @@ LOG = logging.getLogger(__name__)
 
 EXPIRY_DAYS = 365
 RENEW_MARGIN_SECONDS = 5 * 60
+REPLICATION_BACKOFF_SECONDS = 30
+REPLICATION_MAX_BACKOFF_SECONDS = 10 * 60
 
 
 class VaultUnavailableError(Exception):
@@ -21,6 +25,152 @@ class VaultSecretNotReplicatedError(Exception):
     pass
 
 
+def latest_secret_version(metadata):
+    """Return the latest not deleted version in the given secret metadata, 0 if there is none"""
+    versions = metadata['data']['versions']
+    return max(
+        (int(version) for version, meta in versions.items() if not meta.get("deletion_time")),
+        default=0
+    )
+
+
+class ReplicationTracker:
+    """Coalesces replication triggers per path and follows them until the read mount point caught up
+
+    A path stays pending until the read mount point has at least the expected version.
+    While pending, replication is only triggered again after an exponential backoff.
+    """
+
+    def __init__(self, vault, backoff=REPLICATION_BACKOFF_SECONDS, max_backoff=REPLICATION_MAX_BACKOFF_SECONDS):
+        self.vault = vault
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pending = {}
+
+    def request(self, path, service_type=None, version=None):
+        """Trigger the replication of the path, unless the last trigger is still within its backoff.
+           Returns True if the replication got triggered.
+        """
+        entry = self.pending.get(path)
+        if entry is None:
+            entry = self.pending[path] = {"service_type": service_type, "version": None, "attempts": 0,
+                                          "next_trigger": 0}
+        if version is not None:
+            entry["version"] = max(entry["version"] or 0, int(version))
+
+        now = time.time()
+        if now < entry["next_trigger"]:
+            LOG.debug("Replication of %s is already pending (attempt %d) - not triggering it again",
+                      path, entry["attempts"])
+            return False
+
+        self.vault.trigger_replicate(path, entry["service_type"])
+        entry["attempts"] += 1
+        entry["next_trigger"] = now + min(self.backoff * 2 ** (entry["attempts"] - 1), self.max_backoff)
+        return True
+
+    def is_pending(self, path):
+        return path in self.pending
+
+    def is_replicated(self, path):
+        """Poll the read mount point metadata and stop tracking the path once its version caught up.
+           Triggers the replication again if the backoff expired.
+        """
+        entry = self.pending.get(path)
+        if entry is None:
+            return True
+
+        version = entry["version"]
+        if version is None:
+            metadata_write = self.vault.get_metadata(path, read=False, service_type=entry["service_type"])
+            version = latest_secret_version(metadata_write) if metadata_write else 0
+
+        metadata_read = self.vault.get_metadata(path, read=True)
+        if metadata_read and latest_secret_version(metadata_read) >= version:
+            LOG.info("Service-user of path %s got replicated after %d trigger(s)", path, entry["attempts"])
+            self.done(path)
+            return True
+
+        self.request(path)
+        return False
+
+    def done(self, path):
+        """Stop tracking the replication of the path"""
+        self.pending.pop(path, None)
+
+
+class PasswordPool:
+    """Bounded in-memory pool of passwords prefetched from vault in the background
+
+    Every password in the pool was generated for the constraints stored alongside the pool,
+    any change of the constraints drains it.
+    """
+
+    def __init__(self, generate, size=0):
+        self.generate = generate
+        self.size = size
+        self.constraints = None
+        self.passwords = deque()
+        self._lock = threading.Lock()
+        self._filler = None
+
+    def drain(self):
+        """Drop all prefetched passwords"""
+        with self._lock:
+            self.passwords.clear()
+            self.constraints = None
+
+    def get(self, constraints):
+        """Return a prefetched password for the given constraints or None if there is none"""
+        with self._lock:
+            if constraints != self.constraints:
+                self.passwords.clear()
+                self.constraints = None
+            return self.passwords.popleft() if self.passwords else None
+
+    def fill(self, constraints):
+        """Top up the pool in a background thread, unless one is already running"""
+        if self.size <= 0 or not constraints:
+            return
+
+        with self._lock:
+            if constraints != self.constraints:
+                self.passwords.clear()
+                self.constraints = dict(constraints)
+            if len(self.passwords) >= self.size:
+                return
+            if self._filler and self._filler.is_alive():
+                return
+            self._filler = threading.Thread(target=self._fill, name="vault-password-pool", daemon=True)
+            self._filler.start()
+
+    def join(self, timeout=None):
+        """Wait for a running background fill to finish"""
+        filler = self._filler
+        if filler:
+            filler.join(timeout)
+
+    def _fill(self):
+        while True:
+            with self._lock:
+                constraints = self.constraints
+                if not constraints or len(self.passwords) >= self.size:
+                    return
+
+            try:
+                password = self.generate(constraints)
+            except Exception as e:
+                LOG.warning("Failed to prefetch password from vault: %s", e)
+                return
+
+            with self._lock:
+                # The constraints may have changed while waiting for vault
+                if constraints != self.constraints:
+                    continue
+                if len(self.passwords) < self.size:
+                    self.passwords.append(password)
+
+
 class Vault:
     def __init__(self, dry_run=False):
         self.dry_run = dry_run
@@ -31,6 +181,8 @@ class Vault:
         self.next_renew = None
         self.approle = None
         self.password_constraints = None
+        self.password_pool = PasswordPool(self._request_password)
+        self.replication = ReplicationTracker(self)
 
     def require_vault_parameters(fn):
         @wraps(fn)
@@ -70,6 +222,16 @@ class Vault:
     def set_password_constraints(self, password_constraints):
         """Set the password constraints for vault instance"""
         self.password_constraints = password_constraints
+        self.password_pool.drain()
+
+    def set_password_pool_size(self, size):
+        """Set the number of passwords to prefetch from vault, 0 disables prefetching"""
+        self.password_pool.size = size
+
+    def fill_password_pool(self):
+        """Start prefetching passwords for the current password constraints in the background"""
+        if self.token:
+            self.password_pool.fill(self.password_constraints)
 
     def _get_headers(self):
         """Helper method to generate headers for vault requests"""
@@ -182,7 +344,7 @@ class Vault:
 
         version = self.store_service_user_credentials(username, password, path, service_type)
 
-        self.trigger_replicate(path, service_type)
+        self.replication.request(path, service_type, version)
 
         return version, username, password
 
@@ -193,11 +355,21 @@ class Vault:
         - length: total length of the password
         - digits: number of digits
         - symbols: number of symbols
+        Takes a prefetched password from the pool if there is one.
         """
+        password = self.password_pool.get(self.password_constraints)
+        if not password:
+            password = self._request_password(self.password_constraints)
+
+        self.password_pool.fill(self.password_constraints)
+        return password
+
+    def _request_password(self, password_constraints):
+        """Request a new password with the given constraints from vault"""
         metadata = {
-            "length": self.password_constraints["length"],
-            "digits": self.password_constraints["digits"],
-            "symbols": self.password_constraints["symbols"],
+            "length": password_constraints["length"],
+            "digits": password_constraints["digits"],
+            "symbols": password_constraints["symbols"],
         }
 
         headers = self._get_headers()
@@ -1,5 +1,8 @@
 import logging
 import time
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+from datetime import datetime
 
 import pyVmomi
 from pyVim import sso
@@ -7,17 +10,47 @@ from pyvmomi_extended import SSO_VERSION
 
 LOG = logging.getLogger(__name__)
 
+# Requested lifetime of the SAML bearer token, the STS may cap it by its policy
+SAML_TOKEN_DURATION = 60 * 60
+SAML_TOKEN_RENEW_MARGIN_SECONDS = 60
+# Log in again with a new session before the SSO admin session may time out
+SESSION_RENEW_SECONDS = 20 * 60
+# Faults telling that the session or token is not valid anymore, everything else keeps the session
+AUTHENTICATION_FAULTS = {"NotAuthenticated", "InvalidCredentials", "InvalidPrincipal", "InvalidLogin",
+                         "SecurityError", "RequestExpired"}
+SAML_NAMESPACE = "urn:oasis:names:tc:SAML:2.0:assertion"
+
 
 class SSOSkippedError(Exception):
     """Exception to skip SSO connection attempts"""
     pass
 
 
+def _is_authentication_fault(e):
+    """Check if the exception is a fault about the authentication of the session"""
+    # pyVmomi names its fault types like vim.fault.NotAuthenticated
+    return any(cls.__name__.rsplit(".", 1)[-1] in AUTHENTICATION_FAULTS for cls in type(e).__mro__)
+
+
+def _saml_token_expiry(saml_token):
+    """Return the NotOnOrAfter time of the SAML assertion as timestamp, None if it cannot be determined"""
+    try:
+        conditions = ET.fromstring(saml_token).find(f".//{{{SAML_NAMESPACE}}}Conditions")
+        not_on_or_after = conditions.get("NotOnOrAfter")
+        return datetime.fromisoformat(not_on_or_after.replace("Z", "+00:00")).timestamp()
+    except (ET.ParseError, AttributeError, TypeError, ValueError) as e:
+        LOG.debug("Could not determine the expiry of the SAML token: %s", e)
+        return None
+
+
 class VCenterSSO:
     def __init__(self, dry_run=False):
         self.dry_run = dry_run
-        self.saml_token = None
+        # SAML bearer token and its expiry per host, reused for logins while valid
+        self.saml_tokens = dict()
         self.sso_admin_instances = dict()
+        # Principal ids of the service-users per host, saves a lookup before changing group memberships
+        self.principal_ids = defaultdict(dict)
         self.ad_ttu_username = None
         self.ad_ttu_password = None
         self.domain = "vsphere.local"
@@ -28,13 +61,46 @@ class VCenterSSO:
         self.ad_ttu_password = password
         # Reset the SSO instances to ensure they are reconnected with the new credentials
         self.sso_admin_instances = dict()
+        self.saml_tokens = dict()
+        self.principal_ids.clear()
 
     def _get_api_instance(self, host):
         """Ensure connection to the SSO instance and return the API instance."""
         if host not in self.sso_admin_instances or not self.sso_admin_instances[host]["api"]:
             self.connect(host)
+        elif self.sso_admin_instances[host]["login_time"] + SESSION_RENEW_SECONDS < time.time():
+            LOG.debug("Renewing SSO session to %s", host)
+            try:
+                self.connect(host)
+            except SSOSkippedError:
+                LOG.warning("Renewing SSO session to %s failed - continuing with the current session", host)
         return self.sso_admin_instances[host]["api"]
 
+    def _invalidate_on_authentication_fault(self, host, e):
+        """Drop the session and token of the host if the error is an authentication fault.
+           Other, possibly transient, errors keep the session.
+        """
+        if not _is_authentication_fault(e):
+            return
+
+        LOG.info("SSO session to %s is not authenticated anymore - reconnecting on next use", host)
+        self.sso_admin_instances.pop(host, None)
+        self.saml_tokens.pop(host, None)
+
+    def _get_saml_token(self, host):
+        """Return a valid SAML bearer token for the host, requesting a new one only if necessary"""
+        saml_token, expiry = self.saml_tokens.get(host, (None, 0))
+        if saml_token and time.time() < expiry - SAML_TOKEN_RENEW_MARGIN_SECONDS:
+            return saml_token
+
+        auth = sso.SsoAuthenticator(f"https://{host}/sts/STSService/{self.domain}")
+        saml_token = auth.get_bearer_saml_assertion(self.ad_ttu_username, self.ad_ttu_password,
+                                                    token_duration=SAML_TOKEN_DURATION, delegatable=True)
+        expiry = _saml_token_expiry(saml_token)
+        if expiry:
+            self.saml_tokens[host] = (saml_token, expiry)
+        return saml_token
+
     def connect(self, host):
         """Connect to the vCenter SSO instance"""
 
@@ -53,9 +119,7 @@ class VCenterSSO:
                     raise SSOSkippedError()
 
         try:
-            auth = sso.SsoAuthenticator(f"https://{host}/sts/STSService/{self.domain}")
-
-            saml_token = auth.get_bearer_saml_assertion(self.ad_ttu_username, self.ad_ttu_password, delegatable=True)
+            saml_token = self._get_saml_token(host)
 
             stub = pyVmomi.SoapStubAdapter(
                 host=host,
@@ -73,14 +137,18 @@ class VCenterSSO:
             stub.samlToken = None
 
             api = pyVmomi.sso.SsoAdminServiceInstance("SsoAdminServiceInstance", stub=stub).SsoAdminServiceInstance()
-            self.sso_admin_instances[host] = {"api": api, "retry": 0, "last_retry": time.time()}
+            self.sso_admin_instances[host] = {"api": api, "retry": 0, "last_retry": time.time(),
+                                              "login_time": time.time()}
         except Exception as e:
             LOG.error("Error connecting to vCenter SSO instance: %s", e)
+            if _is_authentication_fault(e):
+                self.saml_tokens.pop(host, None)
             if host in self.sso_admin_instances:
                 self.sso_admin_instances[host]["retry"] += 1
                 self.sso_admin_instances[host]["last_retry"] = time.time()
             else:
-                self.sso_admin_instances[host] = {"api": None, "retry": 0, "last_retry": time.time()}
+                self.sso_admin_instances[host] = {"api": None, "retry": 0, "last_retry": time.time(),
+                                                  "login_time": 0}
             LOG.debug(
                 "Failed to connect to SSO instance %s. Incrementing retry count to %s.",
                 host,
@@ -99,9 +167,10 @@ class VCenterSSO:
             )
             users = principal_discovery_service.FindUsers(criteria=criteria, limit=limit)
             user_names = [user.id.name for user in users]
+            self.principal_ids[host].update((user.id.name, user.id) for user in users)
         except Exception as e:
             LOG.error("Error listing service-users for host %s: %s", host, e)
-            del self.sso_admin_instances[host]
+            self._invalidate_on_authentication_fault(host, e)
             raise SSOSkippedError()
 
         return user_names
@@ -129,7 +198,7 @@ class VCenterSSO:
                 return False
         except Exception as e:
             LOG.error("Error checking service-users in Administrator group: %s", e)
-            del self.sso_admin_instances[host]
+            self._invalidate_on_authentication_fault(host, e)
             raise SSOSkippedError()
 
     def create_service_user(self, host, username, password, service):
@@ -149,50 +218,91 @@ class VCenterSSO:
             )
             if resp and resp.name and resp.name != "":
                 LOG.info("Successfully created service-user %s in vCenter %s.", resp.name, host)
+                self.principal_ids[host][resp.name] = resp
             else:
                 LOG.error("Failed to create service-user %s in vCenter %s.", username, host)
                 raise SSOSkippedError()
         except Exception as e:
             LOG.error("Error creating service-user: %s", e)
-            del self.sso_admin_instances[host]
+            self._invalidate_on_authentication_fault(host, e)
             raise SSOSkippedError()
 
     def add_user_to_group(self, host, username):
         """Add a service-user to the Administrators group in the vCenter via SSO instance"""
+        if not self.add_users_to_group(host, [username])[username]:
+            raise SSOSkippedError()
+
+    def _find_principal_id(self, api, host, username):
+        """Return the principal id of the service-user, looking it up only if not known yet"""
+        principal_id = self.principal_ids[host].get(username)
+        if principal_id:
+            return principal_id
+
+        principal_discovery_service = api.principalDiscoveryService
+        criteria = pyVmomi.sso.AdminPrincipalDiscoveryServiceSearchCriteria(
+            searchString=username, domain=self.domain
+        )
+        users = principal_discovery_service.FindUsers(criteria=criteria, limit=1)
+        if len(users) != 1:
+            LOG.error("User %s not found in vCenter %s", username, host)
+            return None
+        user = users[0]
+        if user.id.name != username:
+            LOG.error("Wrong User %s found in vCenter %s - not %s", user.id.name, host, username)
+            return None
+
+        self.principal_ids[host][username] = user.id
+        return user.id
+
+    def add_users_to_group(self, host, usernames):
+        """Add service-users to the Administrators group in the vCenter via SSO instance in one call.
+           Returns a dict of username to whether the user got added.
+        """
         api = self._get_api_instance(host)
+        results = {username: False for username in usernames}
 
         try:
-            principal_discovery_service = api.principalDiscoveryService
-            criteria = pyVmomi.sso.AdminPrincipalDiscoveryServiceSearchCriteria(
-                searchString=username, domain=self.domain
-            )
-            users = principal_discovery_service.FindUsers(criteria=criteria, limit=1)
-            if len(users) != 1:
-                LOG.error("User %s not found in vCenter %s", username, host)
-                raise SSOSkippedError()
-            user = users[0]
-            if user.id.name != username:
-                LOG.error("Wrong User %s found in vCenter %s - not %s", user.id.name, host, username)
-                raise SSOSkippedError()
+            principal_ids = {}
+            for username in results:
+                principal_id = self._find_principal_id(api, host, username)
+                if principal_id:
+                    principal_ids[username] = principal_id
         except Exception as e:
-            LOG.error("Error listing service-user %s for adding to Administrator group: %s", user.id.name, e)
+            LOG.error("Error listing service-users %s for adding to Administrator group: %s", usernames, e)
+            self._invalidate_on_authentication_fault(host, e)
             raise SSOSkippedError()
 
+        if not principal_ids:
+            return results
+
         try:
             principal_management_service = api.principalManagementService
             if self.dry_run:
-                LOG.debug("Dry-run: Would have added service-user %s to group in vcenter", username, host)
-                return
-            resp = principal_management_service.AddUsersToLocalGroup(userIds=[user.id], groupName="Administrators")
-            if len(resp) == 1 and resp[0]:
+                LOG.debug("Dry-run: Would have added service-users %s to group in vcenter %s",
+                          list(principal_ids), host)
+                results.update((username, True) for username in principal_ids)
+                return results
+            resp = principal_management_service.AddUsersToLocalGroup(
+                userIds=list(principal_ids.values()), groupName="Administrators"
+            )
+        except Exception as e:
+            LOG.error("Error adding service-users %s to Administrator group: %s", list(principal_ids), e)
+            self._invalidate_on_authentication_fault(host, e)
+            raise SSOSkippedError()
+
+        if len(resp) != len(principal_ids):
+            LOG.error("Unexpected response adding service-users %s to Administrator group in vCenter %s: %s",
+                      list(principal_ids), host, resp)
+            return results
+
+        for username, added in zip(principal_ids, resp):
+            results[username] = bool(added)
+            if added:
                 LOG.info("Successfully added service-user %s to Administrator group in vCenter %s.", username, host)
             else:
                 LOG.error("Failed to add service-user %s to Administrator group in vCenter %s.", username, host)
-                raise SSOSkippedError()
-        except Exception as e:
-            LOG.error("Error adding service-user to Administrator group for user %s: %s", username, e)
-            del self.sso_admin_instances[host]
-            raise SSOSkippedError()
+
+        return results
 
     def delete_service_user(self, host, username):
         """Delete a service-user in the vCenter via SSO instance"""
@@ -205,8 +315,9 @@ class VCenterSSO:
 
             principal_management_service = api.principalManagementService
             principal_management_service.DeleteLocalPrincipal(principalName=username)
+            self.principal_ids[host].pop(username, None)
             LOG.info("Successfully deleted service-user %s in vCenter %s.", username, host)
         except Exception as e:
             LOG.error("Error deleting service-user: %s", e)
-            del self.sso_admin_instances[host]
+            self._invalidate_on_authentication_fault(host, e)
             raise SSOSkippedError()